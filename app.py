@@ -1,55 +1,209 @@
 import os
 import logging
+import time
 from flask import Flask
 from flask_sqlalchemy import SQLAlchemy
 from flask_login import LoginManager
 from sqlalchemy.orm import DeclarativeBase
 from werkzeug.middleware.proxy_fix import ProxyFix
+import broker
+import database
+import fragments
+import images
+import llm
+import metrics
+import notifications
 
-# Set up logging
-logging.basicConfig(level=logging.DEBUG)
+logger = logging.getLogger(__name__)
 
 class Base(DeclarativeBase):
     pass
 
-db = SQLAlchemy(model_class=Base)
+db = SQLAlchemy(model_class=Base, session_options={'class_': database.RoutingSession})
 
-# Create the app
-app = Flask(__name__)
-app.secret_key = os.environ.get("SESSION_SECRET", "your-secret-key-here")
-app.wsgi_app = ProxyFix(app.wsgi_app, x_proto=1, x_host=1)
-
-# Configure the database
-app.config["SQLALCHEMY_DATABASE_URI"] = os.environ.get("DATABASE_URL", "sqlite:///everchat.db")
-app.config["SQLALCHEMY_ENGINE_OPTIONS"] = {
-    "pool_recycle": 300,
-    "pool_pre_ping": True,
-}
-
-# Configure file uploads
-app.config['UPLOAD_FOLDER'] = 'uploads'
-app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB max file size
-
-# Initialize extensions
-db.init_app(app)
 login_manager = LoginManager()
-login_manager.init_app(app)
-login_manager.login_view = 'login'
+login_manager.login_view = 'main.login'
 login_manager.login_message = 'Please log in to access this page.'
 
 @login_manager.user_loader
 def load_user(user_id):
-    from models import User
-    return User.query.get(int(user_id))
+    import auth
+    return auth.load_user(int(user_id))
+
+def configure(app):
+    """Load settings from the environment, falling back to development defaults."""
+    # DEBUG logs every request and statement, so keep it for development
+    app.config['LOG_LEVEL'] = os.environ.get("LOG_LEVEL", "INFO").upper()
+    app.secret_key = os.environ.get("SESSION_SECRET", "your-secret-key-here")
+
+    # Configure the database; engine options are derived from these in database.configure_engines
+    app.config["SQLALCHEMY_DATABASE_URI"] = os.environ.get("DATABASE_URL", "sqlite:///everchat.db")
+    app.config['DB_POOL_SIZE'] = int(os.environ.get("DB_POOL_SIZE", 5))
+    app.config['DB_MAX_OVERFLOW'] = int(os.environ.get("DB_MAX_OVERFLOW", 10))
+    app.config['DB_POOL_TIMEOUT_SECONDS'] = float(os.environ.get("DB_POOL_TIMEOUT_SECONDS", 30))
+    # Views marked @use_replica read from here; writers stay on the primary for DB_REPLICA_STICKY_SECONDS
+    app.config['DATABASE_REPLICA_URL'] = os.environ.get("DATABASE_REPLICA_URL")
+    app.config['DB_REPLICA_POOL_SIZE'] = int(os.environ.get("DB_REPLICA_POOL_SIZE", app.config['DB_POOL_SIZE']))
+    app.config['DB_REPLICA_STICKY_SECONDS'] = float(os.environ.get("DB_REPLICA_STICKY_SECONDS", 5))
+    app.config['SQLITE_BUSY_TIMEOUT_MS'] = int(os.environ.get("SQLITE_BUSY_TIMEOUT_MS", 5000))
+    app.config['SQLITE_MMAP_SIZE'] = int(os.environ.get("SQLITE_MMAP_SIZE", 256 * 1024 * 1024))
+
+    # Configure file uploads
+    app.config['UPLOAD_FOLDER'] = 'uploads'
+    app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB max file size
+    app.config['UPLOAD_CACHE_MAX_AGE'] = int(os.environ.get("UPLOAD_CACHE_MAX_AGE", 31536000))
+    # "x-accel" (nginx) or "x-sendfile" (Apache/lighttpd) hands file bodies to the front proxy
+    app.config['UPLOAD_SENDFILE_MODE'] = os.environ.get("UPLOAD_SENDFILE_MODE", "").lower()
+    app.config['UPLOAD_ACCEL_PREFIX'] = os.environ.get("UPLOAD_ACCEL_PREFIX", "/protected-uploads/")
+    app.config['USE_X_SENDFILE'] = app.config['UPLOAD_SENDFILE_MODE'] == 'x-sendfile'
+    app.config['IMAGE_WORKERS'] = int(os.environ.get("IMAGE_WORKERS", 2))
+    app.config['IMAGE_MAX_PENDING'] = int(os.environ.get("IMAGE_MAX_PENDING", 64))
+
+    # Configure the home feed
+    app.config['FEED_PAGE_SIZE'] = int(os.environ.get("FEED_PAGE_SIZE", 20))
+    app.config['PROFILE_PAGE_SIZE'] = int(os.environ.get("PROFILE_PAGE_SIZE", 30))
+    app.config['COMMENT_PREVIEW_SIZE'] = int(os.environ.get("COMMENT_PREVIEW_SIZE", 3))
+
+    # Configure the post card cache; FRAGMENT_CACHE_URL (redis://) shares it between workers
+    app.config['FRAGMENT_CACHE_URL'] = os.environ.get("FRAGMENT_CACHE_URL")
+    app.config['FRAGMENT_CACHE_MAX_ENTRIES'] = int(os.environ.get("FRAGMENT_CACHE_MAX_ENTRIES", 5000))
+    app.config['FRAGMENT_CACHE_TTL'] = int(os.environ.get("FRAGMENT_CACHE_TTL", 86400))
+
+    # Configure the chat sidebar
+    app.config['CONVERSATION_PAGE_SIZE'] = int(os.environ.get("CONVERSATION_PAGE_SIZE", 30))
+    app.config['MESSAGE_PAGE_SIZE'] = int(os.environ.get("MESSAGE_PAGE_SIZE", 50))
+
+    # Configure real-time delivery (in-process unless a redis:// URL is given)
+    app.config['BROKER_URL'] = os.environ.get("BROKER_URL")
+    app.config['SSE_HEARTBEAT_SECONDS'] = int(os.environ.get("SSE_HEARTBEAT_SECONDS", 15))
+    app.config['SSE_MAX_STREAM_SECONDS'] = int(os.environ.get("SSE_MAX_STREAM_SECONDS", 300))
+    # Open streams per process (0 = unlimited); gunicorn.conf.py caps it when threads serve the streams
+    app.config['SSE_MAX_STREAMS'] = int(os.environ.get("SSE_MAX_STREAMS", 0))
+
+    # Configure SOS proximity lookups
+    app.config['SOS_RADIUS_KM'] = float(os.environ.get("SOS_RADIUS_KM", 5))
+    app.config['SOS_ACTIVE_HOURS'] = int(os.environ.get("SOS_ACTIVE_HOURS", 24))
+    app.config['LOCATION_MAX_AGE_HOURS'] = int(os.environ.get("LOCATION_MAX_AGE_HOURS", 24))
+    app.config['NEARBY_MAX_RADIUS_KM'] = float(os.environ.get("NEARBY_MAX_RADIUS_KM", 50))
+    app.config['NEARBY_ALERTS_LIMIT'] = int(os.environ.get("NEARBY_ALERTS_LIMIT", 50))
+    app.config['GEO_MAX_CANDIDATES'] = int(os.environ.get("GEO_MAX_CANDIDATES", 5000))
+
+    # Configure background jobs (set JOB_WORKER_THREADS=0 when running `flask run-worker` processes;
+    # gunicorn.conf.py does so under gevent and starts JOB_WORKER_PROCESSES of them itself)
+    app.config['JOB_WORKER_THREADS'] = int(os.environ.get("JOB_WORKER_THREADS", 1))
+    app.config['JOB_BATCH_SIZE'] = int(os.environ.get("JOB_BATCH_SIZE", 20))
+    app.config['JOB_POLL_SECONDS'] = float(os.environ.get("JOB_POLL_SECONDS", 1))
+    app.config['JOB_MAX_ATTEMPTS'] = int(os.environ.get("JOB_MAX_ATTEMPTS", 5))
+    app.config['JOB_BACKOFF_BASE_SECONDS'] = float(os.environ.get("JOB_BACKOFF_BASE_SECONDS", 2))
+    app.config['JOB_BACKOFF_MAX_SECONDS'] = float(os.environ.get("JOB_BACKOFF_MAX_SECONDS", 300))
+    app.config['JOB_LOCK_TIMEOUT_SECONDS'] = int(os.environ.get("JOB_LOCK_TIMEOUT_SECONDS", 120))
+
+    # Configure emergency-contact notifications (logged only unless a gateway URL is given)
+    app.config['SMS_GATEWAY_URL'] = os.environ.get("SMS_GATEWAY_URL")
+    app.config['SMS_GATEWAY_TOKEN'] = os.environ.get("SMS_GATEWAY_TOKEN")
+    app.config['SMS_GATEWAY_TIMEOUT_SECONDS'] = float(os.environ.get("SMS_GATEWAY_TIMEOUT_SECONDS", 10))
 
-# Create uploads directory if it doesn't exist
-os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
+    # Configure offline map packs, built from a local {z}/{x}/{y}.<format> tile tree
+    app.config['TILE_SOURCE_DIR'] = os.environ.get("TILE_SOURCE_DIR", "tiles")
+    app.config['TILE_SOURCE_FORMAT'] = os.environ.get("TILE_SOURCE_FORMAT", "png")
+    app.config['TILE_PACK_DIR'] = os.environ.get("TILE_PACK_DIR", os.path.join(app.instance_path, "tilepacks"))
+    app.config['TILE_PACK_CACHE_SIZE'] = int(os.environ.get("TILE_PACK_CACHE_SIZE", 32))
+    app.config['OFFLINE_MAP_MAX_TILES'] = int(os.environ.get("OFFLINE_MAP_MAX_TILES", 20000))
+    app.config['OFFLINE_MAP_MAX_RADIUS_KM'] = float(os.environ.get("OFFLINE_MAP_MAX_RADIUS_KM", 50))
+    app.config['OFFLINE_MAP_TOUCH_SECONDS'] = int(os.environ.get("OFFLINE_MAP_TOUCH_SECONDS", 3600))
+    app.config['OFFLINE_MAPS_MAX_BYTES'] = int(os.environ.get("OFFLINE_MAPS_MAX_BYTES", 5 * 1024 ** 3))
+    app.config['OFFLINE_MAP_IDLE_DAYS'] = int(os.environ.get("OFFLINE_MAP_IDLE_DAYS", 30))
 
-with app.app_context():
-    # Import models and routes
+    # Configure search results
+    app.config['SEARCH_PAGE_SIZE'] = int(os.environ.get("SEARCH_PAGE_SIZE", 20))
+    app.config['SEARCH_MAX_PAGE'] = int(os.environ.get("SEARCH_MAX_PAGE", 10))
+
+    # Configure contact typeahead; matches per prefix are cached for SUGGEST_CACHE_TTL seconds
+    app.config['SUGGEST_LIMIT'] = int(os.environ.get("SUGGEST_LIMIT", 10))
+    app.config['SUGGEST_CANDIDATES'] = int(os.environ.get("SUGGEST_CANDIDATES", 30))
+    app.config['SUGGEST_CACHE_TTL'] = int(os.environ.get("SUGGEST_CACHE_TTL", 60))
+    app.config['SUGGEST_CACHE_MAX_ENTRIES'] = int(os.environ.get("SUGGEST_CACHE_MAX_ENTRIES", 10000))
+
+    # Configure the session user cache; profile edits only invalidate the worker that served them
+    app.config['SESSION_USER_CACHE_TTL'] = int(os.environ.get("SESSION_USER_CACHE_TTL", 60))
+    app.config['SESSION_USER_CACHE_MAX_ENTRIES'] = int(os.environ.get("SESSION_USER_CACHE_MAX_ENTRIES", 10000))
+
+    # Configure instrumentation; /metrics is only served, with "Authorization: Bearer <METRICS_TOKEN>",
+    # once a token is set, and the per-request Server-Timing header is off unless SERVER_TIMING is
+    app.config['SLOW_QUERY_MS'] = float(os.environ.get("SLOW_QUERY_MS", 200))
+    app.config['METRICS_TOKEN'] = os.environ.get("METRICS_TOKEN")
+    app.config['SERVER_TIMING'] = os.environ.get("SERVER_TIMING", "").lower() in ("1", "true", "yes")
+
+    # Configure the assistant's LLM gateway (OPENAI_BASE_URL can point at a local fake server)
+    app.config['OPENAI_API_KEY'] = os.environ.get("OPENAI_API_KEY")
+    app.config['OPENAI_BASE_URL'] = os.environ.get("OPENAI_BASE_URL")
+    app.config['OPENAI_MODEL'] = os.environ.get("OPENAI_MODEL", "gpt-3.5-turbo")
+    app.config['LLM_TIMEOUT_SECONDS'] = float(os.environ.get("LLM_TIMEOUT_SECONDS", 20))
+    app.config['LLM_MAX_CONCURRENCY'] = int(os.environ.get("LLM_MAX_CONCURRENCY", 8))
+    app.config['LLM_MAX_QUEUE'] = int(os.environ.get("LLM_MAX_QUEUE", 32))
+    app.config['LLM_QUEUE_TIMEOUT_SECONDS'] = float(os.environ.get("LLM_QUEUE_TIMEOUT_SECONDS", 5))
+    app.config['LLM_BREAKER_FAILURES'] = int(os.environ.get("LLM_BREAKER_FAILURES", 5))
+    app.config['LLM_BREAKER_RESET_SECONDS'] = float(os.environ.get("LLM_BREAKER_RESET_SECONDS", 30))
+
+    # Configure the assistant response cache; LLM_CACHE_TTLS is "mode=seconds,..." (0 disables a mode)
+    app.config['LLM_CACHE_MAX_ENTRIES'] = int(os.environ.get("LLM_CACHE_MAX_ENTRIES", 5000))
+    app.config['LLM_CACHE_DEFAULT_TTL'] = int(os.environ.get("LLM_CACHE_DEFAULT_TTL", 3600))
+    app.config['LLM_CACHE_TTLS'] = {
+        mode: int(seconds) for mode, seconds in (
+            item.split('=', 1) for item in os.environ.get(
+                "LLM_CACHE_TTLS", "general=3600,travel=86400,emergency=86400,gpt_command=3600"
+            ).split(',') if item
+        )
+    }
+
+
+def create_app(config=None):
+    """Build and return the application.
+
+    ``config`` overrides settings read from the environment. Creating the app
+    never touches the database, so workers boot (or fork from a --preload
+    parent) without connecting; run ``flask init-db`` to create the schema.
+    """
+    started = time.perf_counter()
+    app = Flask(__name__)
+    configure(app)
+    if config:
+        app.config.update(config)
+    logging.basicConfig(level=app.config['LOG_LEVEL'])
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_proto=1, x_host=1)
+
+    # Initialize extensions
+    database.configure_engines(app)
+    db.init_app(app)
+    database.init_app(app)
+    metrics.init_app(app)
+    broker.init_app(app)
+    llm.init_app(app)
+    images.init_app(app)
+    fragments.init_app(app)
+    notifications.init_app(app)
+    login_manager.init_app(app)
+
+    # Importing models registers the mappers and their events
     import models
+    import auth
     import routes
-    
-    # Create all database tables
-    db.create_all()
-# تعديل بسيط لرفع المشروع
+    import commands
+    import contacts
+    import jobs
+    import offline_maps
+    import search
+    search.init_app(app)
+    auth.init_app(app)
+    contacts.init_app(app)
+    offline_maps.init_app(app)
+    jobs.init_app(app)
+    app.register_blueprint(routes.bp)
+    app.register_blueprint(commands.bp)
+
+    # Create uploads and tile pack directories if they don't exist
+    os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
+    os.makedirs(app.config['TILE_PACK_DIR'], exist_ok=True)
+
+    logger.info('Application created in %.0f ms', (time.perf_counter() - started) * 1000)
+    return app
@@ -0,0 +1,89 @@
+import threading
+import time
+from collections import OrderedDict
+from flask import current_app
+from flask_login import UserMixin
+from sqlalchemy.orm import load_only
+from app import db
+import metrics
+from models import User
+
+
+class SessionUser(UserMixin):
+    """What ``current_user`` is on authenticated requests: only the columns
+    authentication and the page chrome read.
+
+    Views that show or change the rest of the profile load the ``User`` row themselves.
+    """
+
+    def __init__(self, id, username):
+        self.id = id
+        self.username = username
+
+    def __repr__(self):
+        return f'<SessionUser {self.id}>'
+
+
+class SessionUserCache:
+    """Per-process TTL + LRU map from user id to SessionUser.
+
+    Other workers' entries can't be invalidated from here and stay valid for
+    up to ``ttl`` seconds.
+    """
+
+    def __init__(self, max_entries=10000, ttl=60):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, user_id):
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is not None and entry[1] > time.monotonic():
+                self._entries.move_to_end(user_id)
+                self.hits += 1
+                return entry[0]
+            self._entries.pop(user_id, None)
+            self.misses += 1
+            return None
+
+    def put(self, user):
+        if self.ttl <= 0:
+            return
+        with self._lock:
+            self._entries[user.id] = (user, time.monotonic() + self.ttl)
+            self._entries.move_to_end(user.id)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, user_id):
+        with self._lock:
+            self._entries.pop(user_id, None)
+
+
+def init_app(app):
+    cache = SessionUserCache(app.config['SESSION_USER_CACHE_MAX_ENTRIES'], app.config['SESSION_USER_CACHE_TTL'])
+    app.extensions['session_users'] = cache
+    metrics.register_gauge('everchat_session_user_cache_events_total', 'Session user cache lookups by outcome.',
+                           lambda: {'hit': cache.hits, 'miss': cache.misses}, label='outcome', kind='counter')
+
+
+def load_user(user_id):
+    """Return the SessionUser for ``user_id``, or None if the account is gone."""
+    cache = current_app.extensions['session_users']
+    user = cache.get(user_id)
+    if user is None:
+        row = db.session.get(User, user_id, options=[load_only(User.id, User.username)])
+        if row is None:
+            return None
+        user = SessionUser(row.id, row.username)
+        cache.put(user)
+    return user
+
+
+def invalidate(user_id):
+    """Drop ``user_id`` from this process's cache after its row changes."""
+    current_app.extensions['session_users'].invalidate(user_id)
@@ -0,0 +1,333 @@
+"""Drive EverChat's hot endpoints against seeded data and report latency.
+
+Seeds a fresh scratch database (see seed.py), starts the stub LLM server from
+tools/fake_openai.py and sends --requests requests to each endpoint from
+--concurrency logged-in users, either through the Flask test client
+(in-process, default) or a local gunicorn started on the same database.
+
+For every endpoint it reports throughput, p50/p95/p99 latency and SQL
+statements per request (read from the Server-Timing header). --json writes
+the results for later runs to be compared against with --compare.
+
+    python benchmarks/bench_endpoints.py --users 2000 --posts 20000 --requests 300 --json before.json
+    python benchmarks/bench_endpoints.py --server gunicorn --workers 4 --concurrency 16 --compare before.json
+"""
+import argparse
+import http.cookiejar
+import json
+import os
+import platform
+import random
+import re
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from datetime import datetime
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, 'tools'))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import seed as seeder
+
+ENDPOINTS = ('index', 'profile', 'chat', 'messages', 'like_post', 'create_post', 'gpt_chat')
+_SERVER_TIMING_QUERIES = re.compile(r'desc="(\d+) queries"')
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+class TestClientSession:
+    """One logged-in user, served in-process by the Flask test client."""
+
+    def __init__(self, app, username):
+        self._client = app.test_client()
+        self.request('POST', '/login', form={'username': username, 'password': seeder.PASSWORD})
+
+    def request(self, method, path, form=None, json_body=None):
+        response = self._client.open(path, method=method, data=form, json=json_body)
+        response.close()
+        return response.status_code, response.headers.get('Server-Timing', '')
+
+
+class _NoRedirect(urllib.request.HTTPRedirectHandler):
+    def redirect_request(self, *args, **kwargs):
+        return None
+
+
+class HTTPSession:
+    """One logged-in user talking to a running server; redirects are not followed."""
+
+    def __init__(self, base_url, username):
+        self._base_url = base_url
+        self._opener = urllib.request.build_opener(
+            urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()), _NoRedirect()
+        )
+        self.request('POST', '/login', form={'username': username, 'password': seeder.PASSWORD})
+
+    def request(self, method, path, form=None, json_body=None):
+        data, headers = None, {}
+        if form is not None:
+            data = urllib.parse.urlencode(form).encode()
+            headers['Content-Type'] = 'application/x-www-form-urlencoded'
+        elif json_body is not None:
+            data = json.dumps(json_body).encode()
+            headers['Content-Type'] = 'application/json'
+        request = urllib.request.Request(self._base_url + path, data=data, headers=headers, method=method)
+        try:
+            with self._opener.open(request, timeout=60) as response:
+                response.read()
+                return response.status, response.headers.get('Server-Timing', '')
+        except urllib.error.HTTPError as e:
+            e.read()
+            return e.code, e.headers.get('Server-Timing', '')
+
+
+class Workload:
+    """Builds each endpoint's next request for a given user from the seeded data."""
+
+    def __init__(self, app, n_users, seed):
+        from app import db
+        from models import Conversation, Post
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.n_users = n_users
+        self.counter = 0
+        with app.app_context():
+            self.max_post_id = db.session.query(db.func.max(Post.id)).scalar() or 1
+            self.peers = {}
+            for user_id, peer_id in db.session.query(Conversation.user_id, Conversation.peer_id).filter(
+                    Conversation.user_id <= n_users):
+                self.peers.setdefault(user_id, []).append(peer_id)
+
+    def next(self, endpoint, user_id):
+        with self.lock:
+            self.counter += 1
+            counter = self.counter
+            post_id = self.rng.randint(1, self.max_post_id)
+            other = self.rng.randint(1, self.n_users)
+            peers = self.peers.get(user_id) or [other]
+            peer_id = self.rng.choice(peers)
+        if endpoint == 'index':
+            return 'GET', '/', None, None
+        if endpoint == 'profile':
+            return 'GET', f'/profile/user{other}', None, None
+        if endpoint == 'chat':
+            return 'GET', '/chat', None, None
+        if endpoint == 'messages':
+            return 'GET', f'/api/messages/{peer_id}', None, None
+        if endpoint == 'like_post':
+            return 'GET', f'/like_post/{post_id}', None, None
+        if endpoint == 'create_post':
+            return 'POST', '/create_post', {'caption': f'benchmark post {counter}'}, None
+        if endpoint == 'gpt_chat':
+            # Distinct questions, so every call goes upstream instead of to the completion cache
+            return 'POST', '/api/gpt-chat', None, {'message': f'benchmark question {counter}', 'mode': 'general'}
+        raise ValueError(endpoint)
+
+
+def run_endpoint(endpoint, sessions, workload, requests, warmup):
+    """Send ``requests`` requests spread over the sessions' threads; returns the summary dict."""
+    latencies, queries, errors = [], [], [0]
+    results_lock = threading.Lock()
+    budget_lock = threading.Lock()
+    budget = None
+
+    def take():
+        with budget_lock:
+            return next(budget, None) is not None
+
+    def worker(user_id, session, record):
+        while take():
+            method, path, form, json_body = workload.next(endpoint, user_id)
+            started = time.perf_counter()
+            status, server_timing = session.request(method, path, form, json_body)
+            elapsed = time.perf_counter() - started
+            if not record:
+                continue
+            match = _SERVER_TIMING_QUERIES.search(server_timing)
+            with results_lock:
+                latencies.append(elapsed * 1000)
+                if match:
+                    queries.append(int(match.group(1)))
+                if status >= 400:
+                    errors[0] += 1
+
+    def run(record):
+        threads = [threading.Thread(target=worker, args=(user_id, session, record))
+                   for user_id, session in sessions]
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return time.perf_counter() - started
+
+    budget = iter(range(warmup))
+    run(False)
+    budget = iter(range(requests))
+    wall = run(True)
+
+    return {
+        'requests': len(latencies),
+        'errors': errors[0],
+        'throughput_rps': round(len(latencies) / wall, 1),
+        'p50_ms': round(percentile(latencies, 50), 2),
+        'p95_ms': round(percentile(latencies, 95), 2),
+        'p99_ms': round(percentile(latencies, 99), 2),
+        'mean_ms': round(sum(latencies) / len(latencies), 2),
+        'queries_per_request': round(sum(queries) / len(queries), 1) if queries else None,
+        'max_queries': max(queries) if queries else None,
+    }
+
+
+def start_gunicorn(workers, env):
+    port = free_port()
+    env = {**env, 'GUNICORN_BIND': f'127.0.0.1:{port}', 'WEB_CONCURRENCY': str(workers)}
+    process = subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', 'main:app'], cwd=ROOT, env=env,
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError('gunicorn exited during startup')
+        try:
+            with socket.create_connection(('127.0.0.1', port), timeout=1):
+                return process, f'http://127.0.0.1:{port}'
+        except OSError:
+            time.sleep(0.2)
+    process.terminate()
+    raise RuntimeError('gunicorn did not start listening within 30s')
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_table(results, baseline=None):
+    print(f"{'endpoint':<12} {'req/s':>8} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'queries':>8} {'errors':>7}")
+    for endpoint, result in results.items():
+        print(f"{endpoint:<12} {result['throughput_rps']:>8} {result['p50_ms']:>9} {result['p95_ms']:>9} "
+              f"{result['p99_ms']:>9} {str(result['queries_per_request']):>8} {result['errors']:>7}")
+        previous = (baseline or {}).get(endpoint)
+        if previous:
+            changes = []
+            for key in ('throughput_rps', 'p50_ms', 'p95_ms', 'p99_ms'):
+                if previous.get(key):
+                    changes.append(f"{key} {(result[key] - previous[key]) / previous[key] * 100:+.0f}%")
+            print(f"{'':<12} vs baseline: {', '.join(changes)}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    seeder.add_count_arguments(parser)
+    parser.add_argument('--requests', type=int, default=200, help='measured requests per endpoint')
+    parser.add_argument('--warmup', type=int, default=20, help='unmeasured requests per endpoint')
+    parser.add_argument('--concurrency', type=int, default=4, help='simultaneous logged-in users')
+    parser.add_argument('--endpoints', default=','.join(ENDPOINTS), help='comma-separated subset of ' + ', '.join(ENDPOINTS))
+    parser.add_argument('--server', choices=('test-client', 'gunicorn'), default='test-client')
+    parser.add_argument('--workers', type=int, default=2, help='gunicorn worker processes')
+    parser.add_argument('--llm-latency', type=float, default=0.2, help='seconds the stub LLM waits per completion')
+    parser.add_argument('--json', help='write results to this file')
+    parser.add_argument('--compare', help='print changes against a previous --json file')
+    args = parser.parse_args()
+
+    endpoints = [name.strip() for name in args.endpoints.split(',') if name.strip()]
+    unknown = set(endpoints) - set(ENDPOINTS)
+    if unknown:
+        parser.error(f"unknown endpoints: {', '.join(sorted(unknown))}")
+    concurrency = min(args.concurrency, args.users)
+
+    import fake_openai
+    llm_server = fake_openai.make_server(port=0, latency=args.llm_latency)
+    threading.Thread(target=llm_server.serve_forever, daemon=True).start()
+
+    workdir = tempfile.mkdtemp(prefix='everchat-bench-')
+    os.environ.update({
+        'DATABASE_URL': f"sqlite:///{os.path.join(workdir, 'bench.db')}",
+        'OPENAI_API_KEY': 'bench',
+        'OPENAI_BASE_URL': f'http://127.0.0.1:{llm_server.server_address[1]}/v1',
+    })
+    os.environ.setdefault('SESSION_SECRET', 'bench')
+    os.environ.setdefault('LOG_LEVEL', 'WARNING')
+    os.environ.setdefault('SLOW_QUERY_MS', '0')
+    # Query counts are read from the Server-Timing header
+    os.environ['SERVER_TIMING'] = '1'
+
+    from app import create_app
+    import commands
+    app = create_app()
+    counts = {name: getattr(args, name) for name in seeder.DEFAULT_COUNTS}
+    print(f'seeding {workdir}')
+    with app.app_context():
+        commands.create_schema()
+        seed_timings = seeder.seed_database(counts, args.seed, build_search_index=not args.no_search_index)
+
+    workload = Workload(app, args.users, args.seed)
+    server = None
+    try:
+        if args.server == 'gunicorn':
+            server, base_url = start_gunicorn(args.workers, dict(os.environ))
+            sessions = [(i, HTTPSession(base_url, f'user{i}')) for i in range(1, concurrency + 1)]
+        else:
+            sessions = [(i, TestClientSession(app, f'user{i}')) for i in range(1, concurrency + 1)]
+
+        results = {}
+        for endpoint in endpoints:
+            results[endpoint] = run_endpoint(endpoint, sessions, workload, args.requests, args.warmup)
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+        llm_server.shutdown()
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as compare_file:
+            baseline = json.load(compare_file)['endpoints']
+    print_table(results, baseline)
+
+    if args.json:
+        report = {
+            'meta': {
+                'timestamp': datetime.utcnow().isoformat(timespec='seconds') + 'Z',
+                'git_revision': git_revision(),
+                'python': platform.python_version(),
+                'server': args.server,
+                'workers': args.workers if args.server == 'gunicorn' else 1,
+                'concurrency': concurrency,
+                'requests_per_endpoint': args.requests,
+                'llm_latency_seconds': args.llm_latency,
+                'seed': args.seed,
+                'counts': counts,
+                'seed_seconds': seed_timings,
+            },
+            'endpoints': results,
+        }
+        with open(args.json, 'w') as out:
+            json.dump(report, out, indent=2)
+        print(f'wrote {args.json}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,102 @@
+"""Benchmark proximity lookups against a large table of user positions.
+
+Seeds a scratch SQLite database with --positions random positions around a
+handful of cities, then times geo.users_near() (geohash prefix ranges) against
+a full-table haversine scan for the same random query points.
+
+    python benchmarks/bench_geo.py --positions 300000 --queries 200 --radius 5
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Riyadh, Jeddah, Cairo, Amman, Dubai
+CITIES = [(24.71, 46.68), (21.49, 39.19), (30.04, 31.24), (31.95, 35.93), (25.20, 55.27)]
+CITY_SPREAD_DEGREES = 0.5
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+def random_point(rng):
+    lat, lon = rng.choice(CITIES)
+    return (lat + rng.uniform(-CITY_SPREAD_DEGREES, CITY_SPREAD_DEGREES),
+            lon + rng.uniform(-CITY_SPREAD_DEGREES, CITY_SPREAD_DEGREES))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--positions', type=int, default=300000)
+    parser.add_argument('--queries', type=int, default=200)
+    parser.add_argument('--radius', type=float, default=5.0)
+    parser.add_argument('--scan-queries', type=int, default=10, help='full-scan baseline runs (slow)')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='everchat-bench-')
+    os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(workdir, 'bench.db')}"
+    os.environ.setdefault('SESSION_SECRET', 'bench')
+
+    from datetime import datetime
+    from sqlalchemy import insert
+    from app import create_app, db
+    from models import User, UserLocation
+    import commands
+    import geo
+
+    app = create_app()
+    rng = random.Random(args.seed)
+    with app.app_context():
+        commands.create_schema()
+        started = time.perf_counter()
+        now = datetime.utcnow()
+        batch = 20000
+        for offset in range(0, args.positions, batch):
+            ids = range(offset + 1, min(offset + batch, args.positions) + 1)
+            db.session.execute(insert(User), [
+                {'id': i, 'username': f'bench{i}', 'email': f'bench{i}@example.com'} for i in ids
+            ])
+            rows = []
+            for i in ids:
+                lat, lon = random_point(rng)
+                rows.append({'user_id': i, 'latitude': lat, 'longitude': lon,
+                             'geohash': geo.encode(lat, lon), 'updated_at': now})
+            db.session.execute(insert(UserLocation), rows)
+        db.session.commit()
+        print(f'seeded {args.positions} positions in {time.perf_counter() - started:.1f}s')
+
+        points = [random_point(rng) for _ in range(args.queries)]
+        indexed, found = [], []
+        for lat, lon in points:
+            started = time.perf_counter()
+            found.append(len(geo.users_near(lat, lon, args.radius)))
+            indexed.append((time.perf_counter() - started) * 1000)
+
+        scanned = []
+        for lat, lon in points[:args.scan_queries]:
+            started = time.perf_counter()
+            matches = sum(
+                1 for row_lat, row_lon in db.session.query(UserLocation.latitude, UserLocation.longitude)
+                if geo.haversine_km(lat, lon, row_lat, row_lon) <= args.radius
+            )
+            scanned.append((time.perf_counter() - started) * 1000)
+            assert matches == found[len(scanned) - 1] or matches > app.config['GEO_MAX_CANDIDATES'], \
+                'indexed lookup disagrees with full scan'
+
+    print(f'radius {args.radius} km, {statistics.mean(found):.0f} users found per query on average')
+    print(f'geohash lookup: p50 {percentile(indexed, 50):.2f} ms, p95 {percentile(indexed, 95):.2f} ms, '
+          f'p99 {percentile(indexed, 99):.2f} ms over {len(indexed)} queries')
+    if scanned:
+        print(f'full scan:      p50 {percentile(scanned, 50):.2f} ms over {len(scanned)} queries')
+
+
+if __name__ == '__main__':
+    main()
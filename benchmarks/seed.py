@@ -0,0 +1,194 @@
+"""Fill the EverChat schema with synthetic users, posts, likes, comments,
+messages, conversations and SOS alerts.
+
+Rows are written with bulk INSERTs, so the ORM events that normally maintain
+denormalized data don't run; post counters, conversation summaries and the
+search index are computed here instead. The same --seed always produces the
+same data. Every user's password is "bench".
+
+    python benchmarks/seed.py --database-url sqlite:////tmp/everchat-bench.db --users 5000 --posts 50000
+"""
+import argparse
+import os
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+PASSWORD = 'bench'
+BATCH_SIZE = 10000
+DEFAULT_COUNTS = {
+    'users': 2000,
+    'posts': 20000,
+    'likes': 100000,
+    'comments': 40000,
+    'messages': 100000,
+    'sos_alerts': 500,
+}
+# People each user messages; keeps conversations long enough to page through
+FRIENDS_PER_USER = 8
+HISTORY_DAYS = 90
+
+WORDS = (
+    'مرحبا صباح الخير رحلة إلى مكة المدينة الرياض جدة القاهرة عمّان دبي اليوم غدا '
+    'الطريق مزدحم الطقس جميل صورة جديدة من السفر شكرا للجميع أين الاجتماع في المكتب '
+    'hello travel photo coffee meeting tomorrow weekend family friends road trip sunset'
+).split()
+# Riyadh, Jeddah, Cairo, Amman, Dubai
+CITIES = [(24.71, 46.68), (21.49, 39.19), (30.04, 31.24), (31.95, 35.93), (25.20, 55.27)]
+
+
+def sentence(rng, low=3, high=14):
+    return ' '.join(rng.choice(WORDS) for _ in range(rng.randint(low, high)))
+
+
+def _timestamps(rng, count, now):
+    # Ascending with the id, like rows written over time
+    start = now - timedelta(days=HISTORY_DAYS)
+    step = HISTORY_DAYS * 86400 / max(count, 1)
+    return [start + timedelta(seconds=i * step + rng.random() * step) for i in range(count)]
+
+
+def _insert(db, model, rows):
+    from sqlalchemy import insert
+    for offset in range(0, len(rows), BATCH_SIZE):
+        db.session.execute(insert(model), rows[offset:offset + BATCH_SIZE])
+
+
+def seed_database(counts, seed=1, build_search_index=True, log=print):
+    """Insert synthetic rows into the app's (empty) database and commit.
+
+    ``counts`` maps the keys of DEFAULT_COUNTS to row counts. Must run inside
+    an application context, after the schema exists. Returns seconds spent per table.
+    """
+    from werkzeug.security import generate_password_hash
+    from app import db
+    from models import User, Post, Like, Comment, Message, Conversation, SOSAlert
+    from text import normalize_arabic
+    import geo
+    import search
+
+    counts = {**DEFAULT_COUNTS, **counts}
+    rng = random.Random(seed)
+    now = datetime.utcnow()
+    timings = {}
+
+    def timed(name):
+        elapsed = time.perf_counter() - timed.started
+        timings[name] = round(elapsed, 2)
+        log(f'  {name:<14} {elapsed:6.1f}s')
+        timed.started = time.perf_counter()
+    timed.started = time.perf_counter()
+
+    n_users, n_posts = counts['users'], counts['posts']
+    password_hash = generate_password_hash(PASSWORD)
+    joined = _timestamps(rng, n_users, now - timedelta(days=HISTORY_DAYS))
+    _insert(db, User, [
+        {'id': i, 'username': f'user{i}', 'username_normalized': normalize_arabic(f'user{i}'),
+         'email': f'user{i}@example.com', 'password_hash': password_hash,
+         'bio': sentence(rng, 2, 8) if rng.random() < 0.5 else None, 'created_at': joined[i - 1]}
+        for i in range(1, n_users + 1)
+    ])
+    timed('users')
+
+    like_counts = [0] * (n_posts + 1)
+    comment_counts = [0] * (n_posts + 1)
+    likes = set()
+    # Recent posts collect most likes; capped so tiny datasets still terminate
+    target = min(counts['likes'], n_users * n_posts // 4)
+    while len(likes) < target:
+        age = min(n_posts - 1, int(rng.expovariate(1.0) * n_posts / 5))
+        pair = (rng.randint(1, n_users), n_posts - age)
+        if pair not in likes:
+            likes.add(pair)
+            like_counts[pair[1]] += 1
+    comments = []
+    for created_at in _timestamps(rng, counts['comments'], now):
+        post_id = rng.randint(1, n_posts)
+        comment_counts[post_id] += 1
+        comments.append({'content': sentence(rng, 1, 10), 'created_at': created_at,
+                         'user_id': rng.randint(1, n_users), 'post_id': post_id})
+
+    _insert(db, Post, [
+        {'id': i, 'caption': sentence(rng), 'created_at': created_at, 'user_id': rng.randint(1, n_users),
+         'like_count': like_counts[i], 'comment_count': comment_counts[i]}
+        for i, created_at in enumerate(_timestamps(rng, n_posts, now), start=1)
+    ])
+    timed('posts')
+    _insert(db, Like, [{'user_id': user_id, 'post_id': post_id} for user_id, post_id in sorted(likes)])
+    timed('likes')
+    _insert(db, Comment, comments)
+    timed('comments')
+
+    friends = {
+        user_id: rng.sample(range(1, n_users + 1), min(FRIENDS_PER_USER, n_users))
+        for user_id in range(1, n_users + 1)
+    }
+    messages, latest = [], {}
+    for message_id, created_at in enumerate(_timestamps(rng, counts['messages'], now), start=1):
+        sender_id = rng.randint(1, n_users)
+        recipient_id = rng.choice(friends[sender_id])
+        content = sentence(rng, 1, 20)
+        messages.append({'id': message_id, 'content': content, 'created_at': created_at,
+                         'sender_id': sender_id, 'recipient_id': recipient_id, 'is_read': True})
+        latest[(sender_id, recipient_id)] = latest[(recipient_id, sender_id)] = (message_id, content, created_at)
+    _insert(db, Message, messages)
+    _insert(db, Conversation, [
+        {'user_id': user_id, 'peer_id': peer_id, 'last_message_id': message_id,
+         'last_message_preview': content[:100], 'last_message_at': created_at, 'unread_count': 0}
+        for (user_id, peer_id), (message_id, content, created_at) in latest.items()
+    ])
+    timed('messages')
+
+    alerts = []
+    for created_at in _timestamps(rng, counts['sos_alerts'], now):
+        lat, lon = rng.choice(CITIES)
+        lat, lon = lat + rng.uniform(-0.5, 0.5), lon + rng.uniform(-0.5, 0.5)
+        alerts.append({'user_id': rng.randint(1, n_users), 'latitude': lat, 'longitude': lon,
+                       'geohash': geo.encode(lat, lon), 'message': sentence(rng, 2, 6),
+                       'status': 'active' if created_at > now - timedelta(days=1) else 'resolved',
+                       'created_at': created_at})
+    _insert(db, SOSAlert, alerts)
+    db.session.commit()
+    timed('sos_alerts')
+
+    if build_search_index:
+        search.reindex()
+        timed('search_index')
+    return timings
+
+
+def add_count_arguments(parser):
+    for name, default in DEFAULT_COUNTS.items():
+        parser.add_argument(f"--{name.replace('_', '-')}", type=int, default=default, dest=name)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--no-search-index', action='store_true', help='skip rebuilding the full-text index')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--database-url', required=True, help='must point at an empty database')
+    add_count_arguments(parser)
+    args = parser.parse_args()
+
+    os.environ['DATABASE_URL'] = args.database_url
+    os.environ.setdefault('SESSION_SECRET', 'bench')
+    os.environ.setdefault('LOG_LEVEL', 'WARNING')
+    from app import create_app
+    from models import User
+    import commands
+
+    app = create_app()
+    with app.app_context():
+        commands.create_schema()
+        if User.query.first() is not None:
+            parser.error('the database already has users; seed an empty one')
+        print(f'seeding {args.database_url}')
+        seed_database({name: getattr(args, name) for name in DEFAULT_COUNTS}, args.seed,
+                      build_search_index=not args.no_search_index)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,172 @@
+import json
+import logging
+import queue
+import threading
+from collections import defaultdict
+from flask import current_app
+
+logger = logging.getLogger(__name__)
+
+
+class Subscription:
+    """A bounded queue of events for one connected client."""
+
+    def __init__(self, broker, user_id, maxsize=100):
+        self.broker = broker
+        self.user_id = user_id
+        self._queue = queue.Queue(maxsize=maxsize)
+
+    def put(self, event):
+        while True:
+            try:
+                self._queue.put_nowait(event)
+                return
+            except queue.Full:
+                # A client that stopped reading loses its oldest events, not the broker's memory
+                try:
+                    self._queue.get_nowait()
+                except queue.Empty:
+                    pass
+
+    def get(self, timeout=None):
+        """Return the next (event, data) pair, or None if nothing arrived within ``timeout``."""
+        try:
+            return self._queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def close(self):
+        self.broker.unsubscribe(self)
+
+
+class Broker:
+    """Per-user pub/sub interface used by the SSE stream."""
+
+    def publish(self, user_id, event, data):
+        raise NotImplementedError
+
+    def subscribe(self, user_id):
+        raise NotImplementedError
+
+    def unsubscribe(self, subscription):
+        raise NotImplementedError
+
+
+class InMemoryBroker(Broker):
+    """Fans events out to subscribers in this process only."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscribers = defaultdict(set)
+
+    def publish(self, user_id, event, data):
+        self._deliver(user_id, (event, data))
+
+    def _deliver(self, user_id, item):
+        with self._lock:
+            subscribers = list(self._subscribers.get(user_id, ()))
+        for subscription in subscribers:
+            subscription.put(item)
+
+    def subscribe(self, user_id):
+        subscription = Subscription(self, user_id)
+        with self._lock:
+            self._subscribers[user_id].add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            subscribers = self._subscribers.get(subscription.user_id)
+            if subscribers is not None:
+                subscribers.discard(subscription)
+                if not subscribers:
+                    del self._subscribers[subscription.user_id]
+
+
+class RedisBroker(InMemoryBroker):
+    """Publishes through Redis so every worker process sees every event.
+
+    Each process keeps one pattern subscription on a background thread and
+    hands events to its local subscribers, so connected clients never hold a
+    Redis connection of their own.
+    """
+
+    CHANNEL_PREFIX = 'everchat:user:'
+
+    def __init__(self, url):
+        super().__init__()
+        import redis
+        self._redis = redis.Redis.from_url(url)
+        self._listener = None
+        self._listener_lock = threading.Lock()
+
+    def publish(self, user_id, event, data):
+        payload = json.dumps({'event': event, 'data': data})
+        self._redis.publish(f'{self.CHANNEL_PREFIX}{user_id}', payload)
+
+    def subscribe(self, user_id):
+        self._ensure_listener()
+        return super().subscribe(user_id)
+
+    def _ensure_listener(self):
+        # Started lazily so a preloading parent never forks with a live thread
+        with self._listener_lock:
+            if self._listener is None or not self._listener.is_alive():
+                self._listener = threading.Thread(target=self._listen, name='broker-listener', daemon=True)
+                self._listener.start()
+
+    def _listen(self):
+        try:
+            pubsub = self._redis.pubsub(ignore_subscribe_messages=True)
+            pubsub.psubscribe(f'{self.CHANNEL_PREFIX}*')
+            for message in pubsub.listen():
+                try:
+                    user_id = int(message['channel'].decode().rsplit(':', 1)[1])
+                    payload = json.loads(message['data'])
+                    self._deliver(user_id, (payload['event'], payload['data']))
+                except (ValueError, KeyError) as e:
+                    logger.warning('Dropping malformed broker message: %s', e)
+        except Exception:
+            # The next subscribe() starts a fresh listener
+            logger.exception('Broker listener stopped')
+
+
+def init_app(app):
+    url = app.config.get('BROKER_URL')
+    if url and url.startswith('redis://'):
+        try:
+            app.extensions['broker'] = RedisBroker(url)
+        except ImportError as e:
+            raise RuntimeError('BROKER_URL is a redis:// URL but the redis package is not installed; '
+                               'run `pip install redis` or unset BROKER_URL') from e
+    else:
+        app.extensions['broker'] = InMemoryBroker()
+    max_streams = app.config.get('SSE_MAX_STREAMS')
+    app.extensions['stream_slots'] = threading.BoundedSemaphore(max_streams) if max_streams else None
+
+
+def acquire_stream_slot():
+    """Reserve one of this process's SSE_MAX_STREAMS slots.
+
+    Returns the callable that frees it, or None when every slot is taken.
+    """
+    slots = current_app.extensions['stream_slots']
+    if slots is None:
+        return lambda: None
+    return slots.release if slots.acquire(blocking=False) else None
+
+
+def publish(user_id, event, data):
+    """Send ``event`` to every stream ``user_id`` has open; never raises into the caller."""
+    try:
+        current_app.extensions['broker'].publish(user_id, event, data)
+    except Exception as e:
+        logger.warning('Broker publish failed: %s', e)
+
+
+def subscribe(user_id):
+    return current_app.extensions['broker'].subscribe(user_id)
+
+
+def format_sse(event, data):
+    return f'event: {event}\ndata: {json.dumps(data)}\n\n'
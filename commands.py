@@ -0,0 +1,221 @@
+import json
+import signal
+import time
+from datetime import datetime, timedelta
+import click
+from sqlalchemy import delete, func, insert, inspect, or_, select, update
+from flask import Blueprint, current_app
+from app import db
+from models import User, Post, Like, Comment, Message, Conversation, Job
+from messaging import message_preview
+from text import normalize_arabic
+import contacts
+import jobs
+import offline_maps
+import search
+
+# cli_group=None registers these as top-level `flask <command>` commands
+bp = Blueprint('commands', __name__, cli_group=None)
+
+
+def create_schema():
+    """Create missing tables and indexes; existing ones are left alone."""
+    db.create_all()
+    search.create_schema()
+    contacts.create_schema()
+
+
+def missing_columns():
+    """Return "table.column" for model columns that existing tables lack.
+
+    create_all() never alters a table that already exists, so these have to be
+    added by hand (see "Upgrading an existing database" in replit.md).
+    """
+    inspector = inspect(db.engine)
+    missing = []
+    for table in db.metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            continue
+        existing = {column['name'] for column in inspector.get_columns(table.name)}
+        missing.extend(f'{table.name}.{column.name}' for column in table.columns if column.name not in existing)
+    return missing
+
+
+def create_missing_indexes():
+    """Create model indexes that tables made before they were declared lack."""
+    for table in db.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(db.engine, checkfirst=True)
+
+
+@bp.cli.command('init-db')
+def init_db():
+    """Create missing tables and indexes. Run once per deploy, before starting workers."""
+    started = time.perf_counter()
+    missing = missing_columns()
+    if missing:
+        raise click.ClickException(
+            'The database predates columns the app needs: ' + ', '.join(missing) +
+            '. Add them as described in replit.md ("Upgrading an existing database") and run init-db again.'
+        )
+    create_schema()
+    create_missing_indexes()
+    click.echo(f'Database schema is up to date ({time.perf_counter() - started:.2f}s).')
+
+
+@bp.cli.command('repair-counters')
+@click.option('--batch-size', default=10000, show_default=True, help='Posts recomputed per transaction.')
+def repair_counters(batch_size):
+    """Recompute Post.like_count and Post.comment_count from the source tables."""
+    post = Post.__table__
+    like_total = select(func.count(Like.id)).where(Like.post_id == post.c.id).scalar_subquery()
+    comment_total = select(func.count(Comment.id)).where(Comment.post_id == post.c.id).scalar_subquery()
+
+    max_id = db.session.query(func.max(Post.id)).scalar() or 0
+    for start in range(0, max_id, batch_size):
+        # Only drifted posts are rewritten; bumping render_version drops their cached cards
+        db.session.execute(
+            post.update()
+            .where(post.c.id > start, post.c.id <= start + batch_size,
+                   or_(post.c.like_count != like_total, post.c.comment_count != comment_total))
+            .values(like_count=like_total, comment_count=comment_total, render_version=post.c.render_version + 1)
+        )
+        db.session.commit()
+    click.echo(f'Recomputed counters for posts up to id {max_id}.')
+
+
+@bp.cli.command('backfill-usernames')
+@click.option('--batch-size', default=1000, show_default=True, help='Users updated per transaction.')
+def backfill_usernames(batch_size):
+    """Fill User.username_normalized for accounts created before the contact typeahead."""
+    last_id = 0
+    updated = 0
+    while True:
+        rows = db.session.execute(
+            select(User.id, User.username, User.username_normalized)
+            .where(User.id > last_id).order_by(User.id).limit(batch_size)
+        ).all()
+        if not rows:
+            break
+        last_id = rows[-1].id
+        changes = [
+            {'id': row.id, 'username_normalized': normalize_arabic(row.username)}
+            for row in rows if row.username_normalized != normalize_arabic(row.username)
+        ]
+        if changes:
+            # Bulk update by primary key: no ORM events, so profile versions stay as they are
+            db.session.execute(update(User), changes)
+            updated += len(changes)
+        db.session.commit()
+    click.echo(f'Normalized {updated} usernames.')
+
+
+@bp.cli.command('rebuild-conversations')
+@click.option('--batch-size', default=1000, show_default=True, help='Conversations inserted per statement.')
+def rebuild_conversations(batch_size):
+    """Rebuild every Conversation summary from the message table."""
+    last_ids = {}
+    for owner_col, peer_col in ((Message.sender_id, Message.recipient_id), (Message.recipient_id, Message.sender_id)):
+        rows = db.session.query(owner_col, peer_col, func.max(Message.id)).group_by(owner_col, peer_col)
+        for owner_id, peer_id, message_id in rows:
+            key = (owner_id, peer_id)
+            last_ids[key] = max(last_ids.get(key, 0), message_id)
+
+    unread = dict(
+        ((owner_id, peer_id), count) for owner_id, peer_id, count in db.session.query(
+            Message.recipient_id, Message.sender_id, func.count(Message.id)
+        ).filter(Message.is_read == False).group_by(Message.recipient_id, Message.sender_id)
+    )
+
+    db.session.execute(delete(Conversation))
+    items = list(last_ids.items())
+    for start in range(0, len(items), batch_size):
+        batch = items[start:start + batch_size]
+        messages = {
+            message.id: message for message in
+            Message.query.filter(Message.id.in_([message_id for _, message_id in batch]))
+        }
+        db.session.execute(insert(Conversation), [{
+            'user_id': owner_id,
+            'peer_id': peer_id,
+            'last_message_id': message_id,
+            'last_message_preview': message_preview(messages[message_id].content),
+            'last_message_at': messages[message_id].created_at,
+            'unread_count': 0 if owner_id == peer_id else unread.get((owner_id, peer_id), 0)
+        } for (owner_id, peer_id), message_id in batch])
+    db.session.commit()
+    click.echo(f'Rebuilt {len(items)} conversations.')
+
+
+@bp.cli.command('build-image-variants')
+def build_image_variants():
+    """Generate missing resized variants for every uploaded post image and profile picture."""
+    pipeline = current_app.extensions['images']
+    filenames = {name for name, in db.session.query(Post.image_filename).filter(Post.image_filename.isnot(None))}
+    filenames |= {name for name, in db.session.query(User.profile_pic).filter(User.profile_pic.isnot(None))}
+
+    failed = 0
+    for filename in sorted(filenames):
+        try:
+            pipeline.render_now(filename)
+        except Exception as e:
+            failed += 1
+            click.echo(f'{filename}: {e}', err=True)
+    click.echo(f'Processed {len(filenames) - failed} images, {failed} failed.')
+
+
+@bp.cli.command('run-worker')
+@click.option('--batch-size', type=int, help='Jobs claimed per round trip (default JOB_BATCH_SIZE).')
+@click.option('--poll-interval', type=float, help='Seconds to sleep when the queue is empty (default JOB_POLL_SECONDS).')
+@click.option('--once', is_flag=True, help='Process the jobs that are due now and exit.')
+def run_worker(batch_size, poll_interval, once):
+    """Process background jobs until interrupted. Run several for more throughput."""
+    worker = jobs.Worker(batch_size=batch_size, poll_seconds=poll_interval)
+    if once:
+        total = 0
+        while processed := worker.run_once():
+            total += processed
+        click.echo(f'Processed {total} jobs.')
+        return
+    signal.signal(signal.SIGTERM, lambda *args: worker.stop())
+    click.echo(f'Worker {worker.name} started.')
+    try:
+        worker.run()
+    except KeyboardInterrupt:
+        pass
+
+
+@bp.cli.command('job-stats')
+def job_stats():
+    """Print queue depth and recent delivery latency as JSON."""
+    click.echo(json.dumps(jobs.queue_stats(), indent=2))
+
+
+@bp.cli.command('prune-jobs')
+@click.option('--days', default=7, show_default=True, help='Delete finished jobs older than this.')
+def prune_jobs(days):
+    """Delete done and failed jobs that finished more than --days ago."""
+    cutoff = datetime.utcnow() - timedelta(days=days)
+    deleted = Job.query.filter(Job.status.in_(('done', 'failed')), Job.finished_at < cutoff).delete(synchronize_session=False)
+    db.session.commit()
+    click.echo(f'Deleted {deleted} jobs.')
+
+
+@bp.cli.command('evict-offline-maps')
+@click.option('--max-bytes', type=int, help='Total pack size to keep (default OFFLINE_MAPS_MAX_BYTES).')
+@click.option('--idle-days', type=int, help='Evict packs unused for this long (default OFFLINE_MAP_IDLE_DAYS).')
+def evict_offline_maps(max_bytes, idle_days):
+    """Delete cold offline map packs, least recently used first."""
+    count, freed = offline_maps.evict_packs(
+        max_bytes if max_bytes is not None else current_app.config['OFFLINE_MAPS_MAX_BYTES'],
+        idle_days if idle_days is not None else current_app.config['OFFLINE_MAP_IDLE_DAYS']
+    )
+    click.echo(f'Evicted {count} packs, freed {freed} bytes.')
+
+
+@bp.cli.command('reindex-search')
+@click.option('--batch-size', default=1000, show_default=True, help='Rows indexed per transaction.')
+def reindex_search(batch_size):
+    """Rebuild the full-text index for posts, comments, users and messages."""
+    counts = search.reindex(batch_size)
+    click.echo(', '.join(f'{count} {kind}s' for kind, count in counts.items()) + ' indexed.')
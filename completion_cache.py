@@ -0,0 +1,138 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+from text import normalize_query
+
+
+class CompletionCache:
+    """LRU cache of completion text keyed by mode, system prompt and normalized question.
+
+    Concurrent misses for the same key are collapsed: the first caller computes
+    the answer and the others wait for its result. Failures are never cached.
+    """
+
+    def __init__(self, max_entries=1000, ttls=None, default_ttl=3600, wait_timeout=30.0):
+        self.max_entries = max_entries
+        self.ttls = ttls or {}
+        self.default_ttl = default_ttl
+        self.wait_timeout = wait_timeout
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._inflight = {}
+        self.hits = 0
+        self.misses = 0
+        self.collapsed = 0
+        self.evictions = 0
+
+    @staticmethod
+    def make_key(mode, system_prompt, user_message):
+        prompt_digest = hashlib.sha1(system_prompt.encode()).hexdigest()
+        return (mode, prompt_digest, normalize_query(user_message))
+
+    def _lookup(self, key):
+        # Caller holds the lock
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        text, expires_at = entry
+        if expires_at <= time.monotonic():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return text
+
+    def _store(self, key, text):
+        # Caller holds the lock
+        ttl = self.ttls.get(key[0], self.default_ttl)
+        if ttl <= 0:
+            return
+        self._entries[key] = (text, time.monotonic() + ttl)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def claim(self, mode, system_prompt, user_message):
+        """Look up a completion that the caller may have to produce itself, e.g. by streaming.
+
+        Returns ``(text, None, None)`` on a hit, ``(None, future, None)`` when
+        another caller is already producing it (see ``wait``), or
+        ``(None, None, flight)`` when this caller must produce it and then
+        call ``flight.finish(text)`` or ``flight.fail(error)``.
+        """
+        key = self.make_key(mode, system_prompt, user_message)
+        with self._lock:
+            text = self._lookup(key)
+            if text is not None:
+                self.hits += 1
+                return text, None, None
+            pending = self._inflight.get(key)
+            if pending is not None:
+                # Followers are counted only as collapsed; the leader's miss is the one upstream call
+                self.collapsed += 1
+                return None, pending, None
+            self.misses += 1
+            pending = self._inflight[key] = Future()
+            return None, None, Flight(self, key, pending)
+
+    def wait(self, pending):
+        """Return the text a concurrent caller produced; re-raises its failure."""
+        return pending.result(timeout=self.wait_timeout)
+
+    def _resolve(self, key, pending, text=None, error=None):
+        with self._lock:
+            if self._inflight.get(key) is pending:
+                del self._inflight[key]
+            if error is None:
+                self._store(key, text)
+        if error is None:
+            pending.set_result(text)
+        else:
+            pending.set_exception(error)
+
+    def get_or_compute(self, mode, system_prompt, user_message, compute):
+        """Return the cached text, or call ``compute()`` once for all concurrent callers."""
+        text, pending, flight = self.claim(mode, system_prompt, user_message)
+        if text is not None:
+            return text
+        if pending is not None:
+            return self.wait(pending)
+        try:
+            text = compute()
+        except BaseException as e:
+            flight.fail(e)
+            raise
+        flight.finish(text)
+        return text
+
+
+class Flight:
+    """The producing caller's handle on an in-flight completion.
+
+    Resolving it wakes every follower; only the first finish/fail counts, so a
+    stream can safely fail its flight again when the client disconnects.
+    """
+
+    def __init__(self, cache, key, pending):
+        self._cache = cache
+        self._key = key
+        self._pending = pending
+        self._lock = threading.Lock()
+        self._done = False
+
+    def _claim_resolution(self):
+        with self._lock:
+            if self._done:
+                return False
+            self._done = True
+            return True
+
+    def finish(self, text):
+        if self._claim_resolution():
+            self._cache._resolve(self._key, self._pending, text=text)
+
+    def fail(self, error=None):
+        if self._claim_resolution():
+            self._cache._resolve(self._key, self._pending, error=error or RuntimeError('completion abandoned'))
@@ -0,0 +1,113 @@
+import threading
+import time
+from collections import OrderedDict
+from sqlalchemy import text
+from flask import current_app
+from app import db
+import metrics
+from models import User, Conversation
+from text import normalize_arabic
+
+
+class PrefixCache:
+    """Small TTL + LRU map from a normalized prefix to its matching users.
+
+    Entries are shared by every viewer; per-viewer ranking happens on top.
+    New and renamed users show up once their prefixes expire.
+    """
+
+    def __init__(self, max_entries=10000, ttl=60):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, prefix):
+        with self._lock:
+            entry = self._entries.get(prefix)
+            if entry is not None and entry[1] > time.monotonic():
+                self._entries.move_to_end(prefix)
+                self.hits += 1
+                return entry[0]
+            self._entries.pop(prefix, None)
+            self.misses += 1
+            return None
+
+    def put(self, prefix, users):
+        if self.ttl <= 0:
+            return
+        with self._lock:
+            self._entries[prefix] = (users, time.monotonic() + self.ttl)
+            self._entries.move_to_end(prefix)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+
+def init_app(app):
+    cache = PrefixCache(app.config['SUGGEST_CACHE_MAX_ENTRIES'], app.config['SUGGEST_CACHE_TTL'])
+    app.extensions['suggest_cache'] = cache
+    metrics.register_gauge('everchat_suggest_cache_events_total', 'Contact typeahead cache lookups by outcome.',
+                           lambda: {'hit': cache.hits, 'miss': cache.misses}, label='outcome', kind='counter')
+
+
+def create_schema():
+    """Add the PostgreSQL prefix index; part of ``flask init-db``."""
+    if db.engine.dialect.name == 'postgresql':
+        # text_pattern_ops lets LIKE 'prefix%' use the index under any collation
+        with db.engine.begin() as connection:
+            connection.execute(text(
+                'CREATE INDEX IF NOT EXISTS ix_user_username_prefix ON "user" (username_normalized text_pattern_ops)'
+            ))
+
+
+def _prefix_filter(prefix):
+    column = User.username_normalized
+    if db.engine.dialect.name == 'postgresql':
+        return column.startswith(prefix, autoescape=True)
+    # Range over the binary-collated index; U+10FFFF sorts after every character
+    return db.and_(column >= prefix, column < prefix + '\U0010ffff')
+
+
+def _matching_users(prefix):
+    cache = current_app.extensions['suggest_cache']
+    users = cache.get(prefix)
+    if users is None:
+        rows = (db.session.query(User.id, User.username)
+                .filter(_prefix_filter(prefix))
+                .order_by(User.username_normalized, User.id)
+                .limit(current_app.config['SUGGEST_CANDIDATES'])
+                .all())
+        users = [(user_id, username) for user_id, username in rows]
+        cache.put(prefix, users)
+    return users
+
+
+def suggest_users(viewer_id, query, limit=None):
+    """Return up to ``limit`` (id, username, is_contact) whose username starts with ``query``.
+
+    People the viewer has talked to come first, most recent conversation first,
+    then everyone else in username order.
+    """
+    prefix = normalize_arabic(query)[:64]
+    if not prefix:
+        return []
+    limit = limit or current_app.config['SUGGEST_LIMIT']
+
+    contacts = (db.session.query(User.id, User.username)
+                .join(Conversation, Conversation.peer_id == User.id)
+                .filter(Conversation.user_id == viewer_id, Conversation.peer_id != viewer_id, _prefix_filter(prefix))
+                .order_by(Conversation.last_message_at.desc())
+                .limit(limit)
+                .all())
+    results = [(user_id, username, True) for user_id, username in contacts]
+    seen = {user_id for user_id, _, _ in results}
+    seen.add(viewer_id)
+    for user_id, username in _matching_users(prefix):
+        if len(results) >= limit:
+            break
+        if user_id not in seen:
+            results.append((user_id, username, False))
+            seen.add(user_id)
+    return results
@@ -0,0 +1,166 @@
+"""Engine settings per database backend and read replica routing.
+
+SQLite connections get WAL, relaxed fsyncs, mmap and a busy timeout, and the
+writers of a process take turns on a lock, so they queue in Python rather than
+failing with "database is locked". On PostgreSQL, views marked ``@use_replica``
+read from DATABASE_REPLICA_URL, except for a user who has just written, who
+stays on the primary for DB_REPLICA_STICKY_SECONDS so they see their own changes.
+"""
+import functools
+import logging
+import threading
+import time
+from flask import current_app, g, has_request_context, session as flask_session
+from flask_sqlalchemy.session import Session
+from sqlalchemy import event
+from sqlalchemy.engine import make_url
+from sqlalchemy.sql import Select
+import metrics
+
+logger = logging.getLogger(__name__)
+
+REPLICA_BIND = 'replica'
+# Statements that never take SQLite's write lock
+_READ_PREFIXES = ('SELECT', 'WITH', 'PRAGMA', 'EXPLAIN')
+_PRIMARY_UNTIL_KEY = '_db_primary_until'
+
+
+def use_replica(view):
+    """Let the view's plain SELECTs read from the replica, when one is configured."""
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        g._db_use_replica = True
+        return view(*args, **kwargs)
+    return wrapper
+
+
+def _replica_allowed():
+    if not has_request_context() or not g.get('_db_use_replica'):
+        return False
+    return flask_session.get(_PRIMARY_UNTIL_KEY, 0) < time.time()
+
+
+class RoutingSession(Session):
+    """Flask-SQLAlchemy's session, sending replica-eligible SELECTs to the replica bind.
+
+    Flushes, UPDATE/DELETE statements, text() queries and SELECT ... FOR UPDATE
+    always use the primary.
+    """
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if (bind is None and not self._flushing and isinstance(clause, Select)
+                and clause._for_update_arg is None and _replica_allowed()):
+            replica = self._db.engines.get(REPLICA_BIND)
+            if replica is not None:
+                return replica
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+@event.listens_for(RoutingSession, 'after_flush')
+def _note_flush(session, flush_context):
+    session.info['wrote'] = True
+
+
+@event.listens_for(RoutingSession, 'do_orm_execute')
+def _note_bulk_write(orm_execute_state):
+    if orm_execute_state.is_update or orm_execute_state.is_delete or orm_execute_state.is_insert:
+        orm_execute_state.session.info['wrote'] = True
+
+
+@event.listens_for(RoutingSession, 'after_commit')
+def _stick_to_primary(session):
+    if session.info.pop('wrote', False) and has_request_context() and REPLICA_BIND in session._db.engines:
+        # Kept in the cookie so it holds whichever worker serves the next request
+        flask_session[_PRIMARY_UNTIL_KEY] = time.time() + current_app.config['DB_REPLICA_STICKY_SECONDS']
+
+
+@event.listens_for(RoutingSession, 'after_soft_rollback')
+def _forget_writes(session, previous_transaction):
+    session.info.pop('wrote', None)
+
+
+def configure_engines(app):
+    """Fill in engine options and the replica bind; call before ``db.init_app``.
+
+    Settings passed to create_app() explicitly are left alone.
+    """
+    url = make_url(app.config['SQLALCHEMY_DATABASE_URI'])
+    options = {'pool_recycle': 300, 'pool_pre_ping': True}
+    if url.get_backend_name() != 'sqlite':
+        options.update(
+            pool_size=app.config['DB_POOL_SIZE'],
+            max_overflow=app.config['DB_MAX_OVERFLOW'],
+            pool_timeout=app.config['DB_POOL_TIMEOUT_SECONDS'],
+        )
+    app.config.setdefault('SQLALCHEMY_ENGINE_OPTIONS', options)
+
+    replica_url = app.config['DATABASE_REPLICA_URL']
+    if replica_url:
+        binds = app.config.setdefault('SQLALCHEMY_BINDS', {})
+        binds.setdefault(REPLICA_BIND, {
+            **options,
+            'url': replica_url,
+            'pool_size': app.config['DB_REPLICA_POOL_SIZE'],
+        })
+
+
+def _setup_sqlite(engine, app):
+    # busy_timeout first, so switching to WAL waits out other workers doing the same
+    pragmas = (
+        f"PRAGMA busy_timeout={app.config['SQLITE_BUSY_TIMEOUT_MS']}",
+        'PRAGMA journal_mode=WAL',
+        'PRAGMA synchronous=NORMAL',
+        f"PRAGMA mmap_size={app.config['SQLITE_MMAP_SIZE']}",
+    )
+    lock_timeout = app.config['SQLITE_BUSY_TIMEOUT_MS'] / 1000
+    write_lock = threading.Lock()
+
+    def set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for pragma in pragmas:
+            cursor.execute(pragma)
+        cursor.close()
+
+    # pysqlite only opens a transaction at the first write, so the lock is
+    # held over the same span as SQLite's own RESERVED lock
+    def take_write_lock(conn, cursor, statement, parameters, context, executemany):
+        if conn.info.get('write_lock') or statement.lstrip()[:7].upper().startswith(_READ_PREFIXES):
+            return
+        if write_lock.acquire(timeout=lock_timeout):
+            conn.info['write_lock'] = True
+        else:
+            # Fall back to SQLite's busy timeout rather than failing here
+            logger.warning('Waited %.1fs for the SQLite write lock; writing without it', lock_timeout)
+
+    def release_write_lock(conn, *args):
+        if conn.info.pop('write_lock', False):
+            write_lock.release()
+
+    def release_on_reset(dbapi_connection, connection_record, reset_state):
+        release_write_lock(connection_record)
+
+    def release_on_invalidate(dbapi_connection, connection_record, exception):
+        release_write_lock(connection_record)
+
+    event.listen(engine, 'connect', set_pragmas)
+    event.listen(engine, 'before_cursor_execute', take_write_lock)
+    event.listen(engine, 'commit', release_write_lock)
+    event.listen(engine, 'rollback', release_write_lock)
+    # A connection invalidated or returned mid-transaction must not keep the lock
+    event.listen(engine.pool, 'reset', release_on_reset)
+    event.listen(engine.pool, 'invalidate', release_on_invalidate)
+
+
+def init_app(app):
+    """Attach per-backend engine hooks; call after ``db.init_app``. Opens no connections."""
+    with app.app_context():
+        engines = app.extensions['sqlalchemy'].engines
+    for engine in engines.values():
+        if engine.dialect.name == 'sqlite':
+            _setup_sqlite(engine, app)
+
+    def pool_usage():
+        return {key or 'primary': engine.pool.checkedout()
+                for key, engine in engines.items() if hasattr(engine.pool, 'checkedout')}
+    metrics.register_gauge('everchat_db_pool_checked_out', 'Pooled database connections in use, per bind.',
+                           pool_usage, label='bind')
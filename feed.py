@@ -0,0 +1,129 @@
+from markupsafe import Markup
+from sqlalchemy import func
+from sqlalchemy.orm import joinedload
+from flask import current_app
+from app import db
+from models import Post, Like, Comment
+from pagination import keyset_page
+import fragments
+import images
+
+# Stands in for the viewer's heart icon class in cached cards; user text is
+# escaped, so it can't contain this
+HEART_SLOT = '<!--heart-->'
+
+
+class PostCard:
+    """A post plus the aggregates its card needs, loaded for a whole page at once."""
+    __slots__ = ('post', 'like_count', 'comment_count', 'liked', 'comments', 'html')
+
+    def __init__(self, post):
+        self.post = post
+        self.like_count = 0
+        self.comment_count = 0
+        self.liked = False
+        self.comments = []
+        self.html = None
+
+
+def load_feed_page(cursor=None, limit=None):
+    """Return one page of the home feed, newest first, and the cursor for the next page."""
+    limit = limit or current_app.config['FEED_PAGE_SIZE']
+    query = Post.query.options(joinedload(Post.author))
+    return keyset_page(query, Post.created_at, Post.id, cursor, limit)
+
+
+def load_profile_page(user_id, cursor=None, limit=None):
+    """Return one page of ``user_id``'s posts, newest first, and the cursor for the next page."""
+    limit = limit or current_app.config['PROFILE_PAGE_SIZE']
+    query = Post.query.filter_by(user_id=user_id)
+    return keyset_page(query, Post.created_at, Post.id, cursor, limit)
+
+
+def _liked_post_ids(user, post_ids):
+    rows = db.session.query(Like.post_id).filter(
+        Like.user_id == user.id, Like.post_id.in_(post_ids)
+    ).all()
+    return {post_id for post_id, in rows}
+
+
+def _comment_previews(post_ids, per_post):
+    """Return the first ``per_post`` comments of each post, grouped by post id."""
+    ranked = db.session.query(
+        Comment.id,
+        func.row_number().over(
+            partition_by=Comment.post_id,
+            order_by=(Comment.created_at, Comment.id)
+        ).label('rank')
+    ).filter(Comment.post_id.in_(post_ids)).subquery()
+
+    comments = Comment.query.join(ranked, Comment.id == ranked.c.id).filter(
+        ranked.c.rank <= per_post
+    ).options(joinedload(Comment.author)).order_by(Comment.created_at, Comment.id).all()
+
+    previews = {}
+    for comment in comments:
+        previews.setdefault(comment.post_id, []).append(comment)
+    return previews
+
+
+def _fragment_key(post, with_comments, authenticated):
+    # Each part of the key is something the cached HTML depends on
+    if with_comments:
+        ready = post.image_filename is not None and images.variant_ready(post.image_filename, 'feed')
+        return f'card:{post.id}:{post.render_version}:{post.author.profile_version}:{int(ready)}:{int(authenticated)}'
+    ready = post.image_filename is not None and images.variant_ready(post.image_filename, 'thumb')
+    return f'thumb:{post.id}:{post.render_version}:{int(ready)}'
+
+
+def _render_fragments(cards, with_comments, authenticated):
+    if with_comments:
+        template = current_app.jinja_env.get_template('_post_card.html')
+        return [template.render(card=card, authenticated=authenticated, heart_class=Markup(HEART_SLOT))
+                for card in cards]
+    template = current_app.jinja_env.get_template('_post_thumb.html')
+    return [template.render(card=card) for card in cards]
+
+
+def load_post_cards(posts, viewer, with_comments=True):
+    """Wrap ``posts`` in PostCards with their rendered HTML, using a fixed number of grouped queries.
+
+    Counts come from the denormalized Post columns; the viewer's likes and
+    comment previews are each fetched for the whole page in one query instead
+    of once per post. Card HTML comes from the fragment cache, keyed by the
+    post's render_version and its author's profile_version, so comment
+    previews are only loaded and rendered for cards that missed. Only the
+    heart icon is filled in per viewer.
+    """
+    cards = [PostCard(post) for post in posts]
+    if not cards:
+        return cards
+    post_ids = [post.id for post in posts]
+    authenticated = viewer.is_authenticated
+
+    liked = _liked_post_ids(viewer, post_ids) if authenticated else set()
+    for card in cards:
+        card.like_count = card.post.like_count
+        card.comment_count = card.post.comment_count
+        card.liked = card.post.id in liked
+
+    keys = [_fragment_key(card.post, with_comments, authenticated) for card in cards]
+    cached = fragments.get_many(keys)
+    missing = [(key, card) for key, card in zip(keys, cards) if key not in cached]
+    if missing:
+        missing_cards = [card for _, card in missing]
+        if with_comments:
+            previews = _comment_previews([card.post.id for card in missing_cards],
+                                         current_app.config['COMMENT_PREVIEW_SIZE'])
+            for card in missing_cards:
+                card.comments = previews.get(card.post.id, [])
+        rendered = dict(zip((key for key, _ in missing), _render_fragments(missing_cards, with_comments, authenticated)))
+        fragments.set_many(rendered)
+        cached.update(rendered)
+
+    for key, card in zip(keys, cards):
+        html = cached[key]
+        if authenticated:
+            html = html.replace(HEART_SLOT, 'fas text-danger' if card.liked else 'far', 1)
+        card.html = Markup(html)
+    return cards
@@ -0,0 +1,131 @@
+import logging
+import threading
+from collections import OrderedDict
+from flask import current_app
+import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class FragmentBackend:
+    """Storage for rendered HTML fragments.
+
+    Keys embed the version of everything the fragment shows, so an entry never
+    needs to be purged; superseded versions just age out.
+    """
+
+    def get_many(self, keys):
+        """Return {key: html} for the keys that are stored."""
+        raise NotImplementedError
+
+    def set_many(self, fragments):
+        raise NotImplementedError
+
+
+class LocalFragmentBackend(FragmentBackend):
+    """LRU map in this process's memory."""
+
+    def __init__(self, max_entries=5000):
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+
+    def get_many(self, keys):
+        found = {}
+        with self._lock:
+            for key in keys:
+                html = self._entries.get(key)
+                if html is not None:
+                    self._entries.move_to_end(key)
+                    found[key] = html
+        return found
+
+    def set_many(self, fragments):
+        with self._lock:
+            for key, html in fragments.items():
+                self._entries[key] = html
+                self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+
+class RedisFragmentBackend(FragmentBackend):
+    """Shared by every worker process; entries expire after ``ttl`` seconds."""
+
+    KEY_PREFIX = 'everchat:fragment:'
+
+    def __init__(self, url, ttl=86400):
+        import redis
+        self._redis = redis.Redis.from_url(url)
+        self.ttl = ttl
+
+    def get_many(self, keys):
+        values = self._redis.mget([self.KEY_PREFIX + key for key in keys])
+        return {key: value.decode() for key, value in zip(keys, values) if value is not None}
+
+    def set_many(self, fragments):
+        pipeline = self._redis.pipeline(transaction=False)
+        for key, html in fragments.items():
+            pipeline.set(self.KEY_PREFIX + key, html, ex=self.ttl)
+        pipeline.execute()
+
+
+class FragmentCache:
+    """Counts hits and misses around a backend; backend errors count as misses."""
+
+    def __init__(self, backend):
+        self.backend = backend
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.errors = 0
+
+    def get_many(self, keys):
+        try:
+            found = self.backend.get_many(keys) if keys else {}
+        except Exception as e:
+            logger.warning('Fragment cache read failed: %s', e)
+            found = {}
+            self._count(errors=1)
+        self._count(hits=len(found), misses=len(keys) - len(found))
+        return found
+
+    def set_many(self, fragments):
+        if not fragments:
+            return
+        try:
+            self.backend.set_many(fragments)
+        except Exception as e:
+            logger.warning('Fragment cache write failed: %s', e)
+            self._count(errors=1)
+
+    def _count(self, hits=0, misses=0, errors=0):
+        with self._lock:
+            self.hits += hits
+            self.misses += misses
+            self.errors += errors
+
+
+def init_app(app):
+    url = app.config.get('FRAGMENT_CACHE_URL')
+    if url and url.startswith('redis://'):
+        try:
+            backend = RedisFragmentBackend(url, app.config['FRAGMENT_CACHE_TTL'])
+        except ImportError as e:
+            raise RuntimeError('FRAGMENT_CACHE_URL is a redis:// URL but the redis package is not installed; '
+                               'run `pip install redis` or unset FRAGMENT_CACHE_URL') from e
+    else:
+        backend = LocalFragmentBackend(app.config['FRAGMENT_CACHE_MAX_ENTRIES'])
+    cache = FragmentCache(backend)
+    app.extensions['fragments'] = cache
+    metrics.register_gauge('everchat_fragment_cache_events_total', 'Rendered post card cache lookups by outcome.',
+                           lambda: {'hit': cache.hits, 'miss': cache.misses, 'error': cache.errors},
+                           label='outcome', kind='counter')
+
+
+def get_many(keys):
+    return current_app.extensions['fragments'].get_many(keys)
+
+
+def set_many(fragments):
+    current_app.extensions['fragments'].set_many(fragments)
@@ -0,0 +1,180 @@
+import math
+from datetime import datetime, timedelta
+from sqlalchemy import and_, or_
+from sqlalchemy.orm import joinedload
+from flask import current_app
+from app import db
+import broker
+from models import UserLocation, SOSAlert
+
+GEOHASH_PRECISION = 9
+MAX_COVERING_CELLS = 32
+EARTH_RADIUS_KM = 6371.0
+_KM_PER_DEGREE = 111.32
+_BASE32 = '0123456789bcdefghjkmnpqrstuvwxyz'
+# Sorts after every geohash character, so [prefix, prefix + _PREFIX_END) is a prefix range
+_PREFIX_END = '{'
+
+
+def valid_coordinates(latitude, longitude):
+    return (
+        isinstance(latitude, (int, float)) and isinstance(longitude, (int, float))
+        and -90 <= latitude <= 90 and -180 <= longitude <= 180
+    )
+
+
+def encode(latitude, longitude, precision=GEOHASH_PRECISION):
+    lat_range = [-90.0, 90.0]
+    lon_range = [-180.0, 180.0]
+    chars = []
+    bits = bit_count = 0
+    even = True
+    while len(chars) < precision:
+        bounds, value = (lon_range, longitude) if even else (lat_range, latitude)
+        mid = (bounds[0] + bounds[1]) / 2
+        if value >= mid:
+            bits = bits * 2 + 1
+            bounds[0] = mid
+        else:
+            bits = bits * 2
+            bounds[1] = mid
+        even = not even
+        bit_count += 1
+        if bit_count == 5:
+            chars.append(_BASE32[bits])
+            bits = bit_count = 0
+    return ''.join(chars)
+
+
+def _cell_degrees(precision):
+    """(height, width) of a geohash cell in degrees of latitude and longitude."""
+    lon_bits = (5 * precision + 1) // 2
+    lat_bits = 5 * precision // 2
+    return 180.0 / 2 ** lat_bits, 360.0 / 2 ** lon_bits
+
+
+def haversine_km(lat1, lon1, lat2, lon2):
+    phi1, phi2 = math.radians(lat1), math.radians(lat2)
+    dphi = phi2 - phi1
+    dlambda = math.radians(lon2 - lon1)
+    a = math.sin(dphi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(dlambda / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(math.sqrt(min(1.0, a)))
+
+
+def covering_cells(latitude, longitude, radius_km):
+    """Geohash prefixes whose union contains every point within ``radius_km``.
+
+    Covers the circle's bounding box with the finest cells that keep the
+    number of prefix ranges at or below MAX_COVERING_CELLS.
+    """
+    dlat = radius_km / _KM_PER_DEGREE
+    dlon = radius_km / (_KM_PER_DEGREE * max(math.cos(math.radians(latitude)), 1e-6))
+    south = max(-90.0, latitude - dlat)
+    north = min(90.0, latitude + dlat)
+
+    for precision in range(GEOHASH_PRECISION, 0, -1):
+        height, width = _cell_degrees(precision)
+        total_columns = round(360.0 / width)
+        first_row = int((south + 90.0) // height)
+        last_row = min(int((north + 90.0) // height), round(180.0 / height) - 1)
+        if 2 * dlon >= 360.0:
+            columns = range(total_columns)
+        else:
+            first_column = int((longitude - dlon + 180.0) // width)
+            last_column = int((longitude + dlon + 180.0) // width)
+            columns = [column % total_columns for column in range(first_column, last_column + 1)]
+        if precision > 1 and (last_row - first_row + 1) * len(columns) > MAX_COVERING_CELLS:
+            continue
+        return sorted({
+            encode(-90.0 + (row + 0.5) * height, -180.0 + (column + 0.5) * width, precision)
+            for row in range(first_row, last_row + 1)
+            for column in columns
+        })
+
+
+def _in_cells(column, cells):
+    return or_(*(and_(column >= cell, column < cell + _PREFIX_END) for cell in cells))
+
+
+def record_location(user_id, latitude, longitude):
+    """Upsert a user's last-known position. The caller commits."""
+    location = UserLocation.query.filter_by(user_id=user_id).first()
+    if location is None:
+        location = UserLocation(user_id=user_id)
+        db.session.add(location)
+    location.latitude = latitude
+    location.longitude = longitude
+    location.geohash = encode(latitude, longitude)
+    location.updated_at = datetime.utcnow()
+    return location
+
+
+def users_near(latitude, longitude, radius_km, exclude_user_id=None):
+    """Return (row, distance_km) pairs within ``radius_km``, nearest first.
+
+    Rows carry user_id, latitude and longitude only, since callers fan out to
+    many users at once. Positions older than LOCATION_MAX_AGE_HOURS are ignored.
+    """
+    cutoff = datetime.utcnow() - timedelta(hours=current_app.config['LOCATION_MAX_AGE_HOURS'])
+    query = db.session.query(UserLocation.user_id, UserLocation.latitude, UserLocation.longitude).filter(
+        _in_cells(UserLocation.geohash, covering_cells(latitude, longitude, radius_km)),
+        UserLocation.updated_at >= cutoff
+    )
+    if exclude_user_id is not None:
+        query = query.filter(UserLocation.user_id != exclude_user_id)
+
+    nearby = []
+    for location in query.limit(current_app.config['GEO_MAX_CANDIDATES']):
+        distance = haversine_km(latitude, longitude, location.latitude, location.longitude)
+        if distance <= radius_km:
+            nearby.append((location, distance))
+    nearby.sort(key=lambda pair: pair[1])
+    return nearby
+
+
+def alerts_near(latitude, longitude, radius_km, limit=None):
+    """Return (SOSAlert, distance_km) pairs for recent active alerts, nearest first."""
+    limit = limit or current_app.config['NEARBY_ALERTS_LIMIT']
+    cutoff = datetime.utcnow() - timedelta(hours=current_app.config['SOS_ACTIVE_HOURS'])
+    query = (SOSAlert.query
+             .options(joinedload(SOSAlert.user))
+             .filter(
+                 SOSAlert.status == 'active',
+                 _in_cells(SOSAlert.geohash, covering_cells(latitude, longitude, radius_km)),
+                 SOSAlert.created_at >= cutoff
+             ))
+
+    nearby = []
+    for alert in query.limit(current_app.config['GEO_MAX_CANDIDATES']):
+        distance = haversine_km(latitude, longitude, alert.latitude, alert.longitude)
+        if distance <= radius_km:
+            nearby.append((alert, distance))
+    nearby.sort(key=lambda pair: pair[1])
+    return nearby[:limit]
+
+
+def alert_payload(alert, distance_km=None):
+    payload = {
+        'id': alert.id,
+        'username': alert.user.username,
+        'latitude': alert.latitude,
+        'longitude': alert.longitude,
+        'message': alert.message,
+        'created_at': alert.created_at.isoformat()
+    }
+    if distance_km is not None:
+        payload['distance_km'] = round(distance_km, 2)
+    return payload
+
+
+def broadcast_sos(alert):
+    """Push a committed alert to every user last seen within SOS_RADIUS_KM of it.
+
+    Returns the number of users notified.
+    """
+    if alert.geohash is None:
+        return 0
+    nearby = users_near(alert.latitude, alert.longitude, current_app.config['SOS_RADIUS_KM'], exclude_user_id=alert.user_id)
+    for location, distance in nearby:
+        broker.publish(location.user_id, 'sos', alert_payload(alert, distance))
+    return len(nearby)
@@ -0,0 +1,68 @@
+# Gunicorn settings, picked up automatically from the working directory
+import importlib.util
+import os
+import subprocess
+import sys
+
+bind = os.environ.get("GUNICORN_BIND", "0.0.0.0:5000")
+workers = int(os.environ.get("WEB_CONCURRENCY", 2))
+
+# /api/stream keeps connections open for minutes. With gevent each idle stream is a
+# cheap greenlet instead of a pinned worker thread, so use it whenever it is installed.
+if importlib.util.find_spec("gevent"):
+    worker_class = "gevent"
+    worker_connections = int(os.environ.get("GUNICORN_WORKER_CONNECTIONS", 1000))
+else:
+    worker_class = "gthread"
+    threads = int(os.environ.get("GUNICORN_THREADS", 8))
+    # Each open stream pins a thread here, so keep half of them for ordinary requests
+    os.environ.setdefault("SSE_MAX_STREAMS", str(max(1, threads // 2)))
+
+# Under gevent an in-process job thread is a greenlet in the web worker, and a tile
+# pack build's blocking file I/O would stall every request on it. Run the job queue
+# in separate `flask run-worker` processes, started and stopped with the server.
+job_worker_processes = int(os.environ.get("JOB_WORKER_PROCESSES", 1 if worker_class == "gevent" else 0))
+if job_worker_processes:
+    os.environ.setdefault("JOB_WORKER_THREADS", "0")
+_job_workers = []
+
+# GUNICORN_PRELOAD=1 builds the app once in the master and forks warm workers.
+# create_app() opens no connections or threads, so nothing is shared across the
+# fork. Prefer it with gthread; gevent patches modules only after the fork.
+preload_app = os.environ.get("GUNICORN_PRELOAD", "0") == "1"
+
+
+def on_starting(server):
+    if worker_class != "gevent":
+        server.log.warning(
+            "gevent is not installed; serving with gthread and at most %s open event streams per worker. "
+            "Install the requirements (gevent is listed) for long-lived streams.", os.environ["SSE_MAX_STREAMS"]
+        )
+
+
+def post_fork(server, worker):
+    # psycopg2 waits on its socket in C, which would block every greenlet in the
+    # worker; psycogreen makes it yield to the gevent hub instead
+    if worker_class == "gevent" and importlib.util.find_spec("psycopg2"):
+        if importlib.util.find_spec("psycogreen"):
+            from psycogreen.gevent import patch_psycopg
+            patch_psycopg()
+        else:
+            server.log.warning("psycogreen is not installed; PostgreSQL queries will block other requests in the worker")
+
+
+def when_ready(server):
+    for _ in range(job_worker_processes):
+        _job_workers.append(subprocess.Popen([sys.executable, "-m", "flask", "--app", server.app.app_uri, "run-worker"]))
+    if _job_workers:
+        server.log.info("Started %d job worker processes", len(_job_workers))
+
+
+def on_exit(server):
+    for process in _job_workers:
+        process.terminate()
+    for process in _job_workers:
+        try:
+            process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            process.kill()
@@ -0,0 +1,169 @@
+import hashlib
+import logging
+import os
+import threading
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from flask import current_app, url_for
+
+logger = logging.getLogger(__name__)
+
+# Longest edge in pixels for each generated variant
+VARIANT_SIZES = {
+    'thumb': 320,
+    'feed': 1080,
+    'full': 2048,
+}
+VARIANT_FORMAT = 'webp'
+
+# Animated GIFs would lose their frames, so they are always served as uploaded
+_NO_VARIANTS = {'gif'}
+
+
+def variant_filename(filename, variant):
+    stem = filename.rsplit('.', 1)[0]
+    return f"{stem}_{variant}.{VARIANT_FORMAT}"
+
+
+def store_upload(file, extension):
+    """Save an upload under the SHA-256 of its contents and return the filename.
+
+    The file is hashed while it is streamed to disk; if identical content was
+    uploaded before, the new copy is discarded and the existing name reused.
+    """
+    upload_dir = current_app.config['UPLOAD_FOLDER']
+    temp_path = os.path.join(upload_dir, f".upload-{uuid.uuid4().hex}")
+    digest = hashlib.sha256()
+    try:
+        with open(temp_path, 'wb') as out:
+            for chunk in iter(lambda: file.stream.read(64 * 1024), b''):
+                digest.update(chunk)
+                out.write(chunk)
+    except BaseException:
+        # Aborted uploads and RequestEntityTooLarge mid-read must not leave orphans behind
+        os.remove(temp_path)
+        raise
+
+    filename = f"{digest.hexdigest()}.{extension}"
+    path = os.path.join(upload_dir, filename)
+    if os.path.exists(path):
+        os.remove(temp_path)
+    else:
+        os.replace(temp_path, path)
+    return filename
+
+
+def _render_variants(path, upload_dir, filename):
+    # Runs in a worker process
+    from PIL import Image, ImageOps
+
+    with Image.open(path) as original:
+        image = ImageOps.exif_transpose(original)
+        if image.mode not in ('RGB', 'RGBA'):
+            image = image.convert('RGBA' if 'transparency' in image.info else 'RGB')
+        for variant, size in VARIANT_SIZES.items():
+            target = os.path.join(upload_dir, variant_filename(filename, variant))
+            if os.path.exists(target):
+                continue
+            resized = image.copy()
+            resized.thumbnail((size, size))
+            temp_target = f"{target}.{os.getpid()}.tmp"
+            resized.save(temp_target, format=VARIANT_FORMAT, quality=82, method=4)
+            os.replace(temp_target, target)
+    return filename
+
+
+class VariantPipeline:
+    """Generates resized variants on a bounded process pool, off the request thread.
+
+    At most ``max_pending`` uploads wait for a worker; beyond that new uploads are
+    served as originals and can be processed later with ``flask build-image-variants``.
+    """
+
+    MAX_REMEMBERED = 100000
+
+    def __init__(self, upload_dir, max_workers=2, max_pending=64):
+        self.upload_dir = upload_dir
+        self.max_workers = max_workers
+        self._pending = threading.BoundedSemaphore(max_pending)
+        self._executor = None
+        self._executor_pid = None
+        self._lock = threading.Lock()
+        self._ready = set()
+
+    @property
+    def executor(self):
+        # Created lazily in each worker so a preloaded parent never forks a live pool
+        with self._lock:
+            if self._executor is None or self._executor_pid != os.getpid():
+                self._executor = ProcessPoolExecutor(max_workers=self.max_workers)
+                self._executor_pid = os.getpid()
+            return self._executor
+
+    def schedule(self, filename):
+        """Queue variant generation for ``filename``; returns False if it was skipped."""
+        if filename.rsplit('.', 1)[-1].lower() in _NO_VARIANTS or not self._pending.acquire(blocking=False):
+            return False
+        try:
+            future = self.executor.submit(
+                _render_variants, os.path.join(self.upload_dir, filename), self.upload_dir, filename
+            )
+        except Exception as e:
+            self._pending.release()
+            logger.warning('Could not schedule image variants for %s: %s', filename, e)
+            return False
+        future.add_done_callback(self._finished)
+        return True
+
+    def _finished(self, future):
+        self._pending.release()
+        error = future.exception()
+        if error is not None:
+            logger.warning('Image variant generation failed: %s', error)
+
+    def render_now(self, filename):
+        """Generate variants synchronously, for the backfill command."""
+        if filename.rsplit('.', 1)[-1].lower() in _NO_VARIANTS:
+            return
+        _render_variants(os.path.join(self.upload_dir, filename), self.upload_dir, filename)
+
+    def is_ready(self, filename, variant):
+        """Whether ``variant`` of ``filename`` has been generated yet."""
+        name = variant_filename(filename, variant)
+        if name in self._ready:
+            return True
+        if os.path.exists(os.path.join(self.upload_dir, name)):
+            # Variants are content-addressed and never change once written
+            if len(self._ready) >= self.MAX_REMEMBERED:
+                self._ready.clear()
+            self._ready.add(name)
+            return True
+        return False
+
+    def url(self, filename, variant):
+        """URL of a variant if it has been generated, otherwise of the original upload."""
+        if self.is_ready(filename, variant):
+            return url_for('main.uploaded_file', filename=variant_filename(filename, variant))
+        return url_for('main.uploaded_file', filename=filename)
+
+
+def init_app(app):
+    pipeline = VariantPipeline(
+        app.config['UPLOAD_FOLDER'],
+        max_workers=app.config['IMAGE_WORKERS'],
+        max_pending=app.config['IMAGE_MAX_PENDING']
+    )
+    app.extensions['images'] = pipeline
+    app.jinja_env.globals['image_url'] = pipeline.url
+
+
+def variant_ready(filename, variant):
+    return current_app.extensions['images'].is_ready(filename, variant)
+
+
+def schedule_variants(filename):
+    return current_app.extensions['images'].schedule(filename)
+
+
+def image_url(filename, variant):
+    return current_app.extensions['images'].url(filename, variant)
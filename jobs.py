@@ -0,0 +1,238 @@
+import json
+import logging
+import os
+import random
+import socket
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta
+from sqlalchemy import and_, event, func, or_, update
+from sqlalchemy.orm import Session
+from flask import current_app
+from app import db
+from models import Job
+import metrics
+
+logger = logging.getLogger(__name__)
+
+_handlers = {}
+# Set after a commit that enqueued jobs, so in-process workers start without waiting a poll interval
+_wake = threading.Event()
+_inline_lock = threading.Lock()
+_inline_pid = None
+
+
+def handler(kind):
+    """Register ``func(job)`` as the handler for jobs of ``kind``.
+
+    Handlers run inside the worker's transaction, which commits on success and
+    rolls back on any exception before the job is scheduled for a retry.
+    """
+    def register(func):
+        _handlers[kind] = func
+        return func
+    return register
+
+
+def enqueue(kind, payload, idempotency_key=None, delay_seconds=0, max_attempts=None):
+    """Add a job to the current transaction and return it. The caller commits.
+
+    If a job with the same ``idempotency_key`` exists it is returned instead,
+    so retried requests and handlers never enqueue the same work twice.
+    """
+    if idempotency_key is not None:
+        existing = Job.query.filter_by(idempotency_key=idempotency_key).first()
+        if existing is not None:
+            return existing
+
+    job = Job(
+        kind=kind,
+        payload=json.dumps(payload),
+        idempotency_key=idempotency_key,
+        max_attempts=max_attempts or current_app.config['JOB_MAX_ATTEMPTS'],
+        run_at=datetime.utcnow() + timedelta(seconds=delay_seconds)
+    )
+    db.session.add(job)
+    db.session.info['jobs_enqueued'] = True
+    return job
+
+
+@event.listens_for(Session, 'after_commit')
+def _wake_workers(session):
+    if session.info.pop('jobs_enqueued', False):
+        _wake.set()
+
+
+def _backoff_seconds(attempts):
+    delay = min(current_app.config['JOB_BACKOFF_MAX_SECONDS'], current_app.config['JOB_BACKOFF_BASE_SECONDS'] * 2 ** (attempts - 1))
+    # Jittered so jobs that failed together don't retry together
+    return delay * random.uniform(0.5, 1.0)
+
+
+class Worker:
+    """Claims due jobs in batches and runs each in its own transaction.
+
+    Any number of workers, in threads or separate ``flask run-worker``
+    processes, can share the table: a batch is claimed with a conditional
+    UPDATE (and SKIP LOCKED on PostgreSQL), and a job whose worker died is
+    reclaimed once its lock is older than JOB_LOCK_TIMEOUT_SECONDS.
+    """
+
+    def __init__(self, batch_size=None, poll_seconds=None, name=None):
+        # Threads run outside the creating context, so keep the app itself
+        self.app = current_app._get_current_object()
+        self.batch_size = batch_size or current_app.config['JOB_BATCH_SIZE']
+        self.poll_seconds = poll_seconds or current_app.config['JOB_POLL_SECONDS']
+        self.name = name or f'{socket.gethostname()}:{os.getpid()}:{threading.get_ident()}'
+        self._stop = threading.Event()
+
+    def stop(self):
+        self._stop.set()
+        _wake.set()
+
+    def run(self):
+        with self.app.app_context():
+            while not self._stop.is_set():
+                try:
+                    processed = self.run_once()
+                except Exception:
+                    db.session.rollback()
+                    logger.exception('Job worker %s failed to process a batch', self.name)
+                    processed = 0
+                if not processed:
+                    _wake.wait(self.poll_seconds)
+                    _wake.clear()
+
+    def run_once(self):
+        """Claim and run one batch; returns the number of jobs processed."""
+        jobs = self._claim()
+        if not jobs:
+            return 0
+        started = time.monotonic()
+        failed = sum(0 if self._execute(job) else 1 for job in jobs)
+        logger.info('Worker %s processed %d jobs (%d failed) in %.2fs',
+                    self.name, len(jobs), failed, time.monotonic() - started)
+        return len(jobs)
+
+    def _claim(self):
+        now = datetime.utcnow()
+        stale = now - timedelta(seconds=current_app.config['JOB_LOCK_TIMEOUT_SECONDS'])
+        due = or_(
+            and_(Job.status == 'pending', Job.run_at <= now),
+            and_(Job.status == 'running', Job.locked_at < stale)
+        )
+        ids = [job_id for job_id, in (
+            db.session.query(Job.id)
+            .filter(due)
+            .order_by(Job.run_at)
+            .limit(self.batch_size)
+            .with_for_update(skip_locked=True)
+        )]
+        if not ids:
+            db.session.rollback()
+            return []
+
+        token = f'{self.name}:{uuid.uuid4().hex[:8]}'
+        db.session.execute(
+            update(Job)
+            .where(Job.id.in_(ids), due)
+            .values(status='running', locked_by=token, locked_at=now, attempts=Job.attempts + 1)
+            .execution_options(synchronize_session=False)
+        )
+        db.session.commit()
+        return Job.query.filter(Job.locked_by == token, Job.status == 'running').order_by(Job.run_at).all()
+
+    def _execute(self, job):
+        job_id = job.id
+        try:
+            func = _handlers.get(job.kind)
+            if func is None:
+                raise LookupError(f'no handler registered for {job.kind!r}')
+            func(job)
+            job.status = 'done'
+            job.finished_at = datetime.utcnow()
+            job.locked_by = None
+            job.last_error = None
+            db.session.commit()
+            return True
+        except Exception as e:
+            db.session.rollback()
+            job = db.session.get(Job, job_id)
+            job.last_error = f'{type(e).__name__}: {e}'
+            job.locked_by = None
+            if job.attempts >= job.max_attempts:
+                job.status = 'failed'
+                job.finished_at = datetime.utcnow()
+                logger.error('Job %s (%s) failed permanently: %s', job_id, job.kind, e)
+            else:
+                job.status = 'pending'
+                job.run_at = datetime.utcnow() + timedelta(seconds=_backoff_seconds(job.attempts))
+                logger.warning('Job %s (%s) failed, retrying: %s', job_id, job.kind, e)
+            db.session.commit()
+            return False
+
+
+def _start_inline_workers():
+    """Run JOB_WORKER_THREADS workers inside each web process.
+
+    Set JOB_WORKER_THREADS=0 when dedicated ``flask run-worker`` processes
+    are deployed instead.
+    """
+    global _inline_pid
+    if _inline_pid == os.getpid() or current_app.config['JOB_WORKER_THREADS'] <= 0:
+        return
+    with _inline_lock:
+        if _inline_pid == os.getpid():
+            return
+        for index in range(current_app.config['JOB_WORKER_THREADS']):
+            threading.Thread(target=Worker().run, name=f'job-worker-{index}', daemon=True).start()
+        _inline_pid = os.getpid()
+
+
+def _percentile(ordered, pct):
+    if not ordered:
+        return None
+    return round(ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))], 3)
+
+
+def _oldest_due_seconds():
+    now = datetime.utcnow()
+    oldest_due = db.session.query(func.min(Job.run_at)).filter(Job.status == 'pending', Job.run_at <= now).scalar()
+    return round((now - oldest_due).total_seconds(), 3) if oldest_due else 0
+
+
+def queue_stats(window_minutes=15):
+    """Queue depth by status and pickup-to-done latency of recently finished jobs."""
+    now = datetime.utcnow()
+    stats = {status: 0 for status in ('pending', 'running', 'done', 'failed')}
+    stats.update(db.session.query(Job.status, func.count(Job.id)).group_by(Job.status).all())
+
+    stats['oldest_due_seconds'] = _oldest_due_seconds()
+
+    recent = (db.session.query(Job.created_at, Job.finished_at)
+              .filter(Job.status == 'done', Job.finished_at >= now - timedelta(minutes=window_minutes))
+              .order_by(Job.finished_at.desc())
+              .limit(1000))
+    latencies = sorted((finished - created).total_seconds() for created, finished in recent)
+    stats['latency_p50_seconds'] = _percentile(latencies, 50)
+    stats['latency_p95_seconds'] = _percentile(latencies, 95)
+    stats['latency_max_seconds'] = round(latencies[-1], 3) if latencies else None
+    return stats
+
+
+def _queue_depth():
+    rows = (db.session.query(Job.status, func.count(Job.id))
+            .filter(Job.status.in_(('pending', 'running', 'failed')))
+            .group_by(Job.status))
+    depth = {status: 0 for status in ('pending', 'running', 'failed')}
+    depth.update(rows.all())
+    return depth
+
+
+metrics.register_gauge('everchat_jobs', 'Background jobs by status (done jobs are not counted).', _queue_depth, label='status')
+metrics.register_gauge('everchat_jobs_oldest_due_seconds', 'Age of the oldest job waiting to run.', _oldest_due_seconds)
+
+
+def init_app(app):
+    app.before_request(_start_inline_workers)
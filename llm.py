@@ -0,0 +1,270 @@
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from flask import current_app
+from completion_cache import CompletionCache
+import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class LLMUnavailable(Exception):
+    """Raised when a completion cannot be served; callers show their fallback text."""
+
+
+class CircuitBreaker:
+    """Stops calling upstream after repeated failures, then lets one trial through."""
+
+    def __init__(self, failure_threshold, reset_seconds):
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self._lock = threading.Lock()
+        self._failures = 0
+        self._opened_at = None
+        self._trial_in_flight = False
+
+    @property
+    def state(self):
+        with self._lock:
+            if self._opened_at is None:
+                return 'closed'
+            if time.monotonic() - self._opened_at >= self.reset_seconds:
+                return 'half-open'
+            return 'open'
+
+    def allow(self):
+        with self._lock:
+            if self._opened_at is None:
+                return True
+            if time.monotonic() - self._opened_at < self.reset_seconds or self._trial_in_flight:
+                return False
+            self._trial_in_flight = True
+            return True
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._trial_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._trial_in_flight or self._failures >= self.failure_threshold:
+                self._opened_at = time.monotonic()
+            self._trial_in_flight = False
+
+    def release_trial(self):
+        """Give up a half-open trial that ended without an outcome, e.g. an abandoned stream."""
+        with self._lock:
+            self._trial_in_flight = False
+
+
+class CompletionStream:
+    """Iterates the text deltas of a streamed completion while holding its slot.
+
+    The slot is released when iteration ends or ``close()`` is called, whichever
+    comes first, so callers should register ``close`` with the response.
+    """
+
+    def __init__(self, gateway, upstream, release, started=None):
+        self._gateway = gateway
+        self._upstream = upstream
+        self._release = release
+        self._started = started or time.perf_counter()
+        # Iteration usually happens after the request context is gone
+        self._endpoint = metrics.current_endpoint()
+        self._closed = False
+        self._outcome_recorded = False
+
+    def __iter__(self):
+        first = True
+        try:
+            for chunk in self._upstream:
+                if chunk.choices and chunk.choices[0].delta.content:
+                    if first:
+                        metrics.observe_llm('stream_first_token', self._started, endpoint=self._endpoint)
+                        first = False
+                    yield chunk.choices[0].delta.content
+        except Exception as e:
+            self._outcome_recorded = True
+            self._gateway.breaker.record_failure()
+            metrics.observe_llm('stream', self._started, 'error', self._endpoint)
+            raise LLMUnavailable(str(e)) from e
+        else:
+            self._outcome_recorded = True
+            self._gateway.breaker.record_success()
+            metrics.observe_llm('stream', self._started, endpoint=self._endpoint)
+        finally:
+            self.close()
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        if not self._outcome_recorded:
+            # Closed before the end (client gone, GeneratorExit): say nothing about
+            # upstream health, but free a half-open trial so another call can try
+            self._gateway.breaker.release_trial()
+            metrics.observe_llm('stream', self._started, 'abandoned', self._endpoint)
+        try:
+            self._upstream.close()
+        finally:
+            self._release()
+
+
+class LLMGateway:
+    """Owns the shared OpenAI client and admission control for every completion.
+
+    At most ``max_concurrency`` calls run at once; up to ``max_queue`` more wait
+    ``queue_timeout`` seconds for a slot and anything beyond that is shed
+    immediately, so a slow upstream cannot occupy every worker.
+    """
+
+    def __init__(self, api_key, base_url=None, model='gpt-3.5-turbo', timeout=20.0,
+                 max_concurrency=8, max_queue=32, queue_timeout=5.0, breaker=None):
+        self.api_key = api_key
+        self.base_url = base_url
+        self.model = model
+        self.timeout = timeout
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.breaker = breaker or CircuitBreaker(failure_threshold=5, reset_seconds=30)
+        self._slots = threading.BoundedSemaphore(max_concurrency)
+        self._lock = threading.Lock()
+        self._waiting = 0
+        self._client = None
+        self._client_pid = None
+
+    @property
+    def client(self):
+        # Built on first use in each process so forked workers never share a connection pool
+        if self._client is None or self._client_pid != os.getpid():
+            from openai import OpenAI
+            self._client = OpenAI(
+                api_key=self.api_key,
+                base_url=self.base_url,
+                timeout=self.timeout,
+                max_retries=0
+            )
+            self._client_pid = os.getpid()
+        return self._client
+
+    @contextmanager
+    def _admit(self):
+        with self._lock:
+            if self._waiting >= self.max_queue:
+                raise LLMUnavailable('completion queue is full')
+            self._waiting += 1
+        try:
+            acquired = self._slots.acquire(timeout=self.queue_timeout)
+        finally:
+            with self._lock:
+                self._waiting -= 1
+        if not acquired:
+            raise LLMUnavailable('timed out waiting for a completion slot')
+        # Asked only once a slot is held, so a half-open trial claimed here is always sent
+        if not self.breaker.allow():
+            self._slots.release()
+            raise LLMUnavailable('upstream circuit is open')
+        try:
+            yield
+        finally:
+            self._slots.release()
+
+    def complete(self, system_prompt, user_message, max_tokens, temperature=0.7):
+        """Return the completion text for a single system + user exchange."""
+        with self._admit():
+            started = time.perf_counter()
+            try:
+                response = self.client.chat.completions.create(
+                    model=self.model,
+                    messages=[
+                        {"role": "system", "content": system_prompt},
+                        {"role": "user", "content": user_message}
+                    ],
+                    max_tokens=max_tokens,
+                    temperature=temperature
+                )
+            except Exception as e:
+                self.breaker.record_failure()
+                metrics.observe_llm('complete', started, 'error')
+                raise LLMUnavailable(str(e)) from e
+            self.breaker.record_success()
+            metrics.observe_llm('complete', started)
+            return response.choices[0].message.content
+
+    def stream(self, system_prompt, user_message, max_tokens, temperature=0.7):
+        """Start a streamed completion and return a CompletionStream of text deltas.
+
+        Admission and connection errors raise LLMUnavailable here, before any
+        output, so callers can still answer with their fallback text.
+        """
+        admission = self._admit()
+        admission.__enter__()
+        started = time.perf_counter()
+        try:
+            upstream = self.client.chat.completions.create(
+                model=self.model,
+                messages=[
+                    {"role": "system", "content": system_prompt},
+                    {"role": "user", "content": user_message}
+                ],
+                max_tokens=max_tokens,
+                temperature=temperature,
+                stream=True
+            )
+        except Exception as e:
+            admission.__exit__(None, None, None)
+            self.breaker.record_failure()
+            metrics.observe_llm('stream', started, 'error')
+            raise LLMUnavailable(str(e)) from e
+        return CompletionStream(self, upstream, lambda: admission.__exit__(None, None, None), started)
+
+
+def init_app(app):
+    app.extensions['llm'] = LLMGateway(
+        api_key=app.config['OPENAI_API_KEY'],
+        base_url=app.config['OPENAI_BASE_URL'],
+        model=app.config['OPENAI_MODEL'],
+        timeout=app.config['LLM_TIMEOUT_SECONDS'],
+        max_concurrency=app.config['LLM_MAX_CONCURRENCY'],
+        max_queue=app.config['LLM_MAX_QUEUE'],
+        queue_timeout=app.config['LLM_QUEUE_TIMEOUT_SECONDS'],
+        breaker=CircuitBreaker(
+            failure_threshold=app.config['LLM_BREAKER_FAILURES'],
+            reset_seconds=app.config['LLM_BREAKER_RESET_SECONDS']
+        )
+    )
+    app.extensions['completion_cache'] = CompletionCache(
+        max_entries=app.config['LLM_CACHE_MAX_ENTRIES'],
+        ttls=app.config['LLM_CACHE_TTLS'],
+        default_ttl=app.config['LLM_CACHE_DEFAULT_TTL'],
+        wait_timeout=app.config['LLM_TIMEOUT_SECONDS'] + app.config['LLM_QUEUE_TIMEOUT_SECONDS']
+    )
+
+    gateway, cache = app.extensions['llm'], app.extensions['completion_cache']
+    metrics.register_gauge('everchat_llm_queue_waiting', 'Completions waiting for a slot.', lambda: gateway._waiting)
+    metrics.register_gauge('everchat_llm_breaker_open', '1 while the upstream circuit is open.',
+                           lambda: int(gateway.breaker.state == 'open'))
+    metrics.register_gauge('everchat_llm_cache_events_total', 'Completion cache lookups by outcome.',
+                           lambda: {'hit': cache.hits, 'miss': cache.misses, 'collapsed': cache.collapsed,
+                                    'eviction': cache.evictions}, label='outcome', kind='counter')
+
+
+def complete(system_prompt, user_message, max_tokens, temperature=0.7, mode=None):
+    """Return a completion, served from the response cache when ``mode`` is given."""
+    gateway = current_app.extensions['llm']
+    if mode is None:
+        return gateway.complete(system_prompt, user_message, max_tokens, temperature)
+    return current_app.extensions['completion_cache'].get_or_compute(
+        mode, system_prompt, user_message,
+        lambda: gateway.complete(system_prompt, user_message, max_tokens, temperature)
+    )
+
+
+def stream(system_prompt, user_message, max_tokens, temperature=0.7):
+    return current_app.extensions['llm'].stream(system_prompt, user_message, max_tokens, temperature)
+
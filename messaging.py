@@ -0,0 +1,131 @@
+from sqlalchemy import and_, or_
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import joinedload
+from flask import current_app
+from app import db
+import broker
+from models import Message, Conversation
+from pagination import keyset_page, before_cursor, after_cursor
+
+PREVIEW_LENGTH = 100
+# Both support INSERT ... ON CONFLICT DO UPDATE
+_DIALECT_INSERTS = {'postgresql': postgresql.insert, 'sqlite': sqlite.insert}
+
+
+def message_preview(content):
+    if len(content) <= PREVIEW_LENGTH:
+        return content
+    return content[:PREVIEW_LENGTH - 1] + '…'
+
+
+def _upsert_conversation(owner_id, peer_id, summary, unread):
+    # One statement, so two first messages between a pair can't both insert the row;
+    # the unread count is incremented in SQL so concurrent senders don't lose updates
+    table = Conversation.__table__
+    insert = _DIALECT_INSERTS[db.session.get_bind().dialect.name]
+    changes = dict(summary)
+    if unread:
+        changes['unread_count'] = table.c.unread_count + 1
+    db.session.execute(
+        insert(table)
+        .values(user_id=owner_id, peer_id=peer_id, unread_count=int(unread), **summary)
+        .on_conflict_do_update(index_elements=[table.c.user_id, table.c.peer_id], set_=changes)
+    )
+
+
+def deliver_message(sender_id, recipient_id, content, is_gpt_response=False):
+    """Store a direct message and update both participants' conversation rows.
+
+    The caller commits, so the message and its summaries land together.
+    """
+    message = Message(
+        content=content,
+        sender_id=sender_id,
+        recipient_id=recipient_id,
+        is_gpt_response=is_gpt_response
+    )
+    db.session.add(message)
+    db.session.flush()
+
+    summary = {
+        'last_message_id': message.id,
+        'last_message_preview': message_preview(content),
+        'last_message_at': message.created_at,
+    }
+    for owner_id, peer_id in {(sender_id, recipient_id), (recipient_id, sender_id)}:
+        _upsert_conversation(owner_id, peer_id, summary, unread=owner_id == recipient_id and owner_id != sender_id)
+
+    return message
+
+
+def publish_message(message):
+    """Push a committed message to both participants' open streams."""
+    payload = {
+        'id': message.id,
+        'content': message.content,
+        'sender_id': message.sender_id,
+        'recipient_id': message.recipient_id,
+        'created_at': message.created_at.isoformat(),
+        'is_gpt_response': bool(message.is_gpt_response)
+    }
+    broker.publish(message.sender_id, 'message', payload)
+    if message.recipient_id != message.sender_id:
+        broker.publish(message.recipient_id, 'message', payload)
+        publish_unread(message.recipient_id, message.sender_id)
+
+
+def publish_unread(user_id, peer_id, unread=None):
+    """Push the current unread count of one conversation to its owner's streams."""
+    if unread is None:
+        unread = db.session.query(Conversation.unread_count).filter_by(user_id=user_id, peer_id=peer_id).scalar()
+    broker.publish(user_id, 'unread', {'peer_id': peer_id, 'unread_count': unread or 0})
+
+
+def mark_conversation_read(user_id, peer_id):
+    """Mark every message from ``peer_id`` to ``user_id`` read and reset the unread count.
+
+    Returns False without writing anything when the conversation has nothing unread.
+    """
+    unread = db.session.query(Conversation.unread_count).filter_by(user_id=user_id, peer_id=peer_id).scalar()
+    if not unread:
+        return False
+    Message.query.filter_by(sender_id=peer_id, recipient_id=user_id, is_read=False).update({'is_read': True})
+    Conversation.query.filter_by(user_id=user_id, peer_id=peer_id).update({'unread_count': 0})
+    return True
+
+
+def load_messages(user_id, peer_id, since_id=None, before_id=None, limit=None):
+    """Return up to ``limit`` messages of a thread in chronological order.
+
+    With ``since_id`` only messages newer than that message are returned; with
+    ``before_id`` the page immediately older than it. Otherwise the latest page.
+    """
+    limit = limit or current_app.config['MESSAGE_PAGE_SIZE']
+    query = Message.query.filter(or_(
+        and_(Message.sender_id == user_id, Message.recipient_id == peer_id),
+        and_(Message.sender_id == peer_id, Message.recipient_id == user_id)
+    ))
+
+    anchor_id = since_id or before_id
+    if anchor_id:
+        anchor = db.session.query(Message.created_at, Message.id).filter(Message.id == anchor_id).first()
+        if anchor is None:
+            return []
+
+    if since_id:
+        return query.filter(after_cursor(Message.created_at, Message.id, anchor)).order_by(
+            Message.created_at.asc(), Message.id.asc()
+        ).limit(limit).all()
+
+    if before_id:
+        query = query.filter(before_cursor(Message.created_at, Message.id, anchor))
+    messages = query.order_by(Message.created_at.desc(), Message.id.desc()).limit(limit).all()
+    messages.reverse()
+    return messages
+
+
+def load_conversations(user_id, cursor=None, limit=None):
+    """Return one page of a user's conversations, most recently active first."""
+    limit = limit or current_app.config['CONVERSATION_PAGE_SIZE']
+    query = Conversation.query.filter_by(user_id=user_id).options(joinedload(Conversation.peer))
+    return keyset_page(query, Conversation.last_message_at, Conversation.id, cursor, limit)
@@ -0,0 +1,222 @@
+"""In-process request, database and LLM instrumentation, rendered in the
+Prometheus text format at /metrics.
+
+Every observation is a couple of perf_counter() calls and a bucket increment
+under a lock, so it stays on in production. Counters live in each worker
+process; with several gunicorn workers each scrape reports the worker that
+served it, so scrape workers individually or aggregate with ``sum``/``rate``.
+"""
+import bisect
+import logging
+import os
+import threading
+import time
+from flask import current_app, g, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+logger = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200)
+LLM_BUCKETS = (0.1, 0.25, 0.5, 1.0, 2.0, 5.0, 10.0, 20.0, 30.0)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(names, values, extra=None):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+class Histogram:
+    def __init__(self, name, help_text, labels=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.labels = labels
+        self.buckets = tuple(buckets)
+        self._lock = threading.Lock()
+        self._series = {}
+
+    def observe(self, value, *label_values):
+        # Counts are stored per bucket and made cumulative when rendered
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][index] += 1
+            series[1] += value
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} histogram']
+        with self._lock:
+            series = [(key, list(counts), total) for key, (counts, total) in self._series.items()]
+        for key, counts, total in sorted(series):
+            cumulative = 0
+            for bound, count in zip(self.buckets + ('+Inf',), counts):
+                cumulative += count
+                bucket_label = f'le="{bound}"'
+                lines.append(f'{self.name}_bucket{_format_labels(self.labels, key, bucket_label)} {cumulative}')
+            lines.append(f'{self.name}_sum{_format_labels(self.labels, key)} {total:.6f}')
+            lines.append(f'{self.name}_count{_format_labels(self.labels, key)} {cumulative}')
+        return lines
+
+
+class Counter:
+    def __init__(self, name, help_text, labels=()):
+        self.name = name
+        self.help_text = help_text
+        self.labels = labels
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def inc(self, *label_values, amount=1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} counter']
+        with self._lock:
+            values = sorted(self._values.items())
+        for key, value in values:
+            lines.append(f'{self.name}{_format_labels(self.labels, key)} {value}')
+        return lines
+
+
+REQUEST_LATENCY = Histogram(
+    'everchat_http_request_duration_seconds',
+    'Time from request start until the response was handed to the server.',
+    ('endpoint', 'method', 'status')
+)
+REQUEST_QUERIES = Histogram(
+    'everchat_http_request_db_queries', 'SQL statements executed per request.',
+    ('endpoint',), QUERY_COUNT_BUCKETS
+)
+REQUEST_DB_TIME = Histogram(
+    'everchat_http_request_db_seconds', 'Total SQL execution time per request.', ('endpoint',)
+)
+QUERY_LATENCY = Histogram(
+    'everchat_db_query_duration_seconds', 'SQL statement execution time.', (), QUERY_BUCKETS
+)
+SLOW_QUERIES = Counter(
+    'everchat_db_slow_queries_total', 'SQL statements slower than SLOW_QUERY_MS.', ('endpoint',)
+)
+LLM_LATENCY = Histogram(
+    'everchat_llm_request_duration_seconds',
+    'Upstream completion latency; "stream_first_token" is the wait before the first delta.',
+    ('call', 'outcome', 'endpoint'), LLM_BUCKETS
+)
+
+_metrics = [REQUEST_LATENCY, REQUEST_QUERIES, REQUEST_DB_TIME, QUERY_LATENCY, SLOW_QUERIES, LLM_LATENCY]
+# name -> (help, callable returning a number or {label value: number}, label name, type)
+_collectors = {}
+_slow_query_seconds = None
+
+
+def register_gauge(name, help_text, collect, label=None, kind='gauge'):
+    """Report ``collect()`` at scrape time; it returns a number or a dict keyed by ``label``.
+
+    Use ``kind='counter'`` for running totals kept elsewhere, such as cache hit counts.
+    """
+    _collectors[name] = (help_text, collect, label, kind)
+
+
+def current_endpoint():
+    if has_request_context():
+        return request.endpoint or 'unmatched'
+    return 'background'
+
+
+def observe_llm(call, started, outcome='ok', endpoint=None):
+    LLM_LATENCY.observe(time.perf_counter() - started, call, outcome, endpoint or current_endpoint())
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('query_started', []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info['query_started'].pop()
+    QUERY_LATENCY.observe(elapsed)
+    if has_request_context():
+        totals = g.get('_db_totals')
+        if totals is not None:
+            totals[0] += 1
+            totals[1] += elapsed
+    if _slow_query_seconds is not None and elapsed >= _slow_query_seconds:
+        endpoint = current_endpoint()
+        SLOW_QUERIES.inc(endpoint)
+        logger.warning('Slow query (%.1f ms) in %s: %s', elapsed * 1000, endpoint, ' '.join(statement.split())[:1000])
+
+
+def _handle_error(exception_context):
+    # The failed statement never reaches after_cursor_execute
+    started = exception_context.connection.info.get('query_started') if exception_context.connection else None
+    if started:
+        started.pop()
+
+
+def _before_request():
+    g._request_started = time.perf_counter()
+    g._db_totals = [0, 0.0]
+
+
+def _after_request(response):
+    started = g.get('_request_started')
+    if started is None:
+        return response
+    elapsed = time.perf_counter() - started
+    endpoint = request.endpoint or 'unmatched'
+    queries, db_seconds = g._db_totals
+    REQUEST_LATENCY.observe(elapsed, endpoint, request.method, response.status_code)
+    REQUEST_QUERIES.observe(queries, endpoint)
+    REQUEST_DB_TIME.observe(db_seconds, endpoint)
+    if not current_app.config['SERVER_TIMING']:
+        return response
+    # Exposes per-request query counts, so only for benchmarks and debugging
+    response.headers['Server-Timing'] = (
+        f'app;dur={elapsed * 1000:.1f}, db;dur={db_seconds * 1000:.1f};desc="{queries} queries"'
+    )
+    return response
+
+
+def render():
+    """Return every metric in the Prometheus text exposition format."""
+    lines = []
+    for metric in _metrics:
+        lines.extend(metric.render())
+    for name, (help_text, collect, label, kind) in sorted(_collectors.items()):
+        try:
+            value = collect()
+        except Exception as e:
+            logger.warning('Metric %s failed: %s', name, e)
+            continue
+        lines.append(f'# HELP {name} {help_text}')
+        lines.append(f'# TYPE {name} {kind}')
+        if isinstance(value, dict):
+            for key, item in sorted(value.items()):
+                lines.append(f'{name}{{{label}="{_escape(key)}"}} {item}')
+        else:
+            lines.append(f'{name} {value}')
+    return '\n'.join(lines) + '\n'
+
+
+def init_app(app):
+    global _slow_query_seconds
+    if app.config['SLOW_QUERY_MS'] > 0:
+        _slow_query_seconds = app.config['SLOW_QUERY_MS'] / 1000
+    # Listening on the Engine class covers engines created after this call
+    if not event.contains(Engine, 'before_cursor_execute', _before_cursor_execute):
+        event.listen(Engine, 'before_cursor_execute', _before_cursor_execute)
+        event.listen(Engine, 'after_cursor_execute', _after_cursor_execute)
+        event.listen(Engine, 'handle_error', _handle_error)
+    app.before_request(_before_request)
+    app.after_request(_after_request)
+    register_gauge('everchat_process_id', 'Worker process that served this scrape.', os.getpid)
+    app.extensions['metrics'] = render
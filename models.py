@@ -1,16 +1,24 @@
+import json
 from datetime import datetime
+from sqlalchemy import event, inspect, select
+from sqlalchemy.orm import validates
 from app import db
 from flask_login import UserMixin
 from werkzeug.security import generate_password_hash, check_password_hash
+from text import normalize_arabic
 
 class User(UserMixin, db.Model):
     id = db.Column(db.Integer, primary_key=True)
     username = db.Column(db.String(64), unique=True, nullable=False)
+    # Folded form of username for prefix lookups (contact typeahead)
+    username_normalized = db.Column(db.String(64), nullable=False, default='', server_default='', index=True)
     email = db.Column(db.String(120), unique=True, nullable=False)
     password_hash = db.Column(db.String(256))
     bio = db.Column(db.Text)
     profile_pic = db.Column(db.String(200))
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    # Bumped when anything shown on the user's post cards changes; part of their fragment cache keys
+    profile_version = db.Column(db.Integer, nullable=False, default=1, server_default='1')
     
     # Relationships
     posts = db.relationship('Post', backref='author', lazy=True, cascade='all, delete-orphan')
@@ -19,6 +27,11 @@ class User(UserMixin, db.Model):
     likes = db.relationship('Like', backref='user', lazy=True, cascade='all, delete-orphan')
     comments = db.relationship('Comment', backref='author', lazy=True, cascade='all, delete-orphan')
     
+    @validates('username')
+    def _normalize_username(self, key, username):
+        self.username_normalized = normalize_arabic(username)
+        return username
+    
     def set_password(self, password):
         self.password_hash = generate_password_hash(password)
     
@@ -35,20 +48,21 @@ class Post(db.Model):
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     
+    # Denormalized counters, maintained by the Like/Comment mapper events below
+    like_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    comment_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    # Bumped with every change to the post's card (counters, comments, caption); see feed.py
+    render_version = db.Column(db.Integer, nullable=False, default=1, server_default='1')
+    
     # Relationships
     likes = db.relationship('Like', backref='post', lazy=True, cascade='all, delete-orphan')
     comments = db.relationship('Comment', backref='post', lazy=True, cascade='all, delete-orphan')
     
-    def like_count(self):
-        return len(self.likes)
-    
-    def comment_count(self):
-        return len(self.comments)
-    
-    def is_liked_by(self, user):
-        if not user.is_authenticated:
-            return False
-        return Like.query.filter_by(user_id=user.id, post_id=self.id).first() is not None
+    # Keyset indexes for the home feed and profile grids: each page is a range scan from the cursor
+    __table_args__ = (
+        db.Index('ix_post_created_at_id', 'created_at', 'id'),
+        db.Index('ix_post_user_created_at_id', 'user_id', 'created_at', 'id'),
+    )
     
     def __repr__(self):
         return f'<Post {self.id}>'
@@ -71,6 +85,55 @@ class Comment(db.Model):
     def __repr__(self):
         return f'<Comment {self.id}>'
 
+def _adjust_post_counter(connection, post_id, column, delta):
+    post = Post.__table__
+    connection.execute(
+        post.update().where(post.c.id == post_id).values({
+            column: post.c[column] + delta,
+            'render_version': post.c.render_version + 1
+        })
+    )
+
+# Counters are updated in the same flush as the row change, so they commit or roll
+# back with it, and ORM cascades (deleting a user or post) keep them in step too.
+@event.listens_for(Like, 'after_insert')
+def _like_inserted(mapper, connection, target):
+    _adjust_post_counter(connection, target.post_id, 'like_count', 1)
+
+@event.listens_for(Like, 'after_delete')
+def _like_deleted(mapper, connection, target):
+    _adjust_post_counter(connection, target.post_id, 'like_count', -1)
+
+@event.listens_for(Comment, 'after_insert')
+def _comment_inserted(mapper, connection, target):
+    _adjust_post_counter(connection, target.post_id, 'comment_count', 1)
+
+@event.listens_for(Comment, 'after_delete')
+def _comment_deleted(mapper, connection, target):
+    _adjust_post_counter(connection, target.post_id, 'comment_count', -1)
+
+def _changed(target, *attributes):
+    state = inspect(target)
+    return any(getattr(state.attrs, name).history.has_changes() for name in attributes)
+
+# Cached post cards are keyed by these versions, so edits show up without explicit purges
+@event.listens_for(Post, 'before_update')
+def _post_updated(mapper, connection, target):
+    if _changed(target, 'caption', 'image_filename'):
+        target.render_version = Post.render_version + 1
+
+@event.listens_for(User, 'before_update')
+def _user_updated(mapper, connection, target):
+    if _changed(target, 'username', 'profile_pic'):
+        target.profile_version = User.profile_version + 1
+    if _changed(target, 'username'):
+        # Other people's cards show this name in their comment previews
+        post = Post.__table__
+        commented = select(Comment.post_id).where(Comment.user_id == target.id).scalar_subquery()
+        connection.execute(
+            post.update().where(post.c.id.in_(commented)).values(render_version=post.c.render_version + 1)
+        )
+
 class Message(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     content = db.Column(db.Text, nullable=False)
@@ -80,9 +143,37 @@ class Message(db.Model):
     is_read = db.Column(db.Boolean, default=False)
     is_gpt_response = db.Column(db.Boolean, default=False)
     
+    # Either direction of a thread is a range scan on this index
+    __table_args__ = (db.Index('ix_message_pair_created_at', 'sender_id', 'recipient_id', 'created_at'),)
+    
     def __repr__(self):
         return f'<Message {self.id}>'
 
+class Conversation(db.Model):
+    """Inbox summary of a direct-message thread, one row per participant.
+
+    Each side of a pair owns its own row so the chat sidebar is a single range
+    scan over (user_id, last_message_at) without an OR across columns.
+    """
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    peer_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    last_message_id = db.Column(db.Integer, db.ForeignKey('message.id'))
+    last_message_preview = db.Column(db.String(200))
+    last_message_at = db.Column(db.DateTime, default=datetime.utcnow)
+    unread_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    
+    # Relationship
+    peer = db.relationship('User', foreign_keys=[peer_id])
+    
+    __table_args__ = (
+        db.UniqueConstraint('user_id', 'peer_id'),
+        db.Index('ix_conversation_user_last_message', 'user_id', 'last_message_at', 'id'),
+    )
+    
+    def __repr__(self):
+        return f'<Conversation {self.user_id}-{self.peer_id}>'
+
 class AssistantConversation(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
@@ -103,7 +194,12 @@ class OfflineMap(db.Model):
     region_name = db.Column(db.String(200), nullable=False)
     center_lat = db.Column(db.Float, nullable=False)
     center_lng = db.Column(db.Float, nullable=False)
-    zoom_level = db.Column(db.Integer, default=10)
+    zoom_level = db.Column(db.Integer, default=10)  # Highest zoom in the pack
+    min_zoom = db.Column(db.Integer, default=10)
+    radius_km = db.Column(db.Float, default=5)
+    pack_filename = db.Column(db.String(100), index=True)  # Shared by every map of the same region
+    status = db.Column(db.String(20), default='building')  # building, ready, failed, evicted
+    tile_count = db.Column(db.Integer)
     file_size = db.Column(db.Integer)  # Size in bytes
     download_date = db.Column(db.DateTime, default=datetime.utcnow)
     last_used = db.Column(db.DateTime, default=datetime.utcnow)
@@ -135,6 +231,7 @@ class SOSAlert(db.Model):
     latitude = db.Column(db.Float)
     longitude = db.Column(db.Float)
     message = db.Column(db.Text)
+    geohash = db.Column(db.String(12))
     status = db.Column(db.String(20), default='active')  # active, resolved, false_alarm
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     resolved_at = db.Column(db.DateTime)
@@ -142,5 +239,49 @@ class SOSAlert(db.Model):
     # Relationship
     user = db.relationship('User', backref='sos_alerts')
     
+    __table_args__ = (
+        db.Index('ix_sos_alert_status_geohash', 'status', 'geohash'),
+    )
+    
     def __repr__(self):
         return f'<SOSAlert {self.id}>'
+
+class UserLocation(db.Model):
+    """A user's last reported position, indexed by geohash for proximity lookups."""
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), unique=True, nullable=False)
+    latitude = db.Column(db.Float, nullable=False)
+    longitude = db.Column(db.Float, nullable=False)
+    geohash = db.Column(db.String(12), nullable=False, index=True)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    
+    def __repr__(self):
+        return f'<UserLocation {self.user_id}>'
+
+class Job(db.Model):
+    """A unit of background work, claimed and retried by jobs.py workers."""
+    id = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String(50), nullable=False)
+    payload = db.Column(db.Text, nullable=False, default='{}')
+    status = db.Column(db.String(20), nullable=False, default='pending')  # pending, running, done, failed
+    idempotency_key = db.Column(db.String(200), unique=True)
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    max_attempts = db.Column(db.Integer, nullable=False, default=5)
+    last_error = db.Column(db.Text)
+    locked_by = db.Column(db.String(100))
+    locked_at = db.Column(db.DateTime)
+    run_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    finished_at = db.Column(db.DateTime)
+    
+    __table_args__ = (
+        db.Index('ix_job_status_run_at', 'status', 'run_at'),
+        db.Index('ix_job_status_finished_at', 'status', 'finished_at'),
+    )
+    
+    @property
+    def data(self):
+        return json.loads(self.payload)
+    
+    def __repr__(self):
+        return f'<Job {self.id} {self.kind}>'
@@ -0,0 +1,65 @@
+import json
+import logging
+import urllib.request
+from flask import current_app
+
+logger = logging.getLogger(__name__)
+
+
+class Notifier:
+    """Delivers a text message to a phone number; raises on failure so the job retries."""
+
+    def send(self, phone, text, idempotency_key=None):
+        raise NotImplementedError
+
+
+class LogNotifier(Notifier):
+    """Logs messages instead of sending them; used when no gateway is configured."""
+
+    def send(self, phone, text, idempotency_key=None):
+        logger.info('Notification to %s: %s', phone, text)
+
+
+class HTTPNotifier(Notifier):
+    """Posts {"to", "text"} as JSON to an SMS gateway.
+
+    The job's idempotency key is sent as the Idempotency-Key header, so a
+    retry after a timed-out request does not text the contact twice.
+    """
+
+    def __init__(self, url, token=None, timeout=10.0):
+        self.url = url
+        self.token = token
+        self.timeout = timeout
+
+    def send(self, phone, text, idempotency_key=None):
+        headers = {'Content-Type': 'application/json'}
+        if self.token:
+            headers['Authorization'] = f'Bearer {self.token}'
+        if idempotency_key:
+            headers['Idempotency-Key'] = idempotency_key
+        request = urllib.request.Request(
+            self.url,
+            data=json.dumps({'to': phone, 'text': text}).encode(),
+            headers=headers,
+            method='POST'
+        )
+        # urlopen raises HTTPError for 4xx/5xx responses
+        with urllib.request.urlopen(request, timeout=self.timeout) as response:
+            response.read()
+
+
+def init_app(app):
+    url = app.config.get('SMS_GATEWAY_URL')
+    if url:
+        app.extensions['notifier'] = HTTPNotifier(
+            url,
+            token=app.config.get('SMS_GATEWAY_TOKEN'),
+            timeout=app.config['SMS_GATEWAY_TIMEOUT_SECONDS']
+        )
+    else:
+        app.extensions['notifier'] = LogNotifier()
+
+
+def send(phone, text, idempotency_key=None):
+    current_app.extensions['notifier'].send(phone, text, idempotency_key)
@@ -0,0 +1,156 @@
+import hashlib
+import logging
+import os
+from datetime import datetime, timedelta
+from sqlalchemy import func
+from flask import current_app
+from app import db
+import jobs
+import tilepack
+from models import OfflineMap
+
+logger = logging.getLogger(__name__)
+
+
+def init_app(app):
+    app.extensions['tile_packs'] = tilepack.PackCache(app.config['TILE_PACK_CACHE_SIZE'])
+
+
+def _packs():
+    return current_app.extensions['tile_packs']
+
+
+def pack_path(filename):
+    return os.path.join(current_app.config['TILE_PACK_DIR'], filename)
+
+
+def pack_filename(latitude, longitude, radius_km, min_zoom, max_zoom):
+    # Named by region so every user who saves the same area shares one file
+    key = f"{latitude}:{longitude}:{radius_km}:{min_zoom}:{max_zoom}:{current_app.config['TILE_SOURCE_FORMAT']}"
+    return f"{hashlib.sha1(key.encode()).hexdigest()}.tilepack"
+
+
+def request_offline_map(user_id, region_name, latitude, longitude, radius_km, min_zoom, max_zoom):
+    """Create (or reuse) the user's OfflineMap for a region and queue its pack build.
+
+    The centre is rounded to ~100 m so nearby requests resolve to the same pack.
+    The caller commits.
+    """
+    latitude, longitude = round(latitude, 3), round(longitude, 3)
+    filename = pack_filename(latitude, longitude, radius_km, min_zoom, max_zoom)
+    offline_map = OfflineMap.query.filter_by(user_id=user_id, pack_filename=filename).first()
+    if offline_map is None:
+        offline_map = OfflineMap(
+            user_id=user_id,
+            region_name=region_name,
+            center_lat=latitude,
+            center_lng=longitude,
+            radius_km=radius_km,
+            min_zoom=min_zoom,
+            zoom_level=max_zoom,
+            pack_filename=filename
+        )
+        db.session.add(offline_map)
+    elif offline_map.status in ('ready', 'building'):
+        return offline_map
+
+    path = pack_path(filename)
+    if os.path.exists(path):
+        _mark_ready(offline_map, path)
+    else:
+        offline_map.status = 'building'
+        db.session.flush()
+        jobs.enqueue('offline_map.build', {'map_id': offline_map.id})
+    return offline_map
+
+
+def _mark_ready(offline_map, path):
+    offline_map.status = 'ready'
+    offline_map.file_size = os.path.getsize(path)
+    offline_map.tile_count = _packs().open(path).count
+    offline_map.download_date = datetime.utcnow()
+
+
+@jobs.handler('offline_map.build')
+def build_offline_map(job):
+    offline_map = db.session.get(OfflineMap, job.data['map_id'])
+    if offline_map is None or offline_map.status != 'building':
+        return
+
+    path = pack_path(offline_map.pack_filename)
+    if not os.path.exists(path):
+        tiles = tilepack.region_tiles(
+            offline_map.center_lat, offline_map.center_lng, offline_map.radius_km,
+            offline_map.min_zoom, offline_map.zoom_level
+        )
+        stored = tilepack.build_pack(current_app.config['TILE_SOURCE_DIR'], path, tiles, current_app.config['TILE_SOURCE_FORMAT'])
+        if not stored:
+            # The tile source doesn't cover this region; retrying won't help
+            os.remove(path)
+            offline_map.status = 'failed'
+            return
+    _mark_ready(offline_map, path)
+
+
+def open_pack(offline_map):
+    return _packs().open(pack_path(offline_map.pack_filename))
+
+
+def touch(offline_map):
+    """Record use of a pack, at most once per OFFLINE_MAP_TOUCH_SECONDS so tile reads stay read-only."""
+    now = datetime.utcnow()
+    if offline_map.last_used is None or now - offline_map.last_used >= timedelta(seconds=current_app.config['OFFLINE_MAP_TOUCH_SECONDS']):
+        offline_map.last_used = now
+        db.session.commit()
+
+
+def evict_packs(max_bytes, idle_days):
+    """Delete pack files unused for ``idle_days``, then the coldest ones until the total fits ``max_bytes``.
+
+    Maps that used an evicted pack are marked 'evicted' and can be requested
+    again. Returns (packs evicted, bytes freed).
+    """
+    packs = (db.session.query(OfflineMap.pack_filename, func.max(OfflineMap.last_used), func.max(OfflineMap.file_size))
+             .filter(OfflineMap.status == 'ready')
+             .group_by(OfflineMap.pack_filename)
+             .order_by(func.max(OfflineMap.last_used))
+             .all())
+    total = sum(size or 0 for _, _, size in packs)
+    cutoff = datetime.utcnow() - timedelta(days=idle_days)
+
+    evicted, freed = [], 0
+    for filename, last_used, size in packs:
+        if last_used >= cutoff and total <= max_bytes:
+            break
+        path = pack_path(filename)
+        _packs().discard(path)
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        evicted.append(filename)
+        total -= size or 0
+        freed += size or 0
+
+    if evicted:
+        OfflineMap.query.filter(OfflineMap.pack_filename.in_(evicted)).update(
+            {'status': 'evicted', 'file_size': 0}, synchronize_session=False
+        )
+        db.session.commit()
+    return len(evicted), freed
+
+
+def offline_map_payload(offline_map):
+    return {
+        'id': offline_map.id,
+        'region_name': offline_map.region_name,
+        'center_lat': offline_map.center_lat,
+        'center_lng': offline_map.center_lng,
+        'radius_km': offline_map.radius_km,
+        'min_zoom': offline_map.min_zoom,
+        'max_zoom': offline_map.zoom_level,
+        'status': offline_map.status,
+        'file_size': offline_map.file_size,
+        'tile_count': offline_map.tile_count,
+        'last_used': offline_map.last_used.isoformat() if offline_map.last_used else None
+    }
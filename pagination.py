@@ -0,0 +1,50 @@
+import base64
+from datetime import datetime
+from sqlalchemy import and_, or_
+
+
+def encode_cursor(created_at, row_id):
+    """Encode a (created_at, id) keyset position as an opaque URL-safe token."""
+    raw = f"{created_at.isoformat()}|{row_id}".encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(token):
+    """Decode a token produced by encode_cursor, returning None if it is invalid."""
+    if not token:
+        return None
+    try:
+        padded = token + '=' * (-len(token) % 4)
+        created_at, row_id = base64.urlsafe_b64decode(padded).decode().split('|', 1)
+        return datetime.fromisoformat(created_at), int(row_id)
+    except (ValueError, UnicodeDecodeError):
+        return None
+
+
+def before_cursor(created_col, id_col, cursor):
+    """Filter for rows strictly after ``cursor`` in (created_at DESC, id DESC) order."""
+    created_at, row_id = cursor
+    return or_(created_col < created_at, and_(created_col == created_at, id_col < row_id))
+
+
+def after_cursor(created_col, id_col, cursor):
+    """Filter for rows strictly after ``cursor`` in (created_at ASC, id ASC) order."""
+    created_at, row_id = cursor
+    return or_(created_col > created_at, and_(created_col == created_at, id_col > row_id))
+
+
+def keyset_page(query, created_col, id_col, cursor, limit):
+    """Fetch one page of ``query`` newest-first, returning (rows, next_cursor).
+
+    One extra row is fetched to tell whether another page exists, so callers
+    never need a COUNT over the whole table.
+    """
+    if cursor:
+        query = query.filter(before_cursor(created_col, id_col, cursor))
+    rows = query.order_by(created_col.desc(), id_col.desc()).limit(limit + 1).all()
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        last = rows[-1]
+        next_cursor = encode_cursor(getattr(last, created_col.key), getattr(last, id_col.key))
+    return rows, next_cursor
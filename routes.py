@@ -1,26 +1,61 @@
+import hmac
+import mimetypes
 import os
-import uuid
-from flask import render_template, request, redirect, url_for, flash, jsonify, send_from_directory
+import time
+from urllib.parse import quote
+from flask import Blueprint, current_app, render_template, request, redirect, url_for, flash, jsonify, send_from_directory, Response, abort
 from flask_login import login_user, logout_user, login_required, current_user
+from werkzeug.security import safe_join
 from werkzeug.utils import secure_filename
-from app import app, db
+from sqlalchemy.orm import joinedload
+from app import db
+from database import use_replica
 from models import User, Post, Like, Comment, Message, AssistantConversation, OfflineMap, EmergencyContact, SOSAlert
-import openai
+from feed import load_feed_page, load_profile_page, load_post_cards
+from messaging import deliver_message, publish_message, publish_unread, mark_conversation_read, load_conversations, load_messages
+from pagination import decode_cursor
+from geo import valid_coordinates, encode as geohash_encode, record_location, alerts_near, alert_payload
+from sos import enqueue_fanout
+from contacts import suggest_users
+from offline_maps import request_offline_map, open_pack, touch, offline_map_payload
+import auth
+import search
+import tilepack
+import broker
+import images
+import llm
+import metrics
 
-# Initialize OpenAI client
-openai.api_key = os.environ.get("OPENAI_API_KEY")
+bp = Blueprint('main', __name__)
 
 ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif', 'webp'}
 
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
-@app.route('/')
+@bp.route('/')
+@use_replica
 def index():
-    posts = Post.query.order_by(Post.created_at.desc()).all()
-    return render_template('index.html', posts=posts)
+    posts, next_cursor = load_feed_page()
+    cards = load_post_cards(posts, current_user)
+    return render_template('index.html', cards=cards, next_cursor=next_cursor)
 
-@app.route('/register', methods=['GET', 'POST'])
+@bp.route('/api/feed')
+@use_replica
+def api_feed():
+    """Return the next page of the feed as rendered post cards for infinite scroll"""
+    cursor = decode_cursor(request.args.get('cursor'))
+    if request.args.get('cursor') and cursor is None:
+        return jsonify({'error': 'Invalid cursor'}), 400
+    
+    posts, next_cursor = load_feed_page(cursor)
+    cards = load_post_cards(posts, current_user)
+    return jsonify({
+        'html': render_template('_post_cards.html', cards=cards),
+        'next_cursor': next_cursor
+    })
+
+@bp.route('/register', methods=['GET', 'POST'])
 def register():
     if request.method == 'POST':
         username = request.form['username']
@@ -30,11 +65,11 @@ def register():
         # Check if user already exists
         if User.query.filter_by(username=username).first():
             flash('Username already exists')
-            return redirect(url_for('register'))
+            return redirect(url_for('main.register'))
         
         if User.query.filter_by(email=email).first():
             flash('Email already exists')
-            return redirect(url_for('register'))
+            return redirect(url_for('main.register'))
         
         # Create new user
         user = User(username=username, email=email)
@@ -43,11 +78,11 @@ def register():
         db.session.commit()
         
         login_user(user)
-        return redirect(url_for('index'))
+        return redirect(url_for('main.index'))
     
     return render_template('register.html')
 
-@app.route('/login', methods=['GET', 'POST'])
+@bp.route('/login', methods=['GET', 'POST'])
 def login():
     if request.method == 'POST':
         username = request.form['username']
@@ -57,19 +92,19 @@ def login():
         
         if user and user.check_password(password):
             login_user(user)
-            return redirect(url_for('index'))
+            return redirect(url_for('main.index'))
         else:
             flash('Invalid username or password')
     
     return render_template('login.html')
 
-@app.route('/logout')
+@bp.route('/logout')
 @login_required
 def logout():
     logout_user()
-    return redirect(url_for('index'))
+    return redirect(url_for('main.index'))
 
-@app.route('/create_post', methods=['POST'])
+@bp.route('/create_post', methods=['POST'])
 @login_required
 def create_post():
     caption = request.form.get('caption', '')
@@ -79,10 +114,10 @@ def create_post():
     filename = None
     
     if file and file.filename and allowed_file(file.filename):
-        # Generate unique filename
+        # Store by content hash; resized variants are generated in the background
         file_extension = file.filename.rsplit('.', 1)[1].lower()
-        filename = f"{uuid.uuid4().hex}.{file_extension}"
-        file.save(os.path.join(app.config['UPLOAD_FOLDER'], filename))
+        filename = images.store_upload(file, file_extension)
+        images.schedule_variants(filename)
     
     # Create new post
     post = Post(caption=caption, image_filename=filename, user_id=current_user.id)
@@ -90,9 +125,9 @@ def create_post():
     db.session.commit()
     
     flash('Post created successfully!')
-    return redirect(url_for('index'))
+    return redirect(url_for('main.index'))
 
-@app.route('/like_post/<int:post_id>')
+@bp.route('/like_post/<int:post_id>')
 @login_required
 def like_post(post_id):
     post = Post.query.get_or_404(post_id)
@@ -110,12 +145,13 @@ def like_post(post_id):
     
     db.session.commit()
     
+    # The counter was bumped in the same transaction; this reloads only the post row
     return jsonify({
         'action': action,
-        'like_count': post.like_count()
+        'like_count': post.like_count
     })
 
-@app.route('/add_comment/<int:post_id>', methods=['POST'])
+@bp.route('/add_comment/<int:post_id>', methods=['POST'])
 @login_required
 def add_comment(post_id):
     content = request.form.get('content')
@@ -124,59 +160,175 @@ def add_comment(post_id):
         db.session.add(comment)
         db.session.commit()
     
-    return redirect(url_for('index'))
+    return redirect(url_for('main.index'))
+
+@bp.route('/api/posts/<int:post_id>/comments')
+def post_comments(post_id):
+    """Return every comment on a post, for cards that only rendered a preview"""
+    comments = Comment.query.filter_by(post_id=post_id).options(joinedload(Comment.author)).order_by(
+        Comment.created_at, Comment.id
+    ).all()
+    
+    return jsonify([{
+        'id': comment.id,
+        'username': comment.author.username,
+        'content': comment.content,
+        'created_at': comment.created_at.isoformat()
+    } for comment in comments])
 
-@app.route('/profile/<username>')
+@bp.route('/profile/<username>')
+@use_replica
 def profile(username):
     user = User.query.filter_by(username=username).first_or_404()
-    posts = Post.query.filter_by(user_id=user.id).order_by(Post.created_at.desc()).all()
-    return render_template('profile.html', user=user, posts=posts)
+    post_count = Post.query.filter_by(user_id=user.id).count()
+    posts, next_cursor = load_profile_page(user.id)
+    cards = load_post_cards(posts, current_user, with_comments=False)
+    return render_template('profile.html', user=user, cards=cards, post_count=post_count, next_cursor=next_cursor)
 
-@app.route('/chat')
+@bp.route('/api/profile/<username>/posts')
+@use_replica
+def api_profile_posts(username):
+    """Return the next page of a profile's post grid for infinite scroll"""
+    cursor = decode_cursor(request.args.get('cursor'))
+    if cursor is None:
+        return jsonify({'error': 'Invalid cursor'}), 400
+    
+    user = User.query.filter_by(username=username).first_or_404()
+    posts, next_cursor = load_profile_page(user.id, cursor)
+    cards = load_post_cards(posts, current_user, with_comments=False)
+    return jsonify({
+        'html': render_template('_post_cards.html', cards=cards),
+        'next_cursor': next_cursor
+    })
+
+@bp.route('/chat')
 @login_required
 def chat():
-    # Get all users for chat list
-    users = User.query.filter(User.id != current_user.id).all()
+    conversations, next_cursor = load_conversations(current_user.id)
     
-    # Get recent conversations
-    recent_messages = db.session.query(Message).filter(
-        (Message.sender_id == current_user.id) | (Message.recipient_id == current_user.id)
-    ).order_by(Message.created_at.desc()).limit(20).all()
+    # Allow starting a conversation from a profile page
+    chat_with = None
+    username = request.args.get('with')
+    if username and username != current_user.username:
+        chat_with = User.query.filter_by(username=username).first()
     
-    return render_template('chat.html', users=users, recent_messages=recent_messages)
+    return render_template('chat.html', conversations=conversations, next_cursor=next_cursor, chat_with=chat_with)
 
-@app.route('/send_message', methods=['POST'])
+@bp.route('/api/conversations')
+@login_required
+def api_conversations():
+    """Return the next page of the chat sidebar"""
+    cursor = decode_cursor(request.args.get('cursor'))
+    if request.args.get('cursor') and cursor is None:
+        return jsonify({'error': 'Invalid cursor'}), 400
+    
+    conversations, next_cursor = load_conversations(current_user.id, cursor)
+    return jsonify({
+        'html': render_template('_conversation_items.html', conversations=conversations),
+        'next_cursor': next_cursor
+    })
+
+@bp.route('/api/users/suggest')
+@login_required
+def suggest_users_api():
+    """Typeahead for starting a chat: contacts first, then other users by name"""
+    query = request.args.get('q', '').strip()
+    users = suggest_users(current_user.id, query)
+    return jsonify({
+        'users': [
+            {'id': user_id, 'username': username, 'is_contact': is_contact}
+            for user_id, username, is_contact in users
+        ]
+    })
+
+@bp.route('/send_message', methods=['POST'])
 @login_required
 def send_message():
     recipient_id = request.form.get('recipient_id')
     content = request.form.get('content')
     
     if recipient_id and content:
-        message = Message(
-            content=content,
-            sender_id=current_user.id,
-            recipient_id=int(recipient_id)
-        )
-        db.session.add(message)
+        message = deliver_message(current_user.id, int(recipient_id), content)
         db.session.commit()
+        publish_message(message)
+    
+    return redirect(url_for('main.chat'))
+
+@bp.route('/api/stream')
+@login_required
+def stream():
+    """Server-Sent Events feed of the caller's new messages and unread counts"""
+    heartbeat = current_app.config['SSE_HEARTBEAT_SECONDS']
+    max_seconds = current_app.config['SSE_MAX_STREAM_SECONDS']
+    
+    # With threaded workers every open stream holds a thread; past SSE_MAX_STREAMS the
+    # client is told to come back later, leaving threads for ordinary requests
+    release_slot = broker.acquire_stream_slot()
+    if release_slot is None:
+        return Response('retry: 15000\n\n', mimetype='text/event-stream', headers={'Cache-Control': 'no-cache'})
+    subscription = broker.subscribe(current_user.id)
+    
+    # The generator runs after the request context (and its DB session) is torn down.
+    # Streams end after max_seconds and the browser reconnects, so under a sync
+    # worker class no connection holds a worker indefinitely.
+    def generate():
+        try:
+            yield 'retry: 3000\n\n'
+            deadline = time.monotonic() + max_seconds
+            while time.monotonic() < deadline:
+                item = subscription.get(timeout=heartbeat)
+                if item is None:
+                    yield ': keepalive\n\n'
+                else:
+                    yield broker.format_sse(*item)
+        finally:
+            subscription.close()
     
-    return redirect(url_for('chat'))
+    response = Response(generate(), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
+    # Runs even if the client goes away before the generator starts
+    response.call_on_close(subscription.close)
+    response.call_on_close(release_slot)
+    return response
 
-@app.route('/uploads/<filename>')
+@bp.route('/uploads/<filename>')
 def uploaded_file(filename):
-    return send_from_directory(app.config['UPLOAD_FOLDER'], filename)
+    # Upload names are unique and never reused, so the name itself is a strong
+    # validator and browsers may keep the file for as long as they like
+    max_age = current_app.config['UPLOAD_CACHE_MAX_AGE']
+    if current_app.config['UPLOAD_SENDFILE_MODE'] == 'x-accel':
+        path = safe_join(os.path.join(current_app.root_path, current_app.config['UPLOAD_FOLDER']), filename)
+        if path is None or not os.path.isfile(path):
+            abort(404)
+        # The proxy streams the file (and answers ranges) from its internal location
+        response = Response(mimetype=mimetypes.guess_type(filename)[0] or 'application/octet-stream')
+        response.headers['X-Accel-Redirect'] = f"{current_app.config['UPLOAD_ACCEL_PREFIX'].rstrip('/')}/{quote(filename)}"
+        response.set_etag(filename)
+        response = response.make_conditional(request)
+    else:
+        response = send_from_directory(
+            current_app.config['UPLOAD_FOLDER'], filename, etag=filename, max_age=max_age, conditional=True
+        )
+    response.cache_control.public = True
+    response.cache_control.max_age = max_age
+    response.cache_control.immutable = True
+    return response
 
-@app.route('/api/messages/<int:user_id>')
+@bp.route('/api/messages/<int:user_id>')
 @login_required
 def get_messages(user_id):
-    messages = Message.query.filter(
-        ((Message.sender_id == current_user.id) & (Message.recipient_id == user_id)) |
-        ((Message.sender_id == user_id) & (Message.recipient_id == current_user.id))
-    ).order_by(Message.created_at.asc()).all()
+    # Stays on the primary: chat fetches since_id right after a new-message
+    # event, and marking read needs the current unread count
+    since_id = request.args.get('since_id', type=int)
+    before_id = request.args.get('before_id', type=int)
+    messages = load_messages(current_user.id, user_id, since_id=since_id, before_id=before_id)
     
-    # Mark messages as read
-    Message.query.filter_by(sender_id=user_id, recipient_id=current_user.id, is_read=False).update({'is_read': True})
-    db.session.commit()
+    # Mark messages as read; older pages never contain anything new
+    if not before_id and mark_conversation_read(current_user.id, user_id):
+        db.session.commit()
+        publish_unread(current_user.id, user_id, unread=0)
     
     return jsonify([{
         'id': msg.id,
@@ -186,53 +338,107 @@ def get_messages(user_id):
         'is_own': msg.sender_id == current_user.id
     } for msg in messages])
 
-@app.route('/map')
+@bp.route('/map')
 @login_required
 def map_view():
     return render_template('map.html')
 
-@app.route('/assistant')
+@bp.route('/assistant')
 @login_required
 def assistant():
     return render_template('assistant.html')
 
-@app.route('/settings')
+@bp.route('/settings')
 @login_required
 def settings():
-    return render_template('settings.html')
+    user = db.session.get(User, current_user.id)
+    return render_template('settings.html', user=user)
+
+# System prompts for the assistant's modes
+ASSISTANT_SYSTEM_PROMPTS = {
+    'general': 'أنت مساعد ذكي مفيد وودود. تجيب باللغة العربية وتقدم إجابات واضحة ومفيدة.',
+    'travel': 'أنت مساعد سفر متخصص. تساعد في التخطيط للرحلات والسياحة والطرق والفنادق. تجيب باللغة العربية.',
+    'emergency': 'أنت مساعد طوارئ. تقدم مساعدة فورية وإرشادات واضحة للمواقف الطارئة. تجيب باللغة العربية وتؤكد على السلامة أولاً.'
+}
+
+# Fallback responses when API is unavailable
+ASSISTANT_FALLBACK_RESPONSES = {
+    'general': 'عذراً، المساعد الذكي غير متاح حالياً. يرجى المحاولة لاحقاً.',
+    'travel': 'مساعد السفر غير متاح حالياً. يمكنك استخدام الوضع العام أو المحاولة لاحقاً.',
+    'emergency': 'في حالات الطوارئ، اتصل مباشرة بالرقم 999 للحصول على المساعدة الفورية.'
+}
 
-@app.route('/api/gpt-chat', methods=['POST'])
+GPT_COMMAND_SYSTEM_PROMPT = 'أنت مساعد ذكي في تطبيق المحادثات. تجيب باختصار وبوضوح باللغة العربية.'
+GPT_COMMAND_PREFIX = '🤖 مساعد GPT: '
+GPT_COMMAND_FALLBACK_TEXT = 'عذراً، لا أستطيع الإجابة حالياً. يرجى المحاولة لاحقاً.'
+GPT_COMMAND_FALLBACK = GPT_COMMAND_PREFIX + GPT_COMMAND_FALLBACK_TEXT
+
+def extract_gpt_question(message):
+    """Return the question following an @GPT command, or None if there is no command"""
+    # Check if message contains @GPT command
+    if '@GPT' not in message.upper():
+        return None
+    
+    # Extract the question after @GPT
+    gpt_parts = message.upper().split('@GPT', 1)
+    if len(gpt_parts) > 1:
+        return gpt_parts[1].strip()
+    return message
+
+def stream_completion(completion, on_complete=None, success=True, on_failure=None):
+    """Wrap a CompletionStream, or already-known text, as an SSE response of token events
+
+    ``on_complete`` receives the full text once a successful answer has been sent;
+    ``on_failure`` is called instead if the stream fails or the client leaves first.
+    Plain text is sent as one token; pass ``success=False`` for fallback text.
+    """
+    def generate():
+        ok = success
+        if isinstance(completion, str):
+            text = completion
+            yield broker.format_sse('token', {'text': text})
+        else:
+            parts = []
+            try:
+                for delta in completion:
+                    parts.append(delta)
+                    yield broker.format_sse('token', {'text': delta})
+            except llm.LLMUnavailable as e:
+                print(f"OpenAI API Error: {e}")
+                ok = False
+            text = ''.join(parts)
+        if ok and on_complete:
+            on_complete(text)
+        elif not ok and on_failure:
+            on_failure()
+        yield broker.format_sse('done', {'success': ok})
+    
+    response = Response(generate(), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
+    if not isinstance(completion, str):
+        # Frees the gateway slot even if the client disconnects before the first token
+        response.call_on_close(completion.close)
+    if on_failure:
+        # A no-op once the answer completed; otherwise the client left mid-stream
+        response.call_on_close(on_failure)
+    return response
+
+@bp.route('/api/gpt-chat', methods=['POST'])
 @login_required
 def gpt_chat():
     try:
         data = request.get_json()
         message = data.get('message', '')
         mode = data.get('mode', 'general')
+        if mode not in ASSISTANT_SYSTEM_PROMPTS:
+            mode = 'general'
         
-        # Define system prompts for different modes
-        system_prompts = {
-            'general': 'أنت مساعد ذكي مفيد وودود. تجيب باللغة العربية وتقدم إجابات واضحة ومفيدة.',
-            'travel': 'أنت مساعد سفر متخصص. تساعد في التخطيط للرحلات والسياحة والطرق والفنادق. تجيب باللغة العربية.',
-            'emergency': 'أنت مساعد طوارئ. تقدم مساعدة فورية وإرشادات واضحة للمواقف الطارئة. تجيب باللغة العربية وتؤكد على السلامة أولاً.'
-        }
-        
-        system_prompt = system_prompts.get(mode, system_prompts['general'])
+        system_prompt = ASSISTANT_SYSTEM_PROMPTS[mode]
         
-        # Create OpenAI chat completion
-        from openai import OpenAI
-        client = OpenAI(api_key=os.environ.get("OPENAI_API_KEY"))
-        
-        response = client.chat.completions.create(
-            model="gpt-3.5-turbo",
-            messages=[
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": message}
-            ],
-            max_tokens=500,
-            temperature=0.7
-        )
-        
-        ai_response = response.choices[0].message.content
+        # Create chat completion through the shared gateway; repeated questions are cached per mode
+        ai_response = llm.complete(system_prompt, message, max_tokens=500, mode=mode)
         
         return jsonify({
             'success': True,
@@ -241,91 +447,153 @@ def gpt_chat():
         
     except Exception as e:
         print(f"OpenAI API Error: {e}")
-        # Fallback responses when API is unavailable
-        fallback_responses = {
-            'general': 'عذراً، المساعد الذكي غير متاح حالياً. يرجى المحاولة لاحقاً.',
-            'travel': 'مساعد السفر غير متاح حالياً. يمكنك استخدام الوضع العام أو المحاولة لاحقاً.',
-            'emergency': 'في حالات الطوارئ، اتصل مباشرة بالرقم 999 للحصول على المساعدة الفورية.'
-        }
-        
         return jsonify({
             'success': False,
-            'response': fallback_responses.get(mode, fallback_responses['general'])
+            'response': ASSISTANT_FALLBACK_RESPONSES.get(mode, ASSISTANT_FALLBACK_RESPONSES['general'])
         })
 
-@app.route('/api/process-gpt-command', methods=['POST'])
+@bp.route('/api/gpt-chat/stream', methods=['POST'])
+@login_required
+def gpt_chat_stream():
+    """Streaming variant of gpt_chat: tokens are sent as SSE events as they arrive"""
+    data = request.get_json() or {}
+    message = data.get('message', '')
+    mode = data.get('mode', 'general')
+    if mode not in ASSISTANT_SYSTEM_PROMPTS:
+        mode = 'general'
+    system_prompt = ASSISTANT_SYSTEM_PROMPTS[mode]
+    
+    # Identical questions asked while one is streaming wait for its answer instead of going upstream
+    cache = current_app.extensions['completion_cache']
+    cached, pending, flight = cache.claim(mode, system_prompt, message)
+    if pending is not None:
+        try:
+            cached = cache.wait(pending)
+        except Exception as e:
+            print(f"OpenAI API Error: {e}")
+            return stream_completion(ASSISTANT_FALLBACK_RESPONSES[mode], success=False)
+    if cached is not None:
+        return stream_completion(cached)
+    
+    try:
+        completion = llm.stream(system_prompt, message, max_tokens=500)
+    except llm.LLMUnavailable as e:
+        print(f"OpenAI API Error: {e}")
+        flight.fail(e)
+        return stream_completion(ASSISTANT_FALLBACK_RESPONSES[mode], success=False)
+    
+    return stream_completion(completion, on_complete=flight.finish, on_failure=flight.fail)
+
+@bp.route('/api/process-gpt-command', methods=['POST'])
 @login_required
 def process_gpt_command():
     """Process @GPT commands in chat messages"""
     try:
         data = request.get_json()
-        message = data.get('message', '')
-        
-        # Check if message contains @GPT command
-        if '@GPT' not in message.upper():
+        question = extract_gpt_question(data.get('message', ''))
+        if question is None:
             return jsonify({'success': False, 'error': 'No @GPT command found'})
         
-        # Extract the question after @GPT
-        gpt_parts = message.upper().split('@GPT', 1)
-        if len(gpt_parts) > 1:
-            question = gpt_parts[1].strip()
-        else:
-            question = message
+        # Use the shared gateway to generate response
+        completion = llm.complete(GPT_COMMAND_SYSTEM_PROMPT, question, max_tokens=300, mode='gpt_command')
+        ai_response = f"{GPT_COMMAND_PREFIX}{completion}"
         
-        # Use OpenAI to generate response
-        from openai import OpenAI
-        client = OpenAI(api_key=os.environ.get("OPENAI_API_KEY"))
-        
-        response = client.chat.completions.create(
-            model="gpt-3.5-turbo",
-            messages=[
-                {"role": "system", "content": "أنت مساعد ذكي في تطبيق المحادثات. تجيب باختصار وبوضوح باللغة العربية."},
-                {"role": "user", "content": question}
-            ],
-            max_tokens=300,
-            temperature=0.7
-        )
-        
-        ai_response = response.choices[0].message.content
+        # When the chat passes its recipient, deliver the reply directly so both
+        # participants receive it over their streams
+        recipient_id = data.get('recipient_id')
+        if recipient_id:
+            reply = deliver_message(current_user.id, int(recipient_id), ai_response, is_gpt_response=True)
+            db.session.commit()
+            publish_message(reply)
         
         return jsonify({
             'success': True,
-            'response': f"🤖 مساعد GPT: {ai_response}"
+            'response': ai_response,
+            'delivered': bool(recipient_id)
         })
         
     except Exception as e:
         print(f"OpenAI API Error: {e}")
         return jsonify({
             'success': False,
-            'response': "🤖 مساعد GPT: عذراً، لا أستطيع الإجابة حالياً. يرجى المحاولة لاحقاً."
+            'response': GPT_COMMAND_FALLBACK
         })
 
-@app.route('/update_profile', methods=['POST'])
+@bp.route('/api/process-gpt-command/stream', methods=['POST'])
+@login_required
+def process_gpt_command_stream():
+    """Streaming variant of process_gpt_command; the finished reply is delivered to recipient_id"""
+    data = request.get_json() or {}
+    question = extract_gpt_question(data.get('message', ''))
+    if question is None:
+        return jsonify({'success': False, 'error': 'No @GPT command found'}), 400
+    
+    sender_id = current_user.id
+    recipient_id = data.get('recipient_id')
+    cache = current_app.extensions['completion_cache']
+    app = current_app._get_current_object()
+    
+    def deliver(text):
+        # Runs after the request context is gone, once the whole reply has streamed
+        if not recipient_id:
+            return
+        with app.app_context():
+            reply = deliver_message(sender_id, int(recipient_id), f"{GPT_COMMAND_PREFIX}{text}", is_gpt_response=True)
+            db.session.commit()
+            publish_message(reply)
+    
+    cached, pending, flight = cache.claim('gpt_command', GPT_COMMAND_SYSTEM_PROMPT, question)
+    if pending is not None:
+        try:
+            cached = cache.wait(pending)
+        except Exception as e:
+            print(f"OpenAI API Error: {e}")
+            return stream_completion(GPT_COMMAND_FALLBACK_TEXT, success=False)
+    if cached is not None:
+        return stream_completion(cached, on_complete=deliver)
+    
+    try:
+        completion = llm.stream(GPT_COMMAND_SYSTEM_PROMPT, question, max_tokens=300)
+    except llm.LLMUnavailable as e:
+        print(f"OpenAI API Error: {e}")
+        flight.fail(e)
+        # The client renders the prefix itself while streaming
+        return stream_completion(GPT_COMMAND_FALLBACK_TEXT, success=False)
+    
+    def finish(text):
+        flight.finish(text)
+        deliver(text)
+    
+    return stream_completion(completion, on_complete=finish, on_failure=flight.fail)
+
+@bp.route('/update_profile', methods=['POST'])
 @login_required
 def update_profile():
     try:
-        # Update user profile
-        current_user.email = request.form.get('email', current_user.email)
-        current_user.bio = request.form.get('bio', current_user.bio)
+        # current_user only carries the session fields, so edit the row itself
+        user = db.session.get(User, current_user.id)
+        user.email = request.form.get('email', user.email)
+        user.bio = request.form.get('bio', user.bio)
         
         # Handle profile picture upload
         file = request.files.get('profile_pic')
         if file and file.filename and allowed_file(file.filename):
             file_extension = file.filename.rsplit('.', 1)[1].lower()
-            filename = f"profile_{current_user.id}_{uuid.uuid4().hex}.{file_extension}"
-            file.save(os.path.join(app.config['UPLOAD_FOLDER'], filename))
-            current_user.profile_pic = filename
+            filename = images.store_upload(file, file_extension)
+            images.schedule_variants(filename)
+            user.profile_pic = filename
         
         db.session.commit()
+        auth.invalidate(user.id)
         flash('تم تحديث الملف الشخصي بنجاح!')
         
     except Exception as e:
         print(f"Profile update error: {e}")
         flash('حدث خطأ أثناء تحديث الملف الشخصي')
     
-    return redirect(url_for('settings'))
+    return redirect(url_for('main.settings'))
 
-@app.route('/api/send-sos', methods=['POST'])
+@bp.route('/api/send-sos', methods=['POST'])
 @login_required
 def send_sos():
     try:
@@ -333,20 +601,24 @@ def send_sos():
         latitude = data.get('latitude')
         longitude = data.get('longitude')
         message = data.get('message', 'طلب مساعدة طارئة')
+        has_location = valid_coordinates(latitude, longitude)
         
         # Create SOS alert
         sos_alert = SOSAlert(
             user_id=current_user.id,
             latitude=latitude,
             longitude=longitude,
+            geohash=geohash_encode(latitude, longitude) if has_location else None,
             message=message
         )
         db.session.add(sos_alert)
-        db.session.commit()
+        if has_location:
+            record_location(current_user.id, latitude, longitude)
+        db.session.flush()
         
-        # In a real app, this would broadcast to nearby devices
-        # For now, we'll just log it
-        print(f"SOS Alert from user {current_user.username} at {latitude}, {longitude}")
+        # Contacts and nearby users are notified by the job workers
+        enqueue_fanout(sos_alert)
+        db.session.commit()
         
         return jsonify({
             'success': True,
@@ -359,3 +631,169 @@ def send_sos():
             'success': False,
             'message': 'فشل في إرسال إشارة SOS'
         })
+
+@bp.route('/api/location', methods=['POST'])
+@login_required
+def update_location():
+    data = request.get_json(silent=True) or {}
+    latitude = data.get('latitude')
+    longitude = data.get('longitude')
+    if not valid_coordinates(latitude, longitude):
+        return jsonify({'success': False, 'message': 'موقع غير صالح'}), 400
+    
+    record_location(current_user.id, latitude, longitude)
+    db.session.commit()
+    return jsonify({'success': True})
+
+@bp.route('/api/sos/nearby')
+@login_required
+def nearby_sos_alerts():
+    latitude = request.args.get('lat', type=float)
+    longitude = request.args.get('lng', type=float)
+    if not valid_coordinates(latitude, longitude):
+        return jsonify({'success': False, 'message': 'موقع غير صالح'}), 400
+    
+    radius_km = request.args.get('radius_km', current_app.config['SOS_RADIUS_KM'], type=float)
+    radius_km = max(0.1, min(radius_km, current_app.config['NEARBY_MAX_RADIUS_KM']))
+    alerts = alerts_near(latitude, longitude, radius_km)
+    return jsonify({
+        'success': True,
+        'alerts': [alert_payload(alert, distance) for alert, distance in alerts]
+    })
+
+@bp.route('/api/offline-maps')
+@login_required
+def list_offline_maps():
+    offline_maps = OfflineMap.query.filter_by(user_id=current_user.id).order_by(OfflineMap.download_date.desc()).all()
+    return jsonify({
+        'success': True,
+        'maps': [offline_map_payload(offline_map) for offline_map in offline_maps]
+    })
+
+@bp.route('/api/offline-maps', methods=['POST'])
+@login_required
+def create_offline_map():
+    data = request.get_json(silent=True) or {}
+    latitude = data.get('latitude')
+    longitude = data.get('longitude')
+    region_name = (data.get('region_name') or '').strip()[:200] or 'منطقة محفوظة'
+    try:
+        radius_km = float(data.get('radius_km', 5))
+        min_zoom = int(data.get('min_zoom', 10))
+        max_zoom = int(data.get('max_zoom', 15))
+    except (TypeError, ValueError):
+        return jsonify({'success': False, 'message': 'بيانات غير صالحة'}), 400
+    
+    if (not valid_coordinates(latitude, longitude)
+            or not 0 < radius_km <= current_app.config['OFFLINE_MAP_MAX_RADIUS_KM']
+            or not 0 <= min_zoom <= max_zoom <= tilepack.MAX_ZOOM):
+        return jsonify({'success': False, 'message': 'بيانات غير صالحة'}), 400
+    if tilepack.count_region_tiles(latitude, longitude, radius_km, min_zoom, max_zoom) > current_app.config['OFFLINE_MAP_MAX_TILES']:
+        return jsonify({'success': False, 'message': 'المنطقة كبيرة جداً، قلل المساحة أو مستوى التكبير'}), 400
+    
+    offline_map = request_offline_map(current_user.id, region_name, latitude, longitude, radius_km, min_zoom, max_zoom)
+    db.session.commit()
+    return jsonify({'success': True, 'map': offline_map_payload(offline_map)})
+
+@bp.route('/api/offline-maps/<int:map_id>')
+@login_required
+def get_offline_map(map_id):
+    offline_map = OfflineMap.query.filter_by(id=map_id, user_id=current_user.id).first_or_404()
+    return jsonify({'success': True, 'map': offline_map_payload(offline_map)})
+
+@bp.route('/api/offline-maps/<int:map_id>/tiles/<int:z>/<int:x>/<int:y>')
+@login_required
+def offline_map_tile(map_id, z, x, y):
+    offline_map = OfflineMap.query.filter_by(id=map_id, user_id=current_user.id).first_or_404()
+    if offline_map.status != 'ready':
+        abort(404)
+    pack = open_pack(offline_map)
+    tile = pack.get(z, x, y)
+    if tile is None:
+        abort(404)
+    touch(offline_map)
+    
+    response = Response(tile, mimetype=pack.mimetype)
+    # A pack's tiles never change, but the pack can be evicted, so keep this private and bounded
+    response.cache_control.private = True
+    response.cache_control.max_age = 86400
+    return response
+
+@bp.route('/api/offline-maps/<int:map_id>/download')
+@login_required
+def download_offline_map(map_id):
+    offline_map = OfflineMap.query.filter_by(id=map_id, user_id=current_user.id).first_or_404()
+    if offline_map.status != 'ready':
+        abort(404)
+    touch(offline_map)
+    # Conditional responses answer Range/If-Range, so interrupted downloads resume
+    return send_from_directory(
+        current_app.config['TILE_PACK_DIR'], offline_map.pack_filename,
+        as_attachment=True,
+        download_name=f"{secure_filename(offline_map.region_name) or 'map'}.tilepack",
+        etag=offline_map.pack_filename,
+        conditional=True
+    )
+
+@bp.route('/api/search')
+@login_required
+def search_api():
+    query = request.args.get('q', '').strip()
+    search_type = request.args.get('type', 'posts')
+    page = request.args.get('page', 1, type=int)
+    if search_type not in search.SEARCH_TYPES or not 1 <= page <= current_app.config['SEARCH_MAX_PAGE']:
+        return jsonify({'success': False, 'message': 'طلب بحث غير صالح'}), 400
+    
+    per_page = current_app.config['SEARCH_PAGE_SIZE']
+    ids = search.search(search_type, query, current_user.id, page=page, per_page=per_page)
+    if search_type == 'posts':
+        found = Post.query.options(joinedload(Post.author)).filter(Post.id.in_(ids)).all()
+    elif search_type == 'users':
+        found = User.query.filter(User.id.in_(ids)).all()
+    else:
+        found = Message.query.options(joinedload(Message.sender), joinedload(Message.recipient)).filter(Message.id.in_(ids)).all()
+    by_id = {item.id: item for item in found}
+    
+    results = []
+    for item in (by_id[item_id] for item_id in ids if item_id in by_id):
+        if search_type == 'posts':
+            results.append({
+                'id': item.id,
+                'caption': item.caption,
+                'username': item.author.username,
+                'image_url': images.image_url(item.image_filename, 'thumb') if item.image_filename else None,
+                'url': url_for('main.profile', username=item.author.username)
+            })
+        elif search_type == 'users':
+            results.append({
+                'id': item.id,
+                'username': item.username,
+                'bio': item.bio,
+                'url': url_for('main.profile', username=item.username)
+            })
+        else:
+            peer = item.recipient if item.sender_id == current_user.id else item.sender
+            results.append({
+                'id': item.id,
+                'content': item.content,
+                'peer_username': peer.username,
+                'created_at': item.created_at.isoformat(),
+                'url': url_for('main.chat', **{'with': peer.username})
+            })
+    
+    return jsonify({
+        'success': True,
+        'results': results,
+        'next_page': page + 1 if len(ids) == per_page and page < current_app.config['SEARCH_MAX_PAGE'] else None
+    })
+
+@bp.route('/metrics')
+def metrics_endpoint():
+    """Prometheus scrape target: request, query and LLM latency plus queue and cache gauges"""
+    token = current_app.config['METRICS_TOKEN']
+    if not token:
+        # Not exposed at all until a scraper has been given a token
+        abort(404)
+    if not hmac.compare_digest(request.headers.get('Authorization', ''), f'Bearer {token}'):
+        abort(401)
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
@@ -0,0 +1,279 @@
+import re
+from sqlalchemy import event, inspect, text
+from sqlalchemy.engine import make_url
+from flask import current_app
+from app import db
+from models import User, Post, Comment, Message
+from text import normalize_query
+
+# Each indexed row's id is doc_id * 8 + kind code, so updates and deletes hit the primary key
+KIND_CODES = {'post': 1, 'comment': 2, 'user': 3, 'message': 4}
+# Search types exposed by the API and the document kinds each one covers
+SEARCH_TYPES = {
+    'posts': ('post', 'comment'),
+    'users': ('user',),
+    'messages': ('message',),
+}
+_TOKEN = re.compile(r'\w+')
+
+
+def query_tokens(query):
+    return _TOKEN.findall(normalize_query(query))
+
+
+def _row_id(kind, doc_id):
+    return doc_id * 8 + KIND_CODES[kind]
+
+
+class SearchBackend:
+    """Inverted index over normalized text, one row per post, comment, user or message.
+
+    ``ref_id`` is what a hit resolves to (a comment's post, a message's id) and
+    ``scope`` lists the user ids allowed to see the row, if restricted.
+    """
+
+    def create_schema(self, connection):
+        raise NotImplementedError
+
+    def upsert(self, connection, rows):
+        """Index rows of (kind, doc_id, ref_id, scope, body)."""
+        raise NotImplementedError
+
+    def delete(self, connection, kind, doc_id):
+        raise NotImplementedError
+
+    def clear(self, connection):
+        raise NotImplementedError
+
+    def search(self, connection, kinds, tokens, viewer_id, limit, offset):
+        """Return ref_ids ranked best first."""
+        raise NotImplementedError
+
+
+class SQLiteFTSBackend(SearchBackend):
+    """FTS5 virtual table; ``kind`` and ``scope`` are matched as column filters."""
+
+    def create_schema(self, connection):
+        connection.execute(text(
+            "CREATE VIRTUAL TABLE IF NOT EXISTS search_index USING fts5("
+            "kind, ref_id UNINDEXED, scope, body, "
+            "tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3')"
+        ))
+
+    def upsert(self, connection, rows):
+        if not rows:
+            return
+        connection.execute(text("DELETE FROM search_index WHERE rowid = :id"), [
+            {'id': _row_id(kind, doc_id)} for kind, doc_id, _, _, _ in rows
+        ])
+        connection.execute(text(
+            "INSERT INTO search_index (rowid, kind, ref_id, scope, body) VALUES (:id, :kind, :ref_id, :scope, :body)"
+        ), [
+            {
+                'id': _row_id(kind, doc_id),
+                'kind': kind,
+                'ref_id': ref_id,
+                'scope': ' '.join(f'u{user_id}' for user_id in scope or ()),
+                'body': body
+            }
+            for kind, doc_id, ref_id, scope, body in rows
+        ])
+
+    def delete(self, connection, kind, doc_id):
+        connection.execute(text("DELETE FROM search_index WHERE rowid = :id"), {'id': _row_id(kind, doc_id)})
+
+    def clear(self, connection):
+        connection.execute(text("DELETE FROM search_index"))
+
+    def search(self, connection, kinds, tokens, viewer_id, limit, offset):
+        # Every term must match; the last one as a prefix so results follow typing
+        terms = ' '.join(f'"{token}"' for token in tokens[:-1])
+        terms = f'{terms} "{tokens[-1]}"*'.strip()
+        match = f"kind : ({' OR '.join(kinds)}) AND body : ({terms})"
+        if viewer_id is not None:
+            match += f' AND scope : u{viewer_id}'
+        rows = connection.execute(text(
+            # bm25() can't be used inside an aggregate, so score the hits first
+            "WITH hits AS MATERIALIZED ("
+            "SELECT ref_id, bm25(search_index, 0.0, 0.0, 0.0, 1.0) AS score "
+            "FROM search_index WHERE search_index MATCH :match) "
+            "SELECT ref_id, min(score) AS best FROM hits "
+            "GROUP BY ref_id ORDER BY best, ref_id DESC LIMIT :limit OFFSET :offset"
+        ), {'match': match, 'limit': limit, 'offset': offset})
+        return [int(ref_id) for ref_id, _ in rows]
+
+
+class PostgresBackend(SearchBackend):
+    """tsvector column with GIN indexes on the vector and on the scope array."""
+
+    def create_schema(self, connection):
+        connection.execute(text(
+            "CREATE TABLE IF NOT EXISTS search_document ("
+            "id BIGINT PRIMARY KEY, kind VARCHAR(20) NOT NULL, ref_id INTEGER NOT NULL, "
+            "scope INTEGER[], tsv TSVECTOR NOT NULL)"
+        ))
+        connection.execute(text("CREATE INDEX IF NOT EXISTS ix_search_document_tsv ON search_document USING gin (tsv)"))
+        connection.execute(text("CREATE INDEX IF NOT EXISTS ix_search_document_scope ON search_document USING gin (scope)"))
+
+    def upsert(self, connection, rows):
+        if not rows:
+            return
+        # Text is normalized before indexing, so the 'simple' configuration only splits words
+        connection.execute(text(
+            "INSERT INTO search_document (id, kind, ref_id, scope, tsv) "
+            "VALUES (:id, :kind, :ref_id, :scope, to_tsvector('simple', :body)) "
+            "ON CONFLICT (id) DO UPDATE SET ref_id = EXCLUDED.ref_id, scope = EXCLUDED.scope, tsv = EXCLUDED.tsv"
+        ), [
+            {
+                'id': _row_id(kind, doc_id),
+                'kind': kind,
+                'ref_id': ref_id,
+                'scope': list(scope) if scope else None,
+                'body': body
+            }
+            for kind, doc_id, ref_id, scope, body in rows
+        ])
+
+    def delete(self, connection, kind, doc_id):
+        connection.execute(text("DELETE FROM search_document WHERE id = :id"), {'id': _row_id(kind, doc_id)})
+
+    def clear(self, connection):
+        connection.execute(text("TRUNCATE search_document"))
+
+    def search(self, connection, kinds, tokens, viewer_id, limit, offset):
+        terms = ' & '.join(tokens[:-1] + [f'{tokens[-1]}:*'])
+        sql = (
+            "SELECT ref_id, max(ts_rank(tsv, query)) AS score "
+            "FROM search_document, to_tsquery('simple', :terms) AS query "
+            "WHERE tsv @@ query AND kind = ANY(:kinds)"
+        )
+        params = {'terms': terms, 'kinds': list(kinds), 'limit': limit, 'offset': offset}
+        if viewer_id is not None:
+            sql += " AND scope @> ARRAY[:viewer_id]"
+            params['viewer_id'] = viewer_id
+        sql += " GROUP BY ref_id ORDER BY score DESC, ref_id DESC LIMIT :limit OFFSET :offset"
+        return [ref_id for ref_id, _ in connection.execute(text(sql), params)]
+
+
+def _backend():
+    return current_app.extensions['search']
+
+
+def init_app(app):
+    """Pick the backend for the configured database, without connecting to it."""
+    dialect = make_url(app.config['SQLALCHEMY_DATABASE_URI']).get_backend_name()
+    if dialect == 'postgresql':
+        backend = PostgresBackend()
+    elif dialect == 'sqlite':
+        backend = SQLiteFTSBackend()
+    else:
+        raise RuntimeError(f'Full-text search is not supported on {dialect}')
+    app.extensions['search'] = backend
+
+
+def create_schema():
+    """Create the index if missing; part of ``flask init-db``."""
+    with db.engine.begin() as connection:
+        _backend().create_schema(connection)
+
+
+def post_row(post):
+    return ('post', post.id, post.id, None, normalize_query(post.caption))
+
+
+def comment_row(comment):
+    return ('comment', comment.id, comment.post_id, None, normalize_query(comment.content))
+
+
+def user_row(user):
+    return ('user', user.id, user.id, None, normalize_query(f'{user.username} {user.bio or ""}'))
+
+
+def message_row(message):
+    return ('message', message.id, message.id, (message.sender_id, message.recipient_id), normalize_query(message.content))
+
+
+# Index rows are written on the flush's own connection, so they commit or roll back with the change
+@event.listens_for(Post, 'after_insert')
+def _index_new_post(mapper, connection, target):
+    _backend().upsert(connection, [post_row(target)])
+
+
+@event.listens_for(Post, 'after_update')
+def _reindex_post(mapper, connection, target):
+    if inspect(target).attrs.caption.history.has_changes():
+        _backend().upsert(connection, [post_row(target)])
+
+
+@event.listens_for(Comment, 'after_insert')
+def _index_new_comment(mapper, connection, target):
+    _backend().upsert(connection, [comment_row(target)])
+
+
+@event.listens_for(User, 'after_insert')
+def _index_new_user(mapper, connection, target):
+    _backend().upsert(connection, [user_row(target)])
+
+
+@event.listens_for(User, 'after_update')
+def _reindex_user(mapper, connection, target):
+    state = inspect(target)
+    if state.attrs.username.history.has_changes() or state.attrs.bio.history.has_changes():
+        _backend().upsert(connection, [user_row(target)])
+
+
+@event.listens_for(Message, 'after_insert')
+def _index_new_message(mapper, connection, target):
+    _backend().upsert(connection, [message_row(target)])
+
+
+def _unindex(kind):
+    def listener(mapper, connection, target):
+        _backend().delete(connection, kind, target.id)
+    return listener
+
+
+for _model, _kind in ((Post, 'post'), (Comment, 'comment'), (User, 'user'), (Message, 'message')):
+    event.listen(_model, 'after_delete', _unindex(_kind))
+
+
+def search(search_type, query, viewer_id, page=1, per_page=None):
+    """Return ids of matching posts, users or messages, best match first.
+
+    Message results are limited to conversations ``viewer_id`` took part in.
+    """
+    tokens = query_tokens(query)
+    if not tokens or search_type not in SEARCH_TYPES:
+        return []
+    per_page = per_page or current_app.config['SEARCH_PAGE_SIZE']
+    scope_id = viewer_id if search_type == 'messages' else None
+    return _backend().search(
+        db.session.connection(), SEARCH_TYPES[search_type], tokens, scope_id, per_page, (page - 1) * per_page
+    )
+
+
+def reindex(batch_size=1000):
+    """Rebuild the whole index from the source tables; returns rows indexed per kind."""
+    backend = _backend()
+    counts = {}
+    connection = db.session.connection()
+    backend.clear(connection)
+    for kind, model, to_row in (
+        ('post', Post, post_row),
+        ('comment', Comment, comment_row),
+        ('user', User, user_row),
+        ('message', Message, message_row),
+    ):
+        counts[kind] = 0
+        last_id = 0
+        while True:
+            batch = model.query.filter(model.id > last_id).order_by(model.id).limit(batch_size).all()
+            if not batch:
+                break
+            backend.upsert(connection, [to_row(item) for item in batch])
+            counts[kind] += len(batch)
+            last_id = batch[-1].id
+            db.session.commit()
+            db.session.expunge_all()
+            connection = db.session.connection()
+    return counts
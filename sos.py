@@ -0,0 +1,41 @@
+from app import db
+import jobs
+import notifications
+from geo import broadcast_sos
+from models import SOSAlert, EmergencyContact
+
+
+def enqueue_fanout(alert):
+    """Queue notification of everyone who should hear about ``alert``. The caller commits."""
+    return jobs.enqueue('sos.fanout', {'alert_id': alert.id}, idempotency_key=f'sos:{alert.id}')
+
+
+def contact_message(alert):
+    text = f"{alert.user.username} أرسل نداء استغاثة عبر EverChat: {alert.message}"
+    if alert.geohash is not None:
+        text += f" https://maps.google.com/?q={alert.latitude},{alert.longitude}"
+    return text
+
+
+@jobs.handler('sos.fanout')
+def fan_out(job):
+    """Push the alert to nearby users and queue one delivery job per emergency contact."""
+    alert = db.session.get(SOSAlert, job.data['alert_id'])
+    if alert is None or alert.status != 'active':
+        return
+
+    broadcast_sos(alert)
+
+    text = contact_message(alert)
+    for contact in EmergencyContact.query.filter_by(user_id=alert.user_id):
+        jobs.enqueue(
+            'sos.notify_contact',
+            {'alert_id': alert.id, 'contact_id': contact.id, 'phone': contact.phone, 'text': text},
+            idempotency_key=f'sos:{alert.id}:contact:{contact.id}'
+        )
+
+
+@jobs.handler('sos.notify_contact')
+def notify_contact(job):
+    data = job.data
+    notifications.send(data['phone'], data['text'], idempotency_key=job.idempotency_key)
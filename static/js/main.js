@@ -28,8 +28,8 @@ function initializeBootstrapComponents() {
     });
 }
 
-function initializeLikeButtons() {
-    document.querySelectorAll('.like-btn').forEach(button => {
+function initializeLikeButtons(root = document) {
+    root.querySelectorAll('.like-btn').forEach(button => {
         button.addEventListener('click', function() {
             const postId = this.getAttribute('data-post-id');
             const heartIcon = this.querySelector('i');
@@ -138,6 +138,9 @@ function initializeCommentToggles() {
         if (commentsSection) {
             if (commentsSection.style.display === 'none') {
                 commentsSection.style.display = 'block';
+                if (commentsSection.dataset.partial === 'true') {
+                    loadAllComments(postId, commentsSection);
+                }
             } else {
                 commentsSection.style.display = 'none';
             }
@@ -145,6 +148,37 @@ function initializeCommentToggles() {
     };
 }
 
+function loadAllComments(postId, commentsSection) {
+    // The card only rendered a preview; fetch the rest once
+    commentsSection.dataset.partial = 'false';
+    fetch(`/api/posts/${postId}/comments`)
+        .then(response => response.json())
+        .then(comments => {
+            commentsSection.innerHTML = '';
+            comments.forEach(comment => {
+                const commentDiv = document.createElement('div');
+                commentDiv.className = 'comment mb-2';
+                
+                const author = document.createElement('span');
+                author.className = 'fw-bold';
+                author.textContent = comment.username;
+                
+                const date = document.createElement('small');
+                date.className = 'text-muted d-block';
+                date.textContent = new Date(comment.created_at).toLocaleDateString(undefined, {month: 'short', day: 'numeric'});
+                
+                commentDiv.appendChild(author);
+                commentDiv.appendChild(document.createTextNode(` ${comment.content}`));
+                commentDiv.appendChild(date);
+                commentsSection.appendChild(commentDiv);
+            });
+        })
+        .catch(error => {
+            console.error('Error loading comments:', error);
+            commentsSection.dataset.partial = 'true';
+        });
+}
+
 function showNotification(message, type = 'info') {
     // Create notification element
     const notification = document.createElement('div');
@@ -171,6 +205,47 @@ function showNotification(message, type = 'info') {
     }, 5000);
 }
 
+// Read a text/event-stream response body (e.g. from a POST, which EventSource
+// cannot send) and call onEvent(eventName, data) for every event as it arrives
+function readEventStream(response, onEvent) {
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = '';
+    
+    function dispatch(block) {
+        let eventName = 'message';
+        const dataLines = [];
+        block.split('\n').forEach(line => {
+            if (line.startsWith('event:')) {
+                eventName = line.slice(6).trim();
+            } else if (line.startsWith('data:')) {
+                dataLines.push(line.slice(5).trim());
+            }
+        });
+        if (dataLines.length) {
+            onEvent(eventName, JSON.parse(dataLines.join('\n')));
+        }
+    }
+    
+    function pump() {
+        return reader.read().then(({done, value}) => {
+            if (done) {
+                if (buffer.trim()) dispatch(buffer);
+                return;
+            }
+            buffer += decoder.decode(value, {stream: true});
+            let boundary;
+            while ((boundary = buffer.indexOf('\n\n')) !== -1) {
+                dispatch(buffer.slice(0, boundary));
+                buffer = buffer.slice(boundary + 2);
+            }
+            return pump();
+        });
+    }
+    
+    return pump();
+}
+
 // Smooth scrolling for anchor links
 document.querySelectorAll('a[href^="#"]').forEach(anchor => {
     anchor.addEventListener('click', function (e) {
@@ -204,27 +279,44 @@ document.querySelectorAll('textarea').forEach(textarea => {
     });
 });
 
-// Infinite scroll for posts (future enhancement)
+// Infinite scroll for posts
 let isLoading = false;
-let currentPage = 1;
 
 function loadMorePosts() {
-    if (isLoading) return;
+    const feed = document.getElementById('feed');
+    if (isLoading || !feed || !feed.dataset.nextCursor) return;
     
     isLoading = true;
-    // Implementation for infinite scroll would go here
-    // For now, this is just a placeholder
+    const loader = document.getElementById('feed-loader');
+    if (loader) loader.style.display = 'block';
     
-    setTimeout(() => {
-        isLoading = false;
-    }, 1000);
+    // The home feed and profile grids share this; each names its own page endpoint
+    fetch(`${feed.dataset.pageUrl}?cursor=${encodeURIComponent(feed.dataset.nextCursor)}`)
+        .then(response => response.json())
+        .then(data => {
+            const page = document.createElement('div');
+            page.innerHTML = data.html;
+            initializeLikeButtons(page);
+            while (page.firstChild) {
+                feed.appendChild(page.firstChild);
+            }
+            feed.dataset.nextCursor = data.next_cursor || '';
+        })
+        .catch(error => {
+            console.error('Error loading posts:', error);
+            showNotification('Error loading posts', 'error');
+        })
+        .finally(() => {
+            isLoading = false;
+            if (loader) loader.style.display = 'none';
+        });
 }
 
 // Handle scroll events for infinite loading
 window.addEventListener('scroll', function() {
     if ((window.innerHeight + window.scrollY) >= document.body.offsetHeight - 1000) {
         // Load more posts when near bottom
-        // loadMorePosts();
+        loadMorePosts();
     }
 });
 
@@ -274,3 +366,96 @@ function initializeLazyLoading() {
 if ('IntersectionObserver' in window) {
     initializeLazyLoading();
 }
+
+// Search
+let searchType = 'posts';
+let searchPage = 1;
+let searchTimer = null;
+let searchRequest = 0;
+
+function showSearch() {
+    const modalElement = document.getElementById('searchModal');
+    if (!modalElement) return;
+
+    if (!modalElement.dataset.initialized) {
+        modalElement.dataset.initialized = 'true';
+        const input = document.getElementById('search-input');
+        input.addEventListener('input', function() {
+            // Debounced so typing doesn't fire a request per keystroke
+            clearTimeout(searchTimer);
+            searchTimer = setTimeout(() => runSearch(true), 250);
+        });
+        document.querySelectorAll('#search-types .nav-link').forEach(link => {
+            link.addEventListener('click', function(event) {
+                event.preventDefault();
+                document.querySelectorAll('#search-types .nav-link').forEach(other => other.classList.remove('active'));
+                this.classList.add('active');
+                searchType = this.dataset.type;
+                runSearch(true);
+            });
+        });
+        document.getElementById('search-more').addEventListener('click', () => runSearch(false));
+        modalElement.addEventListener('shown.bs.modal', () => input.focus());
+    }
+
+    bootstrap.Modal.getOrCreateInstance(modalElement).show();
+}
+
+function runSearch(reset) {
+    const query = document.getElementById('search-input').value.trim();
+    const results = document.getElementById('search-results');
+    const more = document.getElementById('search-more');
+    if (reset) {
+        searchPage = 1;
+        results.innerHTML = '';
+        more.classList.add('d-none');
+    }
+    if (!query) return;
+
+    const requestId = ++searchRequest;
+    const params = new URLSearchParams({q: query, type: searchType, page: searchPage});
+    fetch(`/api/search?${params}`)
+        .then(response => response.json())
+        .then(data => {
+            // Ignore responses to queries the user has already typed past
+            if (requestId !== searchRequest || !data.success) return;
+            data.results.forEach(result => results.appendChild(renderSearchResult(result)));
+            if (reset && !data.results.length) {
+                results.innerHTML = '<div class="text-center text-muted py-3">لا توجد نتائج</div>';
+            }
+            if (data.next_page) {
+                searchPage = data.next_page;
+                more.classList.remove('d-none');
+            } else {
+                more.classList.add('d-none');
+            }
+        })
+        .catch(error => console.error('Search error:', error));
+}
+
+function renderSearchResult(result) {
+    const item = document.createElement('a');
+    item.className = 'list-group-item list-group-item-action';
+    item.href = result.url;
+
+    const title = document.createElement('div');
+    title.className = 'fw-bold';
+    const detail = document.createElement('small');
+    detail.className = 'text-muted';
+
+    if (searchType === 'posts') {
+        title.textContent = result.username;
+        detail.textContent = result.caption || '';
+    } else if (searchType === 'users') {
+        title.textContent = result.username;
+        detail.textContent = result.bio || '';
+    } else {
+        title.textContent = result.peer_username;
+        detail.textContent = result.content;
+    }
+
+    item.appendChild(title);
+    item.appendChild(detail);
+    return item;
+}
+
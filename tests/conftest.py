@@ -0,0 +1,20 @@
+import pytest
+from app import create_app, db
+import commands
+
+
+@pytest.fixture
+def app(tmp_path):
+    """An app on a throwaway SQLite file, with the schema created and no background workers."""
+    app = create_app({
+        'TESTING': True,
+        'SQLALCHEMY_DATABASE_URI': f"sqlite:///{tmp_path / 'test.db'}",
+        'UPLOAD_FOLDER': str(tmp_path / 'uploads'),
+        'TILE_PACK_DIR': str(tmp_path / 'tilepacks'),
+        'JOB_WORKER_THREADS': 0,
+    })
+    with app.app_context():
+        commands.create_schema()
+        yield app
+        db.session.remove()
+        db.engine.dispose()
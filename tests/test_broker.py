@@ -0,0 +1,48 @@
+import sys
+import pytest
+from app import create_app
+import broker
+
+
+def test_events_reach_only_the_users_subscriptions():
+    hub = broker.InMemoryBroker()
+    first, second, other = hub.subscribe(1), hub.subscribe(1), hub.subscribe(2)
+
+    hub.publish(1, 'message', {'id': 5})
+
+    assert first.get(timeout=0) == ('message', {'id': 5})
+    assert second.get(timeout=0) == ('message', {'id': 5})
+    assert other.get(timeout=0) is None
+
+
+def test_slow_subscriber_keeps_the_newest_events():
+    hub = broker.InMemoryBroker()
+    subscription = broker.Subscription(hub, 1, maxsize=2)
+    for index in range(5):
+        subscription.put(('message', index))
+    assert [subscription.get(timeout=0)[1] for _ in range(2)] == [3, 4]
+
+
+def test_closed_subscription_gets_nothing():
+    hub = broker.InMemoryBroker()
+    subscription = hub.subscribe(1)
+    subscription.close()
+    hub.publish(1, 'message', {})
+    assert subscription.get(timeout=0) is None
+
+
+def test_stream_slots_are_capped(app):
+    app.config['SSE_MAX_STREAMS'] = 1
+    broker.init_app(app)
+    release = broker.acquire_stream_slot()
+    assert release is not None
+    assert broker.acquire_stream_slot() is None
+    release()
+    assert broker.acquire_stream_slot() is not None
+
+
+def test_redis_url_without_the_package_names_it(monkeypatch, tmp_path):
+    monkeypatch.setitem(sys.modules, 'redis', None)
+    with pytest.raises(RuntimeError, match='redis package is not installed'):
+        create_app({'SQLALCHEMY_DATABASE_URI': f"sqlite:///{tmp_path / 'test.db'}",
+                    'BROKER_URL': 'redis://localhost:6379/0'})
@@ -0,0 +1,128 @@
+import threading
+import time
+import pytest
+from completion_cache import CompletionCache
+
+PROMPT = 'You are a helpful assistant.'
+
+
+def answer(cache, mode, question, text='answer'):
+    return cache.get_or_compute(mode, PROMPT, question, lambda: text)
+
+
+def test_repeated_question_is_a_hit_after_normalization():
+    cache = CompletionCache()
+    assert answer(cache, 'general', 'ما هي عاصمة مصر؟', 'القاهرة') == 'القاهرة'
+
+    assert cache.claim('general', PROMPT, '  ما هى عاصمة مصر  ') == ('القاهرة', None, None)
+    assert (cache.hits, cache.misses) == (1, 1)
+
+
+def test_key_includes_mode_and_system_prompt():
+    cache = CompletionCache()
+    answer(cache, 'general', 'hi', 'general answer')
+
+    assert answer(cache, 'travel', 'hi', 'travel answer') == 'travel answer'
+    assert cache.get_or_compute('general', 'Another prompt', 'hi', lambda: 'other') == 'other'
+    assert cache.misses == 3
+
+
+def test_mode_with_zero_ttl_is_never_stored():
+    cache = CompletionCache(ttls={'emergency': 0})
+    answer(cache, 'emergency', 'help', 'call 122')
+    assert answer(cache, 'emergency', 'help', 'call 123') == 'call 123'
+    assert cache.hits == 0
+
+
+def test_entries_expire(monkeypatch):
+    cache = CompletionCache(default_ttl=10)
+    now = time.monotonic()
+    monkeypatch.setattr(time, 'monotonic', lambda: now)
+    answer(cache, 'general', 'hi', 'old')
+    monkeypatch.setattr(time, 'monotonic', lambda: now + 11)
+    assert answer(cache, 'general', 'hi', 'new') == 'new'
+
+
+def test_least_recently_used_entry_is_evicted():
+    cache = CompletionCache(max_entries=2)
+    answer(cache, 'general', 'a', '1')
+    answer(cache, 'general', 'b', '2')
+    answer(cache, 'general', 'a')
+    answer(cache, 'general', 'c', '3')
+
+    assert cache.evictions == 1
+    assert answer(cache, 'general', 'a') == '1'
+    assert answer(cache, 'general', 'b', 'recomputed') == 'recomputed'
+
+
+def test_claim_makes_one_leader_and_counts_followers_only_as_collapsed():
+    cache = CompletionCache()
+    text, pending, flight = cache.claim('general', PROMPT, 'hi')
+    assert text is None and pending is None and flight is not None
+
+    _, follower, none = cache.claim('general', PROMPT, 'hi')
+    assert follower is not None and none is None
+
+    flight.finish('hello')
+    assert cache.wait(follower) == 'hello'
+    assert cache.claim('general', PROMPT, 'hi') == ('hello', None, None)
+    assert (cache.misses, cache.collapsed, cache.hits) == (1, 1, 1)
+
+
+def test_failed_flight_wakes_followers_and_is_not_cached():
+    cache = CompletionCache()
+    _, _, flight = cache.claim('general', PROMPT, 'hi')
+    _, follower, _ = cache.claim('general', PROMPT, 'hi')
+
+    flight.fail(RuntimeError('upstream down'))
+    # A second resolution, e.g. from the stream's close callback, is ignored
+    flight.finish('too late')
+
+    with pytest.raises(RuntimeError, match='upstream down'):
+        cache.wait(follower)
+    _, _, retry = cache.claim('general', PROMPT, 'hi')
+    assert retry is not None
+
+
+def test_compute_errors_propagate_and_are_not_cached():
+    cache = CompletionCache()
+
+    def broken():
+        raise ConnectionError('down')
+
+    with pytest.raises(ConnectionError):
+        cache.get_or_compute('general', PROMPT, 'hi', broken)
+    assert answer(cache, 'general', 'hi', 'recovered') == 'recovered'
+
+
+def test_get_or_compute_collapses_concurrent_misses():
+    cache = CompletionCache()
+    started = threading.Event()
+    release = threading.Event()
+    calls = []
+
+    def compute():
+        calls.append(1)
+        started.set()
+        release.wait(5)
+        return 'answer'
+
+    results = []
+    leader = threading.Thread(target=lambda: results.append(cache.get_or_compute('general', PROMPT, 'q', compute)))
+    leader.start()
+    started.wait(5)
+    followers = [
+        threading.Thread(target=lambda: results.append(cache.get_or_compute('general', PROMPT, 'q', compute)))
+        for _ in range(4)
+    ]
+    for thread in followers:
+        thread.start()
+    while cache.collapsed < 4:
+        time.sleep(0.01)
+    release.set()
+    for thread in [leader] + followers:
+        thread.join(5)
+
+    assert results == ['answer'] * 5
+    assert len(calls) == 1
+    assert cache.misses == 1
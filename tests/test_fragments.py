@@ -0,0 +1,95 @@
+import sys
+import pytest
+from app import create_app, db
+from models import User, Post, Like, Comment
+import fragments
+
+
+def _post_with_comment():
+    author = User(username='author', email='author@example.com')
+    commenter = User(username='commenter', email='commenter@example.com')
+    db.session.add_all([author, commenter])
+    db.session.flush()
+    post = Post(caption='sunset', user_id=author.id)
+    db.session.add(post)
+    db.session.flush()
+    db.session.add(Comment(content='nice', user_id=commenter.id, post_id=post.id))
+    db.session.commit()
+    return post, commenter
+
+
+def _home(app):
+    return app.test_client().get('/').get_data(as_text=True)
+
+
+def test_local_backend_evicts_least_recently_used():
+    backend = fragments.LocalFragmentBackend(max_entries=2)
+    backend.set_many({'a': '1', 'b': '2'})
+    backend.get_many(['a'])
+    backend.set_many({'c': '3'})
+    assert backend.get_many(['a', 'b', 'c']) == {'a': '1', 'c': '3'}
+
+
+def test_backend_errors_count_as_misses():
+    class Broken(fragments.FragmentBackend):
+        def get_many(self, keys):
+            raise ConnectionError('down')
+
+        def set_many(self, fragments):
+            raise ConnectionError('down')
+
+    cache = fragments.FragmentCache(Broken())
+    assert cache.get_many(['a', 'b']) == {}
+    cache.set_many({'a': '1'})
+    assert (cache.hits, cache.misses, cache.errors) == (0, 2, 2)
+
+
+def test_cards_are_served_from_the_cache(app):
+    _post_with_comment()
+    cache = app.extensions['fragments']
+    _home(app)
+    misses = cache.misses
+    _home(app)
+    assert cache.misses == misses
+    assert cache.hits >= 1
+
+
+def test_new_like_refreshes_the_card(app):
+    post, commenter = _post_with_comment()
+    assert '>0</span> likes' in _home(app)
+
+    db.session.add(Like(user_id=commenter.id, post_id=post.id))
+    db.session.commit()
+
+    assert '>1</span> likes' in _home(app)
+
+
+def test_repair_counters_refreshes_cached_cards(app):
+    post, _ = _post_with_comment()
+    db.session.execute(Post.__table__.update().values(like_count=7))
+    db.session.commit()
+    assert '>7</span> likes' in _home(app)
+
+    result = app.test_cli_runner().invoke(args=['repair-counters'])
+
+    assert result.exit_code == 0
+    assert '>0</span> likes' in _home(app)
+
+
+def test_renamed_commenter_refreshes_cards_they_commented_on(app):
+    post, commenter = _post_with_comment()
+    assert 'commenter' in _home(app)
+
+    commenter.username = 'renamed'
+    db.session.commit()
+
+    html = _home(app)
+    assert 'renamed' in html
+    assert 'commenter' not in html
+
+
+def test_redis_url_without_the_package_names_it(monkeypatch, tmp_path):
+    monkeypatch.setitem(sys.modules, 'redis', None)
+    with pytest.raises(RuntimeError, match='redis package is not installed'):
+        create_app({'SQLALCHEMY_DATABASE_URI': f"sqlite:///{tmp_path / 'test.db'}",
+                    'FRAGMENT_CACHE_URL': 'redis://localhost:6379/0'})
@@ -0,0 +1,111 @@
+import math
+import random
+from datetime import datetime, timedelta
+import pytest
+from app import db
+from models import User, UserLocation, SOSAlert
+import geo
+
+
+def test_encode_known_geohash():
+    assert geo.encode(57.64911, 10.40744, precision=11) == 'u4pruydqqvj'
+    # A coarser hash is a prefix of a finer one, which is what the prefix range scans rely on
+    assert geo.encode(30.0444, 31.2357).startswith(geo.encode(30.0444, 31.2357, precision=5))
+
+
+def test_valid_coordinates():
+    assert geo.valid_coordinates(30.0, 31.2)
+    assert geo.valid_coordinates(-90, 180)
+    assert not geo.valid_coordinates(91, 0)
+    assert not geo.valid_coordinates(0, -181)
+    assert not geo.valid_coordinates('30', 31)
+
+
+def test_haversine_km():
+    # Cairo to Alexandria is about 180 km
+    assert geo.haversine_km(30.0444, 31.2357, 31.2001, 29.9187) == pytest.approx(180, abs=5)
+    assert geo.haversine_km(10, 20, 10, 20) == 0
+
+
+@pytest.mark.parametrize('latitude, longitude, radius_km', [
+    (30.0444, 31.2357, 5),
+    (30.0444, 31.2357, 50),
+    (0.0, 179.99, 20),  # across the antimeridian
+    (89.5, 0.0, 30),  # near the pole
+])
+def test_covering_cells_contain_every_point_in_radius(latitude, longitude, radius_km):
+    cells = geo.covering_cells(latitude, longitude, radius_km)
+    assert 0 < len(cells) <= geo.MAX_COVERING_CELLS
+
+    rng = random.Random(1)
+    for _ in range(500):
+        bearing = rng.uniform(0, 2 * math.pi)
+        distance = radius_km * math.sqrt(rng.random()) * 0.99
+        point_lat = latitude + distance / geo._KM_PER_DEGREE * math.cos(bearing)
+        point_lon = longitude + distance / (geo._KM_PER_DEGREE * math.cos(math.radians(latitude))) * math.sin(bearing)
+        point_lat = max(-90.0, min(90.0, point_lat))
+        point_lon = (point_lon + 180.0) % 360.0 - 180.0
+        if geo.haversine_km(latitude, longitude, point_lat, point_lon) > radius_km:
+            continue
+        point_hash = geo.encode(point_lat, point_lon)
+        assert any(point_hash.startswith(cell) for cell in cells)
+
+
+def _user(name):
+    user = User(username=name, email=f'{name}@example.com')
+    db.session.add(user)
+    db.session.flush()
+    return user
+
+
+def test_users_near(app):
+    origin = (30.0444, 31.2357)
+    near, far, stale, me = _user('near'), _user('far'), _user('stale'), _user('me')
+    geo.record_location(near.id, 30.05, 31.24)
+    geo.record_location(far.id, 31.2001, 29.9187)
+    geo.record_location(stale.id, 30.045, 31.236)
+    geo.record_location(me.id, *origin)
+    db.session.commit()
+    stale_location = UserLocation.query.filter_by(user_id=stale.id).one()
+    stale_location.updated_at = datetime.utcnow() - timedelta(hours=app.config['LOCATION_MAX_AGE_HOURS'] + 1)
+    db.session.commit()
+
+    found = geo.users_near(*origin, 10, exclude_user_id=me.id)
+
+    assert [row.user_id for row, _ in found] == [near.id]
+    assert found[0][1] < 1.5
+
+
+def test_record_location_updates_in_place(app):
+    user = _user('mover')
+    geo.record_location(user.id, 30.0, 31.0)
+    db.session.commit()
+    location = geo.record_location(user.id, 31.2, 29.9)
+    db.session.commit()
+
+    assert UserLocation.query.count() == 1
+    assert location.geohash == geo.encode(31.2, 29.9)
+
+
+def test_alerts_near_only_returns_recent_active_alerts_nearest_first(app):
+    user = _user('caller')
+
+    def alert(latitude, longitude, **fields):
+        sos = SOSAlert(user_id=user.id, latitude=latitude, longitude=longitude,
+                       geohash=geo.encode(latitude, longitude), message='help', **fields)
+        db.session.add(sos)
+        return sos
+
+    closer = alert(30.045, 31.236)
+    further = alert(30.07, 31.26)
+    alert(30.046, 31.237, status='resolved')
+    alert(30.047, 31.238, created_at=datetime.utcnow() - timedelta(hours=app.config['SOS_ACTIVE_HOURS'] + 1))
+    alert(31.2001, 29.9187)
+    db.session.commit()
+
+    found = geo.alerts_near(30.0444, 31.2357, 10)
+
+    assert [sos.id for sos, _ in found] == [closer.id, further.id]
+    payload = geo.alert_payload(*found[0])
+    assert payload['username'] == 'caller'
+    assert payload['distance_km'] == round(found[0][1], 2)
@@ -0,0 +1,38 @@
+import io
+import os
+import pytest
+from werkzeug.datastructures import FileStorage
+from werkzeug.exceptions import RequestEntityTooLarge
+import images
+
+
+class FailingStream(io.BytesIO):
+    """Yields one chunk, then fails the way an oversized or aborted upload does."""
+
+    def read(self, size=-1):
+        if self.tell():
+            raise RequestEntityTooLarge()
+        return super().read(size)
+
+
+def _upload_files(app):
+    return sorted(os.listdir(app.config['UPLOAD_FOLDER']))
+
+
+def test_identical_uploads_share_one_file(app):
+    first = images.store_upload(FileStorage(io.BytesIO(b'same bytes')), 'png')
+    second = images.store_upload(FileStorage(io.BytesIO(b'same bytes')), 'png')
+    other = images.store_upload(FileStorage(io.BytesIO(b'other bytes')), 'png')
+
+    assert first == second != other
+    assert _upload_files(app) == sorted([first, other])
+
+
+def test_failed_upload_leaves_no_temp_file(app):
+    with pytest.raises(RequestEntityTooLarge):
+        images.store_upload(FileStorage(FailingStream(b'x' * 200 * 1024)), 'png')
+    assert _upload_files(app) == []
+
+
+def test_variant_filename():
+    assert images.variant_filename('abc.png', 'thumb') == f'abc_thumb.{images.VARIANT_FORMAT}'
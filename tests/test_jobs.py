@@ -0,0 +1,104 @@
+from datetime import datetime, timedelta
+from app import db
+from models import Job
+import jobs
+
+calls = []
+
+
+@jobs.handler('test.record')
+def _record(job):
+    calls.append(job.data)
+
+
+@jobs.handler('test.fail')
+def _fail(job):
+    raise RuntimeError('boom')
+
+
+def setup_function():
+    calls.clear()
+
+
+def test_enqueue_is_idempotent(app):
+    first = jobs.enqueue('test.record', {'n': 1}, idempotency_key='once')
+    db.session.commit()
+    second = jobs.enqueue('test.record', {'n': 2}, idempotency_key='once')
+    db.session.commit()
+
+    assert second.id == first.id
+    assert Job.query.count() == 1
+
+
+def test_worker_runs_due_jobs(app):
+    jobs.enqueue('test.record', {'n': 1})
+    jobs.enqueue('test.record', {'n': 2})
+    jobs.enqueue('test.record', {'n': 3}, delay_seconds=3600)
+    db.session.commit()
+
+    worker = jobs.Worker(batch_size=10)
+    assert worker.run_once() == 2
+    assert worker.run_once() == 0
+
+    assert sorted(data['n'] for data in calls) == [1, 2]
+    done = Job.query.filter_by(status='done').all()
+    assert len(done) == 2
+    assert all(job.finished_at and job.locked_by is None for job in done)
+    assert jobs.queue_stats()['pending'] == 1
+
+
+def test_failed_job_is_retried_with_backoff_then_given_up(app):
+    job = jobs.enqueue('test.fail', {}, max_attempts=2)
+    db.session.commit()
+    worker = jobs.Worker()
+
+    assert worker.run_once() == 1
+    db.session.refresh(job)
+    assert job.status == 'pending'
+    assert job.attempts == 1
+    assert job.run_at > datetime.utcnow()
+    assert job.last_error == 'RuntimeError: boom'
+
+    job.run_at = datetime.utcnow()
+    db.session.commit()
+    worker.run_once()
+    db.session.refresh(job)
+    assert job.status == 'failed'
+    assert job.attempts == 2
+    assert job.finished_at is not None
+
+
+def test_unknown_kind_fails(app):
+    job = jobs.enqueue('test.missing', {}, max_attempts=1)
+    db.session.commit()
+    jobs.Worker().run_once()
+    db.session.refresh(job)
+    assert job.status == 'failed'
+    assert 'no handler registered' in job.last_error
+
+
+def test_stale_running_job_is_reclaimed(app):
+    job = jobs.enqueue('test.record', {'n': 7})
+    db.session.commit()
+    job.status = 'running'
+    job.locked_by = 'dead-worker'
+    job.locked_at = datetime.utcnow() - timedelta(seconds=app.config['JOB_LOCK_TIMEOUT_SECONDS'] + 1)
+    job.attempts = 1
+    db.session.commit()
+
+    assert jobs.Worker().run_once() == 1
+    db.session.refresh(job)
+    assert job.status == 'done'
+    assert job.attempts == 2
+    assert calls == [{'n': 7}]
+
+
+def test_recently_locked_job_is_left_alone(app):
+    job = jobs.enqueue('test.record', {})
+    db.session.commit()
+    job.status = 'running'
+    job.locked_by = 'busy-worker'
+    job.locked_at = datetime.utcnow()
+    db.session.commit()
+
+    assert jobs.Worker().run_once() == 0
@@ -0,0 +1,152 @@
+import os
+import time
+from types import SimpleNamespace
+import pytest
+import llm
+
+
+class FakeCompletions:
+    """Stands in for client.chat.completions; ``fail`` makes the next calls raise."""
+
+    def __init__(self):
+        self.fail = False
+        self.calls = 0
+
+    def create(self, stream=False, **kwargs):
+        self.calls += 1
+        if self.fail:
+            raise ConnectionError('upstream down')
+        if stream:
+            return FakeUpstream(['مرحبا', ' بك'])
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content='مرحبا'))])
+
+
+class FakeUpstream:
+    def __init__(self, deltas):
+        self._deltas = deltas
+        self.closed = False
+
+    def __iter__(self):
+        for delta in self._deltas:
+            yield SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=delta))])
+
+    def close(self):
+        self.closed = True
+
+
+def make_gateway(**kwargs):
+    options = {'max_concurrency': 1, 'max_queue': 4, 'queue_timeout': 0.05,
+               'breaker': llm.CircuitBreaker(failure_threshold=2, reset_seconds=60)}
+    options.update(kwargs)
+    gateway = llm.LLMGateway('test-key', **options)
+    completions = FakeCompletions()
+    gateway._client = SimpleNamespace(chat=SimpleNamespace(completions=completions))
+    gateway._client_pid = os.getpid()
+    return gateway, completions
+
+
+def open_circuit(gateway, completions):
+    completions.fail = True
+    for _ in range(gateway.breaker.failure_threshold):
+        with pytest.raises(llm.LLMUnavailable):
+            gateway.complete('system', 'question', max_tokens=10)
+    completions.fail = False
+    assert gateway.breaker.state == 'open'
+
+
+def half_open(breaker):
+    breaker._opened_at = time.monotonic() - breaker.reset_seconds
+
+
+def test_breaker_opens_and_a_successful_trial_closes_it():
+    gateway, completions = make_gateway()
+    open_circuit(gateway, completions)
+
+    with pytest.raises(llm.LLMUnavailable, match='circuit is open'):
+        gateway.complete('system', 'question', max_tokens=10)
+    assert completions.calls == 2
+
+    half_open(gateway.breaker)
+    assert gateway.complete('system', 'question', max_tokens=10) == 'مرحبا'
+    assert gateway.breaker.state == 'closed'
+
+
+def test_failed_trial_reopens_the_circuit():
+    gateway, completions = make_gateway()
+    open_circuit(gateway, completions)
+    half_open(gateway.breaker)
+
+    completions.fail = True
+    with pytest.raises(llm.LLMUnavailable):
+        gateway.complete('system', 'question', max_tokens=10)
+    assert gateway.breaker.state == 'open'
+
+
+def test_trial_rejected_for_want_of_a_slot_does_not_wedge_the_breaker():
+    gateway, completions = make_gateway()
+    # A stream admitted earlier keeps the only slot busy
+    holder = gateway.stream('system', 'question', max_tokens=10)
+    half_open(gateway.breaker)
+
+    with pytest.raises(llm.LLMUnavailable, match='timed out'):
+        gateway.complete('system', 'question', max_tokens=10)
+    holder.close()
+
+    assert gateway.complete('system', 'question', max_tokens=10) == 'مرحبا'
+    assert gateway.breaker.state == 'closed'
+
+
+def test_full_queue_sheds_without_touching_the_breaker():
+    gateway, completions = make_gateway(max_queue=0)
+    half_open(gateway.breaker)
+
+    with pytest.raises(llm.LLMUnavailable, match='queue is full'):
+        gateway.complete('system', 'question', max_tokens=10)
+    assert gateway.breaker.allow()
+
+
+def test_concurrency_is_bounded():
+    gateway, completions = make_gateway(max_concurrency=2, queue_timeout=0.01)
+    streams = [gateway.stream('system', 'question', max_tokens=10) for _ in range(2)]
+
+    with pytest.raises(llm.LLMUnavailable):
+        gateway.stream('system', 'question', max_tokens=10)
+    assert ''.join(streams[0]) == 'مرحبا بك'
+    gateway.stream('system', 'question', max_tokens=10).close()
+    streams[1].close()
+
+
+def test_stream_closed_before_the_first_token_releases_the_trial():
+    gateway, completions = make_gateway()
+    open_circuit(gateway, completions)
+    half_open(gateway.breaker)
+
+    gateway.stream('system', 'question', max_tokens=10).close()
+
+    assert gateway.breaker.state == 'half-open'
+    assert gateway.complete('system', 'question', max_tokens=10) == 'مرحبا'
+    assert gateway.breaker.state == 'closed'
+
+
+def test_stream_abandoned_mid_iteration_releases_the_trial():
+    gateway, completions = make_gateway()
+    open_circuit(gateway, completions)
+    half_open(gateway.breaker)
+
+    deltas = iter(gateway.stream('system', 'question', max_tokens=10))
+    assert next(deltas) == 'مرحبا'
+    deltas.close()  # GeneratorExit, as when the response is torn down mid-stream
+
+    assert gateway.breaker.allow()
+
+
+def test_finished_stream_records_success():
+    gateway, completions = make_gateway()
+    open_circuit(gateway, completions)
+    half_open(gateway.breaker)
+
+    stream = gateway.stream('system', 'question', max_tokens=10)
+    assert list(stream) == ['مرحبا', ' بك']
+    stream.close()
+
+    assert gateway.breaker.state == 'closed'
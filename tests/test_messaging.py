@@ -0,0 +1,93 @@
+import threading
+from app import db
+from models import User, Message, Conversation
+from messaging import deliver_message, mark_conversation_read, load_conversations
+
+
+def _users(*names):
+    users = [User(username=name, email=f'{name}@example.com') for name in names]
+    db.session.add_all(users)
+    db.session.commit()
+    return [user.id for user in users]
+
+
+def _conversation(user_id, peer_id):
+    return Conversation.query.filter_by(user_id=user_id, peer_id=peer_id).one()
+
+
+def test_first_message_creates_both_summaries(app):
+    ali, sara = _users('ali', 'sara')
+    message = deliver_message(ali, sara, 'مرحبا')
+    db.session.commit()
+
+    mine, theirs = _conversation(ali, sara), _conversation(sara, ali)
+    assert (mine.unread_count, theirs.unread_count) == (0, 1)
+    assert mine.last_message_id == theirs.last_message_id == message.id
+    assert theirs.last_message_preview == 'مرحبا'
+
+
+def test_later_messages_update_the_summaries_in_place(app):
+    ali, sara = _users('ali', 'sara')
+    deliver_message(ali, sara, 'one')
+    deliver_message(ali, sara, 'two')
+    reply = deliver_message(sara, ali, 'x' * 150)
+    db.session.commit()
+
+    assert Conversation.query.count() == 2
+    assert _conversation(sara, ali).unread_count == 2
+    assert _conversation(ali, sara).unread_count == 1
+    assert _conversation(ali, sara).last_message_id == reply.id
+    assert len(_conversation(ali, sara).last_message_preview) == 100
+
+    assert mark_conversation_read(sara, ali)
+    db.session.commit()
+    assert _conversation(sara, ali).unread_count == 0
+    assert Message.query.filter_by(recipient_id=sara, is_read=False).count() == 0
+    assert not mark_conversation_read(sara, ali)
+
+
+def test_message_to_self_is_never_unread(app):
+    ali, = _users('ali')
+    deliver_message(ali, ali, 'note to self')
+    db.session.commit()
+    assert Conversation.query.count() == 1
+    assert _conversation(ali, ali).unread_count == 0
+
+
+def test_simultaneous_first_messages_keep_both(app):
+    ali, sara = _users('ali', 'sara')
+    barrier = threading.Barrier(2)
+    errors = []
+
+    def send(sender_id, recipient_id):
+        with app.app_context():
+            try:
+                barrier.wait(5)
+                deliver_message(sender_id, recipient_id, f'from {sender_id}')
+                db.session.commit()
+            except Exception as e:
+                errors.append(e)
+            finally:
+                db.session.remove()
+
+    threads = [threading.Thread(target=send, args=pair) for pair in ((ali, sara), (sara, ali))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(10)
+
+    assert errors == []
+    assert Message.query.count() == 2
+    assert Conversation.query.count() == 2
+    assert _conversation(ali, sara).unread_count == 1
+    assert _conversation(sara, ali).unread_count == 1
+
+
+def test_inbox_lists_latest_conversation_first(app):
+    ali, sara, omar = _users('ali', 'sara', 'omar')
+    deliver_message(sara, ali, 'hi')
+    deliver_message(omar, ali, 'hey')
+    db.session.commit()
+
+    rows, _ = load_conversations(ali)
+    assert [row.peer_id for row in rows] == [omar, sara]
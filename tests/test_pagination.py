@@ -0,0 +1,72 @@
+from datetime import datetime, timedelta
+from app import db
+from models import User, Post
+from pagination import encode_cursor, decode_cursor, keyset_page
+
+
+def test_cursor_round_trip():
+    created_at = datetime(2024, 5, 1, 12, 30, 15, 123456)
+    token = encode_cursor(created_at, 42)
+    assert '=' not in token
+    assert decode_cursor(token) == (created_at, 42)
+
+
+def test_decode_cursor_rejects_garbage():
+    assert decode_cursor(None) is None
+    assert decode_cursor('') is None
+    assert decode_cursor('not-a-cursor') is None
+    assert decode_cursor(encode_cursor(datetime(2024, 1, 1), 1)[:-3]) is None
+
+
+def _add_posts(count, same_time_every=1):
+    user = User(username='poster', email='poster@example.com')
+    db.session.add(user)
+    db.session.flush()
+    start = datetime(2024, 1, 1)
+    for index in range(count):
+        # Several posts share a timestamp, so the id has to break ties
+        created_at = start + timedelta(minutes=index // same_time_every)
+        db.session.add(Post(caption=f'post {index}', user_id=user.id, created_at=created_at))
+    db.session.commit()
+    return user
+
+
+def _walk(query, limit):
+    pages = []
+    cursor = None
+    while True:
+        rows, token = keyset_page(query, Post.created_at, Post.id, cursor, limit)
+        pages.append([row.id for row in rows])
+        if token is None:
+            return pages
+        cursor = decode_cursor(token)
+
+
+def test_keyset_page_walks_every_row_once_newest_first(app):
+    _add_posts(23, same_time_every=3)
+    expected = [post.id for post in Post.query.order_by(Post.created_at.desc(), Post.id.desc())]
+
+    pages = _walk(Post.query, 5)
+
+    assert [len(page) for page in pages] == [5, 5, 5, 5, 3]
+    assert [post_id for page in pages for post_id in page] == expected
+
+
+def test_keyset_page_has_no_cursor_when_rows_fit_exactly(app):
+    _add_posts(10)
+    rows, token = keyset_page(Post.query, Post.created_at, Post.id, None, 10)
+    assert len(rows) == 10
+    assert token is None
+
+
+def test_keyset_page_respects_query_filters(app):
+    user = _add_posts(4)
+    other = User(username='other', email='other@example.com')
+    db.session.add(other)
+    db.session.flush()
+    db.session.add(Post(caption='elsewhere', user_id=other.id))
+    db.session.commit()
+
+    pages = _walk(Post.query.filter_by(user_id=user.id), 3)
+
+    assert sum(len(page) for page in pages) == 4
@@ -0,0 +1,81 @@
+import pytest
+import tilepack
+
+
+def _write_tile(source_dir, z, x, y, data):
+    path = source_dir / str(z) / str(x)
+    path.mkdir(parents=True, exist_ok=True)
+    (path / f'{y}.png').write_bytes(data)
+
+
+def test_lonlat_to_tile():
+    assert tilepack.lonlat_to_tile(0.0, 0.0, 0) == (0, 0)
+    assert tilepack.lonlat_to_tile(10.0, 10.0, 1) == (1, 0)
+    assert tilepack.lonlat_to_tile(-10.0, -10.0, 1) == (0, 1)
+    # Clamped to the grid at the poles and the antimeridian
+    assert tilepack.lonlat_to_tile(90.0, 180.0, 3) == (7, 0)
+
+
+def test_region_tiles_matches_count():
+    tiles = list(tilepack.region_tiles(30.04, 31.24, 5, 10, 13))
+    assert len(tiles) == tilepack.count_region_tiles(30.04, 31.24, 5, 10, 13)
+    assert {z for z, _, _ in tiles} == {10, 11, 12, 13}
+
+
+def test_build_pack_and_read_tiles(tmp_path):
+    source = tmp_path / 'tiles'
+    _write_tile(source, 3, 4, 2, b'land')
+    _write_tile(source, 3, 4, 3, b'sea')
+    _write_tile(source, 4, 8, 5, b'sea')
+    pack_path = tmp_path / 'pack.ectp'
+
+    written = tilepack.build_pack(str(source), str(pack_path), [(3, 4, 2), (3, 4, 3), (4, 8, 5), (4, 9, 9)])
+
+    assert written == 3
+    pack = tilepack.TilePack(str(pack_path))
+    try:
+        assert (pack.min_zoom, pack.max_zoom, pack.count) == (3, 4, 3)
+        assert pack.mimetype == 'image/png'
+        assert pack.get(3, 4, 2) == b'land'
+        assert pack.get(4, 8, 5) == b'sea'
+        assert pack.get(4, 9, 9) is None
+        assert pack.get(30, 0, 0) is None
+    finally:
+        pack.close()
+    # The two identical "sea" tiles share one blob
+    index_end = tilepack.HEADER.size + 3 * tilepack.ENTRY.size
+    assert pack_path.stat().st_size == index_end + len(b'land') + len(b'sea')
+    assert not list(tmp_path.glob('*.tmp'))
+
+
+def test_empty_pack(tmp_path):
+    pack_path = tmp_path / 'empty.ectp'
+    assert tilepack.build_pack(str(tmp_path), str(pack_path), [(1, 0, 0)]) == 0
+    pack = tilepack.TilePack(str(pack_path))
+    assert pack.get(1, 0, 0) is None
+    pack.close()
+
+
+def test_rejects_other_files(tmp_path):
+    path = tmp_path / 'bogus.ectp'
+    path.write_bytes(b'\0' * 64)
+    with pytest.raises(ValueError):
+        tilepack.TilePack(str(path))
+
+
+def test_pack_cache_reuses_and_evicts(tmp_path):
+    paths = []
+    for name in ('a', 'b', 'c'):
+        path = tmp_path / f'{name}.ectp'
+        tilepack.build_pack(str(tmp_path), str(path), [])
+        paths.append(str(path))
+    cache = tilepack.PackCache(max_open=2)
+
+    first = cache.open(paths[0])
+    assert cache.open(paths[0]) is first
+    cache.open(paths[1])
+    cache.open(paths[2])
+    assert cache.open(paths[0]) is not first
+
+    cache.discard(paths[0])
+    assert cache.open(paths[0]) is not first
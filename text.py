@@ -0,0 +1,32 @@
+import re
+import unicodedata
+
+# Harakat, Quranic annotation marks and the superscript alef
+_DIACRITICS = re.compile('[\u0610-\u061a\u064b-\u065f\u0670\u06d6-\u06ed]')
+_TATWEEL = '\u0640'
+_LETTER_FORMS = str.maketrans({
+    '\u0623': '\u0627', '\u0625': '\u0627', '\u0622': '\u0627', '\u0671': '\u0627',  # أ إ آ ٱ -> ا
+    '\u0649': '\u064a',  # ى -> ي
+    '\u0629': '\u0647',  # ة -> ه
+    '\u0624': '\u0648', '\u0626': '\u064a',  # ؤ -> و, ئ -> ي
+    '\u0621': None,  # standalone ء
+})
+_WHITESPACE = re.compile(r'\s+')
+
+
+def normalize_arabic(text):
+    """Fold Arabic spelling variants so equivalent strings compare equal.
+
+    Strips diacritics and tatweel, unifies alef/yaa/taa-marbuta/hamza forms,
+    case-folds Latin text and collapses whitespace.
+    """
+    text = unicodedata.normalize('NFKC', text or '')
+    text = _DIACRITICS.sub('', text).replace(_TATWEEL, '')
+    text = text.translate(_LETTER_FORMS).casefold()
+    return _WHITESPACE.sub(' ', text).strip()
+
+
+def normalize_query(text):
+    """normalize_arabic() with punctuation removed, for matching questions and search terms."""
+    text = ''.join(' ' if unicodedata.category(ch).startswith('P') else ch for ch in normalize_arabic(text))
+    return _WHITESPACE.sub(' ', text).strip()
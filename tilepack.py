@@ -0,0 +1,179 @@
+"""Single-file offline map packs: a sorted tile index followed by tile blobs.
+
+Layout (little-endian):
+
+    header   magic "ECTP", version u8, min_zoom u8, max_zoom u8, pad, format 4s, tile count u32
+    index    count x (key u64, offset u64, length u32), sorted by key = z << 48 | x << 24 | y
+    blobs    tile data; identical tiles (open sea, empty land) are stored once
+
+Packs are read through mmap, so a tile lookup is a binary search over the
+index pages the OS already has cached and a slice of the blob.
+"""
+import hashlib
+import math
+import mmap
+import os
+import struct
+import threading
+from collections import OrderedDict
+
+MAGIC = b'ECTP'
+VERSION = 1
+MAX_ZOOM = 24
+HEADER = struct.Struct('<4sBBBx4sI')
+ENTRY = struct.Struct('<QQI')
+_KEY = struct.Struct('<Q')
+_KM_PER_DEGREE = 111.32
+
+MIMETYPES = {
+    'png': 'image/png',
+    'jpg': 'image/jpeg',
+    'webp': 'image/webp',
+    'pbf': 'application/x-protobuf',
+}
+
+
+def tile_key(z, x, y):
+    return (z << 48) | (x << 24) | y
+
+
+def lonlat_to_tile(latitude, longitude, zoom):
+    """Slippy-map (XYZ) tile containing the point at ``zoom``."""
+    n = 2 ** zoom
+    latitude = max(-85.0511, min(85.0511, latitude))
+    x = int((longitude + 180.0) / 360.0 * n)
+    y = int((1.0 - math.asinh(math.tan(math.radians(latitude))) / math.pi) / 2.0 * n)
+    return min(max(x, 0), n - 1), min(max(y, 0), n - 1)
+
+
+def _tile_bounds(latitude, longitude, radius_km, zoom):
+    dlat = radius_km / _KM_PER_DEGREE
+    dlon = radius_km / (_KM_PER_DEGREE * max(math.cos(math.radians(latitude)), 1e-6))
+    x_min, y_min = lonlat_to_tile(latitude + dlat, max(-180.0, longitude - dlon), zoom)
+    x_max, y_max = lonlat_to_tile(latitude - dlat, min(180.0, longitude + dlon), zoom)
+    return x_min, x_max, y_min, y_max
+
+
+def count_region_tiles(latitude, longitude, radius_km, min_zoom, max_zoom):
+    total = 0
+    for zoom in range(min_zoom, max_zoom + 1):
+        x_min, x_max, y_min, y_max = _tile_bounds(latitude, longitude, radius_km, zoom)
+        total += (x_max - x_min + 1) * (y_max - y_min + 1)
+    return total
+
+
+def region_tiles(latitude, longitude, radius_km, min_zoom, max_zoom):
+    """Yield (z, x, y) for every tile overlapping the region's bounding box."""
+    for zoom in range(min_zoom, max_zoom + 1):
+        x_min, x_max, y_min, y_max = _tile_bounds(latitude, longitude, radius_km, zoom)
+        for x in range(x_min, x_max + 1):
+            for y in range(y_min, y_max + 1):
+                yield zoom, x, y
+
+
+def build_pack(source_dir, path, tiles, tile_format='png'):
+    """Write the tiles found under ``source_dir/{z}/{x}/{y}.{format}`` into a pack at ``path``.
+
+    Missing source tiles are skipped. The pack is written to a temporary file
+    and moved into place, so readers never see a partial pack. Returns the
+    number of tiles stored.
+    """
+    found = []
+    min_zoom, max_zoom = MAX_ZOOM, 0
+    for z, x, y in tiles:
+        source = os.path.join(source_dir, str(z), str(x), f'{y}.{tile_format}')
+        if os.path.exists(source):
+            found.append((tile_key(z, x, y), source))
+            min_zoom, max_zoom = min(min_zoom, z), max(max_zoom, z)
+    found.sort()
+    if not found:
+        min_zoom = max_zoom = 0
+
+    # Unique per thread too: job worker threads in one process may build the same pack
+    temp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+    offset = HEADER.size + ENTRY.size * len(found)
+    index = []
+    stored = {}
+    with open(temp_path, 'wb') as out:
+        out.write(HEADER.pack(MAGIC, VERSION, min_zoom, max_zoom, tile_format.encode(), len(found)))
+        out.seek(offset)
+        for key, source in found:
+            with open(source, 'rb') as tile_file:
+                blob = tile_file.read()
+            digest = hashlib.sha1(blob).digest()
+            if digest not in stored:
+                out.write(blob)
+                stored[digest] = (offset, len(blob))
+                offset += len(blob)
+            index.append((key,) + stored[digest])
+        out.seek(HEADER.size)
+        out.write(b''.join(ENTRY.pack(*entry) for entry in index))
+    os.replace(temp_path, path)
+    return len(found)
+
+
+class TilePack:
+    """Read-only, memory-mapped view of a pack file."""
+
+    def __init__(self, path):
+        with open(path, 'rb') as pack_file:
+            self._map = mmap.mmap(pack_file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, self.min_zoom, self.max_zoom, tile_format, self.count = HEADER.unpack_from(self._map, 0)
+        if magic != MAGIC or version != VERSION:
+            self._map.close()
+            raise ValueError(f'{path} is not a version {VERSION} tile pack')
+        self.format = tile_format.rstrip(b'\0').decode()
+        self.mimetype = MIMETYPES.get(self.format, 'application/octet-stream')
+
+    def get(self, z, x, y):
+        """Return the tile's bytes, or None if the pack doesn't contain it."""
+        if not 0 <= z <= MAX_ZOOM:
+            return None
+        key = tile_key(z, x, y)
+        low, high = 0, self.count
+        while low < high:
+            middle = (low + high) // 2
+            if _KEY.unpack_from(self._map, HEADER.size + middle * ENTRY.size)[0] < key:
+                low = middle + 1
+            else:
+                high = middle
+        if low == self.count:
+            return None
+        found, offset, length = ENTRY.unpack_from(self._map, HEADER.size + low * ENTRY.size)
+        if found != key:
+            return None
+        return self._map[offset:offset + length]
+
+    def close(self):
+        self._map.close()
+
+
+class PackCache:
+    """Keeps the most recently used packs mapped, keyed by path.
+
+    Packs that fall out of the cache are not closed explicitly; the mapping
+    goes away once no request is still reading from it.
+    """
+
+    def __init__(self, max_open=32):
+        self.max_open = max_open
+        self._lock = threading.Lock()
+        self._packs = OrderedDict()
+
+    def open(self, path):
+        with self._lock:
+            pack = self._packs.get(path)
+            if pack is not None:
+                self._packs.move_to_end(path)
+                return pack
+        pack = TilePack(path)
+        with self._lock:
+            self._packs[path] = pack
+            self._packs.move_to_end(path)
+            while len(self._packs) > self.max_open:
+                self._packs.popitem(last=False)
+        return pack
+
+    def discard(self, path):
+        with self._lock:
+            self._packs.pop(path, None)
@@ -0,0 +1,120 @@
+"""Local stand-in for the OpenAI chat completions API.
+
+Point the app at it with OPENAI_BASE_URL=http://127.0.0.1:8099/v1 (any
+OPENAI_API_KEY value works) to exercise the LLM gateway without network
+access, e.g. to watch the circuit breaker open under --failure-rate.
+
+    python tools/fake_openai.py --port 8099 --latency 0.5 --failure-rate 0.2
+
+Requests with "stream": true are answered word by word as SSE chunks, with
+--token-latency seconds between them.
+"""
+import argparse
+import json
+import random
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class CompletionHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    latency = 0.0
+    token_latency = 0.0
+    failure_rate = 0.0
+    reply = 'هذه إجابة تجريبية من الخادم المحلي.'
+
+    def do_POST(self):
+        if not self.path.rstrip('/').endswith('/chat/completions'):
+            self.send_error(404)
+            return
+        length = int(self.headers.get('Content-Length', 0))
+        body = json.loads(self.rfile.read(length) or b'{}')
+
+        time.sleep(self.latency)
+        if random.random() < self.failure_rate:
+            self._send_json(500, {'error': {'message': 'Injected failure', 'type': 'server_error'}})
+            return
+
+        if body.get('stream'):
+            self._send_stream(body.get('model', 'fake'))
+            return
+
+        self._send_json(200, {
+            'id': f'chatcmpl-{uuid.uuid4().hex}',
+            'object': 'chat.completion',
+            'created': int(time.time()),
+            'model': body.get('model', 'fake'),
+            'choices': [{
+                'index': 0,
+                'message': {'role': 'assistant', 'content': self.reply},
+                'finish_reason': 'stop'
+            }],
+            'usage': {'prompt_tokens': 0, 'completion_tokens': 0, 'total_tokens': 0}
+        })
+
+    def _send_stream(self, model):
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+        completion_id = f'chatcmpl-{uuid.uuid4().hex}'
+        words = self.reply.split(' ')
+        for i, word in enumerate(words):
+            self._send_chunk(completion_id, model, {'content': word if i == 0 else f' {word}'}, None)
+            time.sleep(self.token_latency)
+        self._send_chunk(completion_id, model, {}, 'stop')
+        self._write_chunk(b'data: [DONE]\n\n')
+        self._write_chunk(b'')
+
+    def _send_chunk(self, completion_id, model, delta, finish_reason):
+        payload = {
+            'id': completion_id,
+            'object': 'chat.completion.chunk',
+            'created': int(time.time()),
+            'model': model,
+            'choices': [{'index': 0, 'delta': delta, 'finish_reason': finish_reason}]
+        }
+        self._write_chunk(f'data: {json.dumps(payload)}\n\n'.encode())
+
+    def _write_chunk(self, data):
+        self.wfile.write(f'{len(data):x}\r\n'.encode() + data + b'\r\n')
+        self.wfile.flush()
+
+    def _send_json(self, status, payload):
+        data = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def make_server(host='127.0.0.1', port=8099, latency=0.0, failure_rate=0.0, token_latency=0.0):
+    handler = type('Handler', (CompletionHandler,), {
+        'latency': latency,
+        'failure_rate': failure_rate,
+        'token_latency': token_latency
+    })
+    return ThreadingHTTPServer((host, port), handler)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8099)
+    parser.add_argument('--latency', type=float, default=0.0, help='Seconds to wait before answering.')
+    parser.add_argument('--failure-rate', type=float, default=0.0, help='Fraction of requests answered with HTTP 500.')
+    parser.add_argument('--token-latency', type=float, default=0.05, help='Seconds between streamed tokens.')
+    args = parser.parse_args()
+
+    server = make_server(args.host, args.port, args.latency, args.failure_rate, args.token_latency)
+    print(f'Fake completion server on http://{args.host}:{args.port}/v1')
+    server.serve_forever()
+
+
+if __name__ == '__main__':
+    main()
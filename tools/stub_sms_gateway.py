@@ -0,0 +1,94 @@
+"""Local stand-in for an SMS gateway, for exercising emergency-contact delivery.
+
+Point the app at it with SMS_GATEWAY_URL=http://127.0.0.1:8098/messages.
+Delivered messages are printed and listed by GET /messages; a repeated
+Idempotency-Key is acknowledged without being delivered again.
+
+    python tools/stub_sms_gateway.py --port 8098 --latency 0.2 --failure-rate 0.3
+"""
+import argparse
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class GatewayHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    latency = 0.0
+    failure_rate = 0.0
+    verbose = False
+    messages = None
+    seen_keys = None
+    lock = None
+
+    def do_POST(self):
+        if self.path.rstrip('/') != '/messages':
+            self.send_error(404)
+            return
+        length = int(self.headers.get('Content-Length', 0))
+        body = json.loads(self.rfile.read(length) or b'{}')
+
+        time.sleep(self.latency)
+        if random.random() < self.failure_rate:
+            self._send_json(503, {'error': 'Injected failure'})
+            return
+
+        key = self.headers.get('Idempotency-Key')
+        with self.lock:
+            duplicate = key is not None and key in self.seen_keys
+            if not duplicate:
+                if key is not None:
+                    self.seen_keys.add(key)
+                self.messages.append({'to': body.get('to'), 'text': body.get('text'), 'received_at': time.time()})
+        if self.verbose and not duplicate:
+            print(f"SMS to {body.get('to')}: {body.get('text')}")
+        self._send_json(200, {'status': 'duplicate' if duplicate else 'queued'})
+
+    def do_GET(self):
+        if self.path.rstrip('/') != '/messages':
+            self.send_error(404)
+            return
+        with self.lock:
+            self._send_json(200, {'messages': list(self.messages)})
+
+    def _send_json(self, status, payload):
+        data = json.dumps(payload, ensure_ascii=False).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def make_server(host='127.0.0.1', port=8098, latency=0.0, failure_rate=0.0, verbose=False):
+    handler = type('Handler', (GatewayHandler,), {
+        'latency': latency,
+        'failure_rate': failure_rate,
+        'verbose': verbose,
+        'messages': [],
+        'seen_keys': set(),
+        'lock': threading.Lock()
+    })
+    return ThreadingHTTPServer((host, port), handler)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8098)
+    parser.add_argument('--latency', type=float, default=0.0, help='Seconds to wait before answering.')
+    parser.add_argument('--failure-rate', type=float, default=0.0, help='Fraction of requests answered with HTTP 503.')
+    args = parser.parse_args()
+
+    server = make_server(args.host, args.port, args.latency, args.failure_rate, verbose=True)
+    print(f'Stub SMS gateway on http://{args.host}:{args.port}/messages')
+    server.serve_forever()
+
+
+if __name__ == '__main__':
+    main()